@@ -4,10 +4,20 @@ import config
 from handlers.command_handlers import register_command_handlers
 from handlers.callback_handlers import register_callback_handlers
 from handlers.message_handlers import register_message_handlers
+from handlers.inline_handlers import register_inline_handlers
+import asyncio
+import atexit
+import signal
 import time
 import requests
 import logging
-from utils.data_manager import load_data, save_data
+from utils.data_manager import init_data_store, flush_autocommits, recover_autocommits
+from utils.workers import UpdateWorkerPool, install_data_sessions
+from utils.webhook import WebhookServer
+from utils.jobs import init_jobs
+from utils.markup_edits import init_markup_editor
+from utils.search import init_search_index, get_search_index
+from utils.outbound import install_outbound_limiter, install_async_outbound_limiter
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,13 +31,41 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+def init_storage():
+    try:
+        store = init_data_store()
+        store.flush()  # Обновляем файл данных
+        store.start()  # Фоновый сброс изменений на диск
+        atexit.register(store.close)
+        init_search_index(store.data, config.SEARCH_INDEX_FILE)
+        # Отложенные автокоммиты, потерянные при аварийной остановке
+        recover_autocommits(store.data)
+        # SIGTERM превращаем в обычный выход, чтобы сработал финальный сброс
+        signal.signal(signal.SIGTERM, lambda signum, frame: exit(0))
+        logger.info("Данные загружены в память и инициализированы.")
+        return store
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации данных: {e}")
+        return None
+
 def start_bot():
-    bot = telebot.TeleBot(config.BOT_TOKEN)
+    if config.OUTBOUND_LIMITS:
+        install_outbound_limiter()
+    workers = None
+    if config.WORKER_THREADS > 0:
+        # Обработчики выполняются в нашем пуле, поэтому внутри telebot — синхронно
+        bot = telebot.TeleBot(config.BOT_TOKEN, threaded=False)
+        workers = UpdateWorkerPool(config.WORKER_THREADS, max_pending=config.UPDATE_QUEUE_SIZE)
+        workers.install(bot)
+    else:
+        bot = telebot.TeleBot(config.BOT_TOKEN)
+        install_data_sessions(bot)
 
     # Регистрация обработчиков
     register_command_handlers(bot)
     register_callback_handlers(bot)
     register_message_handlers(bot)
+    register_inline_handlers(bot)
 
     # Проверка доступа к чату для хранения данных
     try:
@@ -38,14 +76,30 @@ def start_bot():
         return
 
     # Инициализация данных
-    try:
-        data = load_data()
-        save_data(data)  # Обновляем файл данных
-        logger.info("Данные инициализированы.")
-    except Exception as e:
-        logger.error(f"Ошибка при инициализации данных: {e}")
+    store = init_storage()
+    jobs = init_jobs(bot)
+    jobs.resume()
+    editor = init_markup_editor(bot)
 
     # Запуск бота с обработкой возможных исключений
+    try:
+        if config.UPDATE_MODE == "webhook":
+            run_webhook(bot, workers)
+        else:
+            run_polling(bot)
+    finally:
+        # Дожидаемся уже принятых обновлений и сбрасываем накопленные изменения
+        if workers is not None:
+            workers.shutdown()
+        jobs.shutdown()
+        editor.shutdown()
+        flush_autocommits()
+        if store is not None:
+            store.close()
+        if get_search_index() is not None:
+            get_search_index().close()
+
+def run_polling(bot):
     while True:
         try:
             logger.info("Бот запущен и ожидает обновлений...")
@@ -57,5 +111,88 @@ def start_bot():
             logger.error(f"Произошла ошибка: {e}")
             time.sleep(5)
 
+def run_webhook(bot, workers):
+    if workers is not None:
+        # Если очередь заполнена дольше таймаута, Telegram получит 503 и повторит доставку
+        accept_update = lambda update: workers.submit(update, timeout=config.WEBHOOK_ENQUEUE_TIMEOUT)
+        health = workers.stats
+    else:
+        def accept_update(update):
+            bot.process_new_updates([update])
+            return True
+        health = None
+
+    server = WebhookServer(config.WEBHOOK_HOST, config.WEBHOOK_PORT, config.WEBHOOK_PATH, accept_update,
+                           secret_token=config.WEBHOOK_SECRET or None, health=health)
+    if config.WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+                        secret_token=config.WEBHOOK_SECRET or None,
+                        max_connections=max(config.WORKER_THREADS, 1) * 5)
+        logger.info(f"Вебхук зарегистрирован: {config.WEBHOOK_URL}")
+    logger.info(f"Бот запущен в режиме вебхука на {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+    try:
+        server.serve_forever()
+    finally:
+        server.shutdown()
+
+async def start_bot_async():
+    # Асинхронный режим требует aiohttp, поэтому импортируется только здесь
+    from telebot.async_telebot import AsyncTeleBot
+    from handlers.async_command_handlers import register_async_command_handlers
+    from handlers.async_callback_handlers import register_async_callback_handlers
+    from handlers.async_message_handlers import register_async_message_handlers
+    from handlers.async_inline_handlers import register_async_inline_handlers
+    from utils.async_runtime import shutdown_storage_executor
+
+    if config.OUTBOUND_LIMITS:
+        install_async_outbound_limiter()
+    bot = AsyncTeleBot(config.BOT_TOKEN)
+
+    # Регистрация обработчиков. Обработчики кнопок регистрируются первыми:
+    # ожидаемый после нажатия кнопки ввод должен перехватываться раньше команд
+    register_async_callback_handlers(bot)
+    register_async_command_handlers(bot)
+    register_async_message_handlers(bot)
+    register_async_inline_handlers(bot)
+
+    store = None
+    jobs = None
+    editor = None
+    try:
+        # Проверка доступа к чату для хранения данных
+        try:
+            chat = await bot.get_chat(config.DATA_CHAT_ID)
+            logger.info(f"Доступ к чату для хранения данных подтвержден: {chat.title}")
+        except Exception as e:
+            logger.error(f"Не удалось получить доступ к чату для хранения данных: {e}")
+            return
+
+        # Инициализация данных; signal.signal() допустим только в главном потоке,
+        # поэтому разовое чтение при запуске выполняется прямо в цикле событий
+        store = init_storage()
+        jobs = init_jobs(bot, async_runtime=True)
+        jobs.resume()
+        editor = init_markup_editor(bot, async_runtime=True)
+
+        logger.info("Бот запущен (asyncio) и ожидает обновлений...")
+        await bot.infinity_polling(timeout=60, request_timeout=90)
+    finally:
+        if jobs is not None:
+            await jobs.shutdown()
+        if editor is not None:
+            await editor.shutdown()
+        await bot.close_session()
+        # Дожидаемся начатых операций с данными и сбрасываем накопленные изменения
+        shutdown_storage_executor()
+        flush_autocommits()
+        if store is not None:
+            store.close()
+        if get_search_index() is not None:
+            get_search_index().close()
+
 if __name__ == "__main__":
-    start_bot()
+    if config.ASYNC_RUNTIME:
+        asyncio.run(start_bot_async())
+    else:
+        start_bot()
@@ -2,4 +2,79 @@
 BOT_TOKEN = "TOKEN"
 DATA_CHAT_ID = -100IDCHAT  # ID чата для хранения данных
 
-DATA_FILE = 'data.json'  # Имя файла для хранения данных
\ No newline at end of file
+DATA_FILE = 'data.json'  # Имя файла для хранения данных
+
+# Хранилище данных: "json" — один файл DATA_FILE,
+# "sharded" — отдельный файл на пользователя и проект в каталоге DATA_DIR,
+# "sqlite" — база SQLite в файле SQLITE_PATH
+# (при первом запуске данные из DATA_FILE переносятся автоматически)
+STORAGE_BACKEND = "json"
+DATA_DIR = 'data'
+SQLITE_PATH = 'data.sqlite3'
+
+# Отложенная запись данных на диск
+FLUSH_INTERVAL = 1.0  # Максимальный интервал между сбросами (сек)
+FLUSH_MAX_PENDING = 50  # Сбросить сразу после стольких изменений
+
+# Обработка обновлений: число рабочих потоков. Обновления разных пользователей
+# обрабатываются параллельно, одного пользователя и одного проекта — по очереди.
+# 0 — встроенная многопоточность telebot без блокировок
+WORKER_THREADS = 8
+UPDATE_QUEUE_SIZE = 1000  # Сколько принятых обновлений может ждать обработки
+
+# Получение обновлений: "polling" (long polling) или "webhook" (локальный HTTP-сервер).
+# В режиме webhook GET /health возвращает состояние очереди
+UPDATE_MODE = "polling"
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_URL = ""  # Публичный адрес, например https://example.com; пусто — не регистрировать вебхук в Telegram
+WEBHOOK_SECRET = ""  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_ENQUEUE_TIMEOUT = 2.0  # Сколько ждать места в очереди перед ответом 503 (сек)
+
+# Ограничение исходящих запросов к Telegram (ответы 429 и сетевые ошибки повторяются)
+OUTBOUND_LIMITS = True
+OUTBOUND_GLOBAL_RATE = 25  # Запросов в секунду на бота
+OUTBOUND_CHAT_RATE = 1.0  # Сообщений в секунду в личный чат
+OUTBOUND_CHAT_BURST = 3  # Сколько сообщений в чат можно отправить подряд без паузы
+OUTBOUND_GROUP_RATE = 20 / 60  # Сообщений в секунду в группу
+OUTBOUND_MAX_RETRIES = 5
+
+# Автокоммиты при загрузке файлов в Git-проект (режим меняется командой /autocommit):
+# "immediate" — коммит на каждый файл, "debounced" — один коммит на серию загрузок,
+# когда AUTOCOMMIT_DELAY секунд не было новых, "manual" — только по /commit
+AUTOCOMMIT_MODE = "debounced"
+AUTOCOMMIT_DELAY = 10.0
+AUTOCOMMIT_MAX_DELAY = 60.0  # Серия загрузок коммитится не позже чем через столько секунд
+
+# Фоновые задачи (выдача больших папок): состояние хранится в JOBS_FILE, параметры —
+# в каталоге <JOBS_FILE без расширения>_params; незавершённые задачи продолжаются после перезапуска
+JOBS_FILE = 'jobs.json'
+JOB_THREADS = 2  # Сколько задач выполняется одновременно
+
+# Листание папок: элементов на странице по умолчанию и наибольшее значение,
+# которое пользователь может выбрать командой /pagesize
+FOLDER_PAGE_SIZE = 5
+MAX_FOLDER_PAGE_SIZE = 50
+
+# Кнопки: длинные аргументы callback_data (имена папок, проектов и веток,
+# не влезающие в 64 байта) хранятся на сервере, не больше CALLBACK_TOKENS штук
+CALLBACK_TOKENS = 100000
+
+# Поиск (/find): журнал инвертированного индекса по именам и текстам файлов.
+# Если файла нет, индекс строится по данным при запуске
+SEARCH_INDEX_FILE = 'search_index.jsonl'
+
+# Inline-режим (@бот запрос, включается у @BotFather командой /setinline):
+# ответы на одинаковые запросы пользователя запоминаются на INLINE_CACHE_TTL секунд
+INLINE_CACHE_TTL = 10
+INLINE_CACHE_ENTRIES = 1000
+
+# Экспорт папок в ZIP (/export): готовые архивы кэшируются по хешу содержимого
+EXPORT_CACHE_DIR = 'export_cache'
+EXPORT_CACHE_ENTRIES = 20  # Сколько архивов хранить
+
+# Асинхронный режим (AsyncTeleBot, нужен aiohttp): запросы к Telegram не занимают
+# потоки, а работа с данными выполняется в пуле из STORAGE_THREADS потоков
+ASYNC_RUNTIME = False
+STORAGE_THREADS = 4
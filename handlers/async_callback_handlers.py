@@ -0,0 +1,434 @@
+# handlers/async_callback_handlers.py
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import CallbackQuery, Message
+from utils.data_manager import (
+    load_data,
+    save_data,
+    init_user,
+    create_branch,
+    switch_branch,
+    get_current_branch_structure,
+    rollback_to_commit,
+    get_branch_commits,
+    format_commit,
+    find_file,
+    search_files,
+    format_search_results,
+    jump_to_file,
+    user_page_size
+)
+from utils.navigation import navigate_to_path
+from utils.keyboards import generate_markup, generate_branch_markup, generate_search_markup
+from utils.callbacks import decode
+from utils.search import PAGE_SIZE
+from utils.locks import project_lock
+from utils.jobs import get_jobs
+from utils.markup_edits import get_markup_editor, remember_markup
+from utils.export import locate_export
+from utils.retrieval import caption_kwargs
+from utils.async_runtime import run_storage, per_user, expect_input, has_pending_input, pop_pending_input
+from handlers.async_command_handlers import invite_collaborator
+from handlers.callback_handlers import current_folder_markup
+import copy
+import logging
+from config import DATA_CHAT_ID
+
+logger = logging.getLogger(__name__)
+
+# Асинхронные версии обработчиков из callback_handlers.py
+
+
+def shared_folder(data, shared_key):
+    """(владелец, путь, папка) общей папки или строка с ошибкой."""
+    shared = data.get("shared_folders", {}).get(shared_key)
+    if not shared:
+        return "Неверный или несуществующий ключ доступа."
+    owner_id = shared["user_id"]
+    path = shared["path"]
+    try:
+        return owner_id, path, navigate_to_path(data["users"][owner_id]["structure"], path)
+    except KeyError:
+        return "Папка не найдена."
+
+
+def register_async_callback_handlers(bot: AsyncTeleBot):
+    # Регистрируется раньше команд: ожидаемый ввод перехватывает любое сообщение,
+    # как register_next_step_handler в синхронной версии
+    @bot.message_handler(func=has_pending_input, content_types=['text', 'photo', 'document', 'video', 'audio'])
+    @per_user
+    async def handle_pending_input(message: Message):
+        callback = pop_pending_input(message.chat.id)
+        if callback is not None:
+            await callback(message)
+
+    # Обработчики кнопок: (нажатие, действие, аргументы кнопки). Кнопка разбирается
+    # utils.callbacks.decode(), обработчик выбирается по словарю ACTION_HANDLERS
+
+    async def answer(call, text=None):
+        await bot.answer_callback_query(call.id, text)
+
+    def refresh_markup(call, markup):
+        # Правка уходит отдельной задачей; совпадающая с показанной клавиатура не отправляется
+        get_markup_editor().submit(call.message.chat.id, call.message.message_id, markup)
+
+    async def on_navigate(call, action, folder_name=None):
+        user_id = str(call.message.chat.id)
+        username = call.from_user.username
+
+        def navigate():
+            # Возвращает (текст ответа, клавиатура или None)
+            data = load_data()
+            changed = init_user(data, user_id, username=username)
+            current_path = data["users"][user_id]["current_path"]
+            if action == "exit_project":
+                current_path.pop()
+                text = "Вы вышли из Git-проекта."
+            elif action == "up":
+                if not current_path:
+                    if changed:
+                        save_data(data)
+                    return "Вы уже в корневой папке.", current_folder_markup(data, user_id)
+                text = f"Вернулись из папки '{current_path.pop()}'."
+            else:
+                if current_path and current_path[-1].endswith('.git'):
+                    project_name = current_path[-1]
+                    branch_structure = get_current_branch_structure(data, user_id, project_name)
+                    current = navigate_to_path(branch_structure, current_path[current_path.index(project_name)+1:])
+                else:
+                    current = navigate_to_path(data["users"][user_id]["structure"], current_path)
+                if folder_name not in current["folders"]:
+                    if changed:
+                        save_data(data)
+                    return "Папка не найдена.", current_folder_markup(data, user_id)
+                current_path.append(folder_name)
+                text = f"Перешли в папку '{folder_name}'."
+            save_data(data)
+            return text, current_folder_markup(data, user_id)
+
+        text, markup = await run_storage(navigate)
+        await answer(call, text)
+        if action == "exit_project":
+            await bot.send_message(call.message.chat.id, text)
+        refresh_markup(call, markup)
+
+    async def on_search(call, action, argument):
+        user_id = str(call.message.chat.id)
+        username = call.from_user.username
+
+        def apply_search():
+            # Возвращает (ошибка, текст, клавиатура)
+            data = load_data()
+            init_user(data, user_id, username=username)
+            if action == "find_go":
+                error = jump_to_file(data, user_id, argument)
+                if error:
+                    return error, None, None
+                save_data(data)
+                text = "Папка файла: /" + "/".join(data["users"][user_id]["current_path"])
+                return None, text, current_folder_markup(data, user_id)
+            query = data["users"][user_id].get("last_search")
+            if not query:
+                return "Повторите поиск командой /find.", None, None
+            total, page, results = search_files(data, user_id, query, argument)
+            return None, format_search_results(query, total, page, results), \
+                generate_search_markup(results, page, total, PAGE_SIZE)
+
+        error, text, markup = await run_storage(apply_search)
+        if error:
+            await answer(call, error)
+            return
+        if action == "find_go":
+            await answer(call, "Перешли в папку файла.")
+            remember_markup(await bot.send_message(call.message.chat.id, text, reply_markup=markup), markup)
+            return
+        try:
+            await bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                        reply_markup=markup)
+            remember_markup(call.message, markup)
+            await answer(call)
+        except ApiTelegramException as e:
+            logger.error(f"Ошибка при обновлении результатов поиска: {e}")
+            await answer(call, "Ошибка при обновлении результатов поиска.")
+
+    async def on_job_cancel(call, action, job_id):
+        if get_jobs().cancel(job_id, call.message.chat.id):
+            await answer(call, "Задача будет остановлена.")
+        else:
+            await answer(call, "Задача уже завершена.")
+
+    async def on_export(call, action, shared_key=None):
+        user_id = str(call.message.chat.id)
+        username = call.from_user.username
+
+        def locate():
+            data = load_data()
+            if init_user(data, user_id, username=username):
+                save_data(data)
+            error, folder, name = locate_export(data, user_id, shared_key)
+            return error, copy.deepcopy(folder), name
+
+        error, folder, name = await run_storage(locate)
+        if error:
+            await answer(call, error)
+        elif await get_jobs().submit("export", call.message.chat.id, {"tree": folder, "name": name}) is None:
+            await answer(call, "Дождитесь завершения предыдущих задач.")
+        else:
+            await answer(call, f"Собираю архив «{name}»...")
+
+    async def on_page(call, action, *args):
+        user_id = str(call.message.chat.id)
+        username = call.from_user.username
+
+        def render_page():
+            data = load_data()
+            if init_user(data, user_id, username=username):
+                save_data(data)
+            if action == "page":
+                return None, current_folder_markup(data, user_id, start=args[0])
+            shared_key, start = args
+            found = shared_folder(data, shared_key)
+            if isinstance(found, str):
+                return found, None
+            _, path, current = found
+            return None, generate_markup(current, path, shared_key=shared_key, start=start,
+                                         items_per_page=user_page_size(data, user_id))
+
+        error, markup = await run_storage(render_page)
+        if error:
+            await answer(call, error)
+            return
+        refresh_markup(call, markup)
+        await answer(call)
+
+    async def on_files(call, action, argument=None):
+        user_id = str(call.message.chat.id)
+        username = call.from_user.username
+
+        def collect_files():
+            # Возвращает (ошибка, список файлов, клавиатура для обновления)
+            data = load_data()
+            if init_user(data, user_id, username=username):
+                save_data(data)
+            current_path = data["users"][user_id]["current_path"]
+            in_project = current_path and current_path[-1].endswith('.git')
+            if action == "shared_retrieve_all":
+                found = shared_folder(data, argument)
+                if isinstance(found, str):
+                    return found, None, None
+                return None, list(found[2]["files"]), None
+            if action == "retrieve_all_project" and not in_project:
+                return "Вы не находитесь в проекте.", None, None
+            if in_project:
+                project_name = current_path[-1]
+                branch_structure = get_current_branch_structure(data, user_id, project_name)
+                project_path = current_path[current_path.index(project_name)+1:]
+                current = navigate_to_path(branch_structure, project_path)
+            else:
+                project_name, project_path = None, current_path
+                current = navigate_to_path(data["users"][user_id]["structure"], current_path)
+            if action == "file":
+                file_info = find_file(data, current, argument, user_id, project_name=project_name, path=project_path)
+                if not file_info:
+                    return "Файл не найден.", None, None
+                return None, [file_info], None
+            return None, list(current["files"]), current_folder_markup(data, user_id)
+
+        error, files, markup = await run_storage(collect_files)
+        if error:
+            await answer(call, error)
+            return
+        if action == "file":
+            await send_file(call, files[0])
+            return
+        await send_all_files(call, files)
+        if markup is not None:
+            refresh_markup(call, markup)
+
+    async def on_project_input(call, action, project_name):
+        user_id = str(call.message.chat.id)
+        if action == "invite_member":
+            def is_owner():
+                data = load_data()
+                return project_name in data["projects"].get(user_id, {})
+
+            if not await run_storage(is_owner):
+                await answer(call, f"У вас нет прав на управление проектом `{project_name}`.")
+                return
+            await bot.send_message(call.message.chat.id, "Введите имя пользователя для приглашения:")
+            expect_input(user_id, lambda m: handle_invite_member(m, project_name))
+        else:
+            await bot.send_message(call.message.chat.id, "Введите название новой ветки:")
+            expect_input(user_id, lambda m: handle_create_branch(m, project_name))
+        await answer(call)
+
+    async def on_switch_branch_project(call, action, project_name):
+        user_id = str(call.message.chat.id)
+
+        def render_branches():
+            data = load_data()
+            if "projects" not in data or project_name not in data["projects"].get(user_id, {}):
+                return None
+            return generate_branch_markup(project_name, data["projects"][user_id][project_name]["branches"])
+
+        markup = await run_storage(render_branches)
+        if markup is None:
+            await answer(call, f"Проект `{project_name}` не найден.")
+            return
+        await bot.edit_message_text("Выберите ветку для переключения:", chat_id=call.message.chat.id,
+                                    message_id=call.message.message_id, reply_markup=markup)
+        await answer(call)
+
+    async def on_project_change(call, action, project_name, argument):
+        user_id = str(call.message.chat.id)
+
+        def apply():
+            data = load_data()
+            if "projects" not in data or project_name not in data["projects"].get(user_id, {}):
+                return False
+            with project_lock(user_id, project_name):
+                if action == "switch_to_branch":
+                    success = switch_branch(data, user_id, project_name, argument)
+                else:
+                    success = rollback_to_commit(data, user_id, project_name, argument)
+                if success:
+                    save_data(data)
+            return success
+
+        success = await run_storage(apply)
+        if action == "switch_to_branch":
+            text = f"Переключились на ветку `{argument}` в проекте `{project_name}`." if success \
+                else f"Ветка `{argument}` не найдена в проекте `{project_name}`."
+        else:
+            text = f"Откатились к коммиту `{argument}` в проекте `{project_name}`." if success \
+                else f"Коммит `{argument}` не найден или откат не удался."
+        await answer(call, text)
+        if success:
+            await bot.send_message(call.message.chat.id, text)
+
+    async def on_log_project(call, action, project_name):
+        user_id = str(call.message.chat.id)
+
+        def render_log():
+            data = load_data()
+            if "projects" not in data or project_name not in data["projects"].get(user_id, {}):
+                return f"Проект `{project_name}` не найден.", None
+            project = data["projects"][user_id][project_name]
+            commits = get_branch_commits(data, user_id, project_name)
+            if not commits:
+                return None, f"В проекте `{project_name}` нет коммитов в ветке `{project['current_branch']}`."
+            log_message = f"История коммитов для `{project_name}` (ветка `{project['current_branch']}`):\n\n"
+            return None, log_message + "".join(format_commit(commit) for commit in commits)
+
+        error, log_message = await run_storage(render_log)
+        if error:
+            await answer(call, error)
+            return
+        await bot.send_message(call.message.chat.id, log_message)
+        await answer(call)
+
+    ACTION_HANDLERS = {
+        "up": on_navigate,
+        "exit_project": on_navigate,
+        "folder": on_navigate,
+        "find_page": on_search,
+        "find_go": on_search,
+        "job_cancel": on_job_cancel,
+        "export": on_export,
+        "shared_export": on_export,
+        "page": on_page,
+        "shared_page": on_page,
+        "retrieve_all": on_files,
+        "retrieve_all_project": on_files,
+        "shared_retrieve_all": on_files,
+        "file": on_files,
+        "invite_member": on_project_input,
+        "create_branch_project": on_project_input,
+        "switch_branch_project": on_switch_branch_project,
+        "switch_to_branch": on_project_change,
+        "rollback_commit": on_project_change,
+        "log_project": on_log_project,
+    }
+
+    @bot.callback_query_handler(func=lambda call: True)
+    @per_user
+    async def handle_callback(call: CallbackQuery):
+        decoded = decode(call.data)
+        if decoded is None:
+            await answer(call, "Кнопка устарела, откройте папку заново.")
+            return
+        action, args = decoded
+        handler = ACTION_HANDLERS.get(action)
+        if handler is None:
+            await answer(call, "Неизвестная команда.")
+            return
+        await handler(call, action, *args)
+
+    async def handle_invite_member(message, project_name):
+        user_id = str(message.chat.id)
+        username = message.from_user.username
+        invitee_username = (message.text or "").strip().lstrip("@")
+        if not invitee_username:
+            await bot.send_message(message.chat.id, "Имя пользователя не может быть пустым.")
+            return
+        reply, invitee_user_id = await run_storage(
+            invite_collaborator, user_id, username, project_name, invitee_username
+        )
+        await bot.send_message(message.chat.id, reply)
+        if invitee_user_id:
+            try:
+                await bot.send_message(invitee_user_id, f"Вас пригласили в проект `{project_name}` пользователя @{username}.")
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомления: {e}")
+
+    async def handle_create_branch(message, project_name):
+        user_id = str(message.chat.id)
+        branch_name = (message.text or "").strip()
+        if not branch_name:
+            await bot.send_message(message.chat.id, "Название ветки не может быть пустым.")
+            return
+
+        def branch():
+            data = load_data()
+            init_user(data, user_id)
+            if "projects" not in data or project_name not in data["projects"].get(user_id, {}):
+                return f"Проект `{project_name}` не найден."
+            with project_lock(user_id, project_name):
+                success = create_branch(data, user_id, project_name, branch_name)
+                if success:
+                    save_data(data)
+            if success:
+                return f"Ветка `{branch_name}` успешно создана и переключились на неё в проекте `{project_name}`."
+            return f"Ветка `{branch_name}` уже существует в проекте `{project_name}`."
+
+        await bot.send_message(message.chat.id, await run_storage(branch))
+
+    async def send_all_files(call, files):
+        if not files:
+            await bot.answer_callback_query(call.id, "В этой папке нет файлов.")
+            return
+        # Выдача идёт фоновой задачей, обработчик кнопки сразу освобождается
+        job_id = await get_jobs().submit("retrieve", call.message.chat.id, {"files": copy.deepcopy(files)})
+        if job_id is None:
+            await bot.answer_callback_query(call.id, "Дождитесь завершения предыдущих выдач.")
+            return
+        await bot.answer_callback_query(call.id, "Отправляю файлы...")
+
+    async def send_file(call, file_info):
+        if file_info["type"] in ["text", "code"]:
+            content = file_info.get("content")
+            if content:
+                await bot.send_message(call.message.chat.id, f"Содержимое файла:\n\n{content}")
+            else:
+                await bot.answer_callback_query(call.id, "Невозможно отобразить содержимое файла.")
+        else:
+            try:
+                await bot.copy_message(
+                    chat_id=call.message.chat.id,
+                    from_chat_id=DATA_CHAT_ID,
+                    message_id=file_info["message_id"],
+                    **caption_kwargs(file_info)
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при копировании файла: {e}")
+                await bot.send_message(call.message.chat.id, f"Ошибка при отправке файла: {str(e)}")
@@ -0,0 +1,648 @@
+# handlers/async_command_handlers.py
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import Message
+from utils.data_manager import (
+    load_data,
+    save_data,
+    init_user,
+    init_project,
+    create_commit,
+    create_branch,
+    merge_branches,
+    get_current_branch_structure,
+    rollback_to_commit,
+    get_branch_commits,
+    format_commit,
+    format_merge_result,
+    get_user_id_by_username,
+    is_project_member,
+    resolve_file,
+    search_files,
+    format_search_results,
+    search_history,
+    get_autocommit_mode,
+    set_autocommit_mode,
+    format_autocommit_mode,
+    user_page_size,
+    set_page_size
+)
+from utils.autocommit import AUTOCOMMIT_MODES
+from utils.navigation import navigate_to_path
+from utils.history import short_commit_id
+from utils.keyboards import generate_markup, generate_main_menu, generate_branch_markup, generate_rollback_markup, generate_search_markup
+from utils.locks import project_lock
+from utils.async_runtime import run_storage, per_user, expect_input
+from utils.export import locate_export
+from utils.importer import import_target, import_request_error
+from utils.jobs import get_jobs
+from utils.markup_edits import remember_markup
+from utils.retrieval import send_single_async
+from utils.search import query_tokens, PAGE_SIZE
+from handlers.command_handlers import HELP_TEXT, parse_find_query, parse_page_size
+import copy
+import uuid
+import logging
+from config import MAX_FOLDER_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Асинхронные версии обработчиков из command_handlers.py. Работа с данными
+# выполняется в пуле run_storage() одной функцией, запросы к Telegram — в цикле событий.
+
+
+def parse_project_args(text, parts):
+    """Разбирает '/команда <название.git> ...'; возвращает список аргументов или None."""
+    args = text.split(maxsplit=parts)[1:]
+    if len(args) != parts:
+        return None
+    return args
+
+
+def register_async_command_handlers(bot: AsyncTeleBot):
+    @bot.message_handler(commands=['start', 'help'])
+    @per_user
+    async def handle_start_help(message: Message):
+        user_id = str(message.chat.id)
+        username = message.from_user.username
+
+        def update_user():
+            data = load_data()
+            init_user(data, user_id, username=username)
+            save_data(data)
+
+        await run_storage(update_user)
+        args = message.text.split()[1:]
+        if args and message.text.startswith('/start'):
+            await open_file(message, args[0])
+            return
+        await bot.send_message(message.chat.id, HELP_TEXT, reply_markup=generate_main_menu())
+
+    @bot.message_handler(commands=['open'])
+    @per_user
+    async def handle_open(message: Message):
+        args = message.text.split()[1:]
+        if len(args) != 1:
+            await bot.reply_to(message, "Укажите ID файла. Пример: /open 1a2b3c4d")
+            return
+        await open_file(message, args[0])
+
+    @bot.message_handler(commands=['find'])
+    @per_user
+    async def handle_find(message: Message):
+        user_id = str(message.chat.id)
+        query, history = parse_find_query(message.text)
+        if not query_tokens(query):
+            await bot.reply_to(message, "Укажите, что искать. Пример: /find отчёт 2024")
+            return
+
+        def find():
+            # Возвращает (текст, клавиатура или None)
+            data = load_data()
+            init_user(data, user_id)
+            if history:
+                save_data(data)
+                return search_history(data, user_id, query), None
+            data["users"][user_id]["last_search"] = query
+            save_data(data)
+            total, page, results = search_files(data, user_id, query)
+            return format_search_results(query, total, page, results), generate_search_markup(results, page, total, PAGE_SIZE)
+
+        text, markup = await run_storage(find)
+        await bot.reply_to(message, text, reply_markup=markup)
+
+    async def open_file(message: Message, short_id):
+        user_id = str(message.chat.id)
+
+        def resolve():
+            data = load_data()
+            if init_user(data, user_id):
+                save_data(data)
+            error, file_info, place = resolve_file(data, user_id, short_id)
+            return error, dict(file_info) if file_info else None, place
+
+        error, file_info, place = await run_storage(resolve)
+        if error:
+            await bot.reply_to(message, error)
+            return
+        await bot.reply_to(message, f"Файл '{file_info.get('name')}' — {place}")
+        if not await send_single_async(bot, message.chat.id, file_info):
+            await bot.send_message(message.chat.id, "Невозможно отобразить содержимое файла.")
+
+    @bot.message_handler(commands=['mkdir'])
+    @per_user
+    async def handle_mkdir(message: Message):
+        user_id = str(message.chat.id)
+        try:
+            _, folder_name = message.text.split(maxsplit=1)
+        except ValueError:
+            await bot.reply_to(message, "Укажите имя папки. Пример: /mkdir НоваяПапка")
+            return
+
+        def mkdir():
+            data = load_data()
+            init_user(data, user_id)
+            current = navigate_to_path(data["users"][user_id]["structure"], data["users"][user_id]["current_path"])
+            if folder_name in current["folders"]:
+                return "Папка с таким именем уже существует."
+            current["folders"][folder_name] = {"folders": {}, "files": []}
+            save_data(data)
+            return f"Папка '{folder_name}' создана."
+
+        await bot.reply_to(message, await run_storage(mkdir))
+
+    @bot.message_handler(commands=['cd'])
+    @per_user
+    async def handle_cd(message: Message):
+        user_id = str(message.chat.id)
+        try:
+            _, folder_name = message.text.split(maxsplit=1)
+        except ValueError:
+            await bot.reply_to(message, "Укажите имя папки. Пример: /cd МояПапка")
+            return
+
+        def cd():
+            data = load_data()
+            init_user(data, user_id)
+            current = navigate_to_path(data["users"][user_id]["structure"], data["users"][user_id]["current_path"])
+            if folder_name not in current["folders"]:
+                return "Папка не найдена."
+            data["users"][user_id]["current_path"].append(folder_name)
+            save_data(data)
+            return f"Перешли в папку '{folder_name}'."
+
+        await bot.reply_to(message, await run_storage(cd))
+
+    @bot.message_handler(commands=['up'])
+    @per_user
+    async def handle_up(message: Message):
+        user_id = str(message.chat.id)
+
+        def up():
+            data = load_data()
+            init_user(data, user_id)
+            if not data["users"][user_id]["current_path"]:
+                return "Вы уже в корневой папке."
+            popped = data["users"][user_id]["current_path"].pop()
+            save_data(data)
+            return f"Вернулись из папки '{popped}'."
+
+        await bot.reply_to(message, await run_storage(up))
+
+    @bot.message_handler(commands=['getmydata'])
+    @per_user
+    async def handle_getmydata(message: Message):
+        user_id = str(message.chat.id)
+        username = message.from_user.username
+
+        def render():
+            # Возвращает (ответ, текст, клавиатура)
+            data = load_data()
+            if init_user(data, user_id, username=username):
+                save_data(data)
+            current_path = data["users"][user_id]["current_path"]
+            if current_path and current_path[-1].endswith('.git'):
+                project_name = current_path[-1]
+                owner_id = user_id  # По умолчанию владелец - текущий пользователь
+                if "projects" in data and project_name in data["projects"][owner_id]:
+                    if not is_project_member(data, user_id, owner_id, project_name):
+                        return f"У вас нет доступа к проекту `{project_name}`.", None, None
+                    project = data["projects"][owner_id][project_name]
+                    branch_structure = get_current_branch_structure(data, owner_id, project_name)
+                    project_path = current_path[current_path.index(project_name) + 1:]
+                    current_project_folder = navigate_to_path(branch_structure, project_path)
+                    markup = generate_markup(current_project_folder, current_path, project_name=project_name,
+                                             items_per_page=user_page_size(data, user_id))
+                    return None, f"Содержимое Git-проекта `{project_name}` (ветка `{project['current_branch']}`):", markup
+            current = navigate_to_path(data["users"][user_id]["structure"], current_path)
+            return None, "Ваша папочная структура:", generate_markup(current, current_path, items_per_page=user_page_size(data, user_id))
+
+        reply, text, markup = await run_storage(render)
+        if reply:
+            await bot.reply_to(message, reply)
+            return
+        try:
+            remember_markup(await bot.send_message(message.chat.id, text, reply_markup=markup), markup)
+        except ApiTelegramException as e:
+            await bot.send_message(message.chat.id, f"Ошибка при отправке клавиатуры: {str(e)}")
+
+    @bot.message_handler(commands=['export'])
+    @per_user
+    async def handle_export(message: Message):
+        user_id = str(message.chat.id)
+        username = message.from_user.username
+
+        def locate():
+            data = load_data()
+            if init_user(data, user_id, username=username):
+                save_data(data)
+            error, folder, name = locate_export(data, user_id)
+            return error, copy.deepcopy(folder), name
+
+        error, folder, name = await run_storage(locate)
+        if error:
+            await bot.reply_to(message, error)
+            return
+        if await get_jobs().submit("export", message.chat.id, {"tree": folder, "name": name}) is None:
+            await bot.reply_to(message, "Дождитесь завершения предыдущих задач.")
+            return
+        await bot.reply_to(message, f"Собираю архив «{name}»...")
+
+    @bot.message_handler(commands=['import'])
+    @per_user
+    async def handle_import(message: Message):
+        user_id = str(message.chat.id)
+        username = message.from_user.username
+
+        def locate():
+            data = load_data()
+            if init_user(data, user_id, username=username):
+                save_data(data)
+            path = list(data["users"][user_id]["current_path"])
+            return import_target(data, user_id, path)[0], path
+
+        error, path = await run_storage(locate)
+        if error:
+            await bot.reply_to(message, error)
+            return
+        await bot.reply_to(message, "Отправьте ZIP-архив: его содержимое будет добавлено в текущую папку.")
+        expect_input(user_id, lambda m: handle_import_archive(m, path))
+
+    async def handle_import_archive(message: Message, path):
+        error = import_request_error(message)
+        if error:
+            await bot.reply_to(message, error)
+            return
+        params = {"file_id": message.document.file_id, "user_id": str(message.chat.id), "path": path,
+                  "name": message.document.file_name or "archive.zip"}
+        if await get_jobs().submit("import", message.chat.id, params) is None:
+            await bot.reply_to(message, "Дождитесь завершения предыдущих задач.")
+            return
+        await bot.reply_to(message, "Импортирую архив...")
+
+    @bot.message_handler(commands=['share'])
+    @per_user
+    async def handle_share(message: Message):
+        user_id = str(message.chat.id)
+
+        def share():
+            data = load_data()
+            init_user(data, user_id)
+            current_path = data["users"][user_id]["current_path"]
+            try:
+                current = navigate_to_path(data["users"][user_id]["structure"], current_path)
+            except KeyError:
+                return None, "Текущая папка не существует."
+            if not current["folders"] and not current["files"]:
+                return None, "Текущая папка пуста. Нечего делиться."
+            unique_key = uuid.uuid4().hex
+            data["shared_folders"][unique_key] = {
+                "user_id": user_id,
+                "path": current_path.copy()
+            }
+            save_data(data)
+            return unique_key, None
+
+        unique_key, error = await run_storage(share)
+        if error:
+            await bot.reply_to(message, error)
+            return
+        await bot.reply_to(
+            message,
+            f"Папка успешно сделана публичной.\nВаш ключ для доступа: `{unique_key}`\nИспользуйте команду /access <ключ> чтобы получить доступ.",
+            parse_mode="Markdown"
+        )
+
+    @bot.message_handler(commands=['access'])
+    @per_user
+    async def handle_access(message: Message):
+        user_id = str(message.chat.id)
+        try:
+            _, access_key = message.text.split(maxsplit=1)
+        except ValueError:
+            await bot.reply_to(message, "Пожалуйста, укажите ключ доступа. Пример: /access <ключ>")
+            return
+
+        def render():
+            data = load_data()
+            if init_user(data, user_id):
+                save_data(data)
+            shared = data.get("shared_folders", {}).get(access_key)
+            if not shared:
+                return "Неверный или несуществующий ключ доступа.", None
+            owner_id = shared["user_id"]
+            path = shared["path"]
+            if owner_id not in data["users"]:
+                return "Владелец папки не существует.", None
+            try:
+                shared_folder = navigate_to_path(data["users"][owner_id]["structure"], path)
+            except KeyError:
+                return "Папка не найдена.", None
+            return None, generate_markup(shared_folder, path, shared_key=access_key,
+                                         items_per_page=user_page_size(data, user_id))
+
+        error, markup = await run_storage(render)
+        if error:
+            await bot.reply_to(message, error)
+            return
+        try:
+            remember_markup(await bot.send_message(message.chat.id, "Содержимое публичной папки:", reply_markup=markup), markup)
+        except ApiTelegramException as e:
+            await bot.send_message(message.chat.id, f"Ошибка при отправке клавиатуры: {str(e)}")
+
+    @bot.message_handler(commands=['initgit'])
+    @per_user
+    async def handle_initgit(message: Message):
+        user_id = str(message.chat.id)
+        args = parse_project_args(message.text, 1)
+        if args is None:
+            await bot.reply_to(message, "Укажите название проекта. Пример: /initgit MyProject.git")
+            return
+        project_name = args[0]
+        if not project_name.endswith('.git'):
+            await bot.reply_to(message, "Название проекта должно заканчиваться на `.git`. Пример: MyProject.git")
+            return
+
+        def initgit():
+            data = load_data()
+            init_user(data, user_id)
+            if "projects" not in data:
+                data["projects"] = {}
+            if user_id not in data["projects"]:
+                data["projects"][user_id] = {}
+            if project_name in data["projects"][user_id]:
+                return f"Проект `{project_name}` уже существует."
+            current = navigate_to_path(data["users"][user_id]["structure"], data["users"][user_id]["current_path"])
+            if project_name in current["folders"]:
+                return f"Папка `{project_name}` уже существует."
+            with project_lock(user_id, project_name):
+                init_project(data, user_id, project_name)
+                current["folders"][project_name] = {"folders": {}, "files": []}
+                save_data(data)
+            return f"Git-проект `{project_name}` успешно инициализирован."
+
+        await bot.reply_to(message, await run_storage(initgit))
+
+    def project_missing(data, user_id, project_name):
+        return "projects" not in data or project_name not in data["projects"].get(user_id, {})
+
+    @bot.message_handler(commands=['commit'])
+    @per_user
+    async def handle_commit(message: Message):
+        user_id = str(message.chat.id)
+        args = parse_project_args(message.text, 2)
+        if args is None:
+            await bot.reply_to(message, "Использование: /commit <название.git> <сообщение>")
+            return
+        project_name, commit_message = args
+        if not project_name.endswith('.git'):
+            await bot.reply_to(message, "Название проекта должно заканчиваться на `.git`.")
+            return
+
+        def commit():
+            data = load_data()
+            init_user(data, user_id)
+            if project_missing(data, user_id, project_name):
+                return f"Проект `{project_name}` не найден. Используйте /initgit для его создания."
+            with project_lock(user_id, project_name):
+                commit_id = create_commit(data, user_id, project_name, commit_message)
+                save_data(data)
+            return f"Коммит создан. ID коммита: {short_commit_id(commit_id)}"
+
+        await bot.reply_to(message, await run_storage(commit))
+
+    @bot.message_handler(commands=['autocommit'])
+    @per_user
+    async def handle_autocommit(message: Message):
+        user_id = str(message.chat.id)
+        args = message.text.split()[1:]
+        if len(args) not in (1, 2) or (len(args) == 2 and args[1] not in AUTOCOMMIT_MODES):
+            await bot.reply_to(message, "Использование: /autocommit <название.git> [immediate|debounced|manual]")
+            return
+        project_name = args[0]
+
+        def configure():
+            data = load_data()
+            init_user(data, user_id)
+            if project_missing(data, user_id, project_name):
+                return f"Проект `{project_name}` не найден."
+            if len(args) == 2:
+                with project_lock(user_id, project_name):
+                    set_autocommit_mode(data, user_id, project_name, args[1])
+                    save_data(data)
+            return format_autocommit_mode(project_name, get_autocommit_mode(data, user_id, project_name))
+
+        await bot.reply_to(message, await run_storage(configure))
+
+    @bot.message_handler(commands=['pagesize'])
+    @per_user
+    async def handle_pagesize(message: Message):
+        user_id = str(message.chat.id)
+        args = message.text.split()[1:]
+        page_size = parse_page_size(args[0]) if args else None
+        if args and (page_size is None or len(args) > 1):
+            await bot.reply_to(message, f"Использование: /pagesize [1-{MAX_FOLDER_PAGE_SIZE}]")
+            return
+
+        def configure():
+            data = load_data()
+            changed = init_user(data, user_id)
+            if page_size is not None:
+                set_page_size(data, user_id, page_size)
+                changed = True
+            if changed:
+                save_data(data)
+            return f"Элементов на странице папки: {user_page_size(data, user_id)}."
+
+        await bot.reply_to(message, await run_storage(configure))
+
+    @bot.message_handler(commands=['branch'])
+    @per_user
+    async def handle_branch(message: Message):
+        user_id = str(message.chat.id)
+        args = parse_project_args(message.text, 2)
+        if args is None:
+            await bot.reply_to(message, "Использование: /branch <название.git> <ветка>")
+            return
+        project_name, branch_name = args
+        if not project_name.endswith('.git'):
+            await bot.reply_to(message, "Название проекта должно заканчиваться на `.git`.")
+            return
+
+        def branch():
+            data = load_data()
+            init_user(data, user_id)
+            if project_missing(data, user_id, project_name):
+                return f"Проект `{project_name}` не найден. Используйте /initgit для его создания."
+            with project_lock(user_id, project_name):
+                success = create_branch(data, user_id, project_name, branch_name)
+                if success:
+                    save_data(data)
+            if success:
+                return f"Ветка `{branch_name}` успешно создана и переключились на неё в проекте `{project_name}`."
+            return f"Ветка `{branch_name}` уже существует в проекте `{project_name}`."
+
+        await bot.reply_to(message, await run_storage(branch))
+
+    @bot.message_handler(commands=['checkout'])
+    @per_user
+    async def handle_checkout(message: Message):
+        user_id = str(message.chat.id)
+        args = parse_project_args(message.text, 1)
+        if args is None:
+            await bot.reply_to(message, "Использование: /checkout <название.git>")
+            return
+        project_name = args[0]
+        if not project_name.endswith('.git'):
+            await bot.reply_to(message, "Название проекта должно заканчиваться на `.git`.")
+            return
+
+        def render():
+            data = load_data()
+            if init_user(data, user_id):
+                save_data(data)
+            if project_missing(data, user_id, project_name):
+                return None
+            return generate_branch_markup(project_name, data["projects"][user_id][project_name]["branches"])
+
+        markup = await run_storage(render)
+        if markup is None:
+            await bot.reply_to(message, f"Проект `{project_name}` не найден. Используйте /initgit для его создания.")
+            return
+        await bot.send_message(message.chat.id, "Выберите ветку для переключения:", reply_markup=markup)
+
+    @bot.message_handler(commands=['log'])
+    @per_user
+    async def handle_log(message: Message):
+        user_id = str(message.chat.id)
+        args = parse_project_args(message.text, 1)
+        if args is None:
+            await bot.reply_to(message, "Укажите название проекта. Пример: /log MyProject.git")
+            return
+        project_name = args[0]
+        if not project_name.endswith('.git'):
+            await bot.reply_to(message, "Название проекта должно заканчиваться на `.git`.")
+            return
+
+        def render():
+            data = load_data()
+            if init_user(data, user_id):
+                save_data(data)
+            if project_missing(data, user_id, project_name):
+                return f"Проект `{project_name}` не найден.", None, None
+            project = data["projects"][user_id][project_name]
+            commits = get_branch_commits(data, user_id, project_name)
+            if not commits:
+                return f"В проекте `{project_name}` нет коммитов.", None, None
+            log_message = f"История коммитов для `{project_name}` (ветка `{project['current_branch']}`):\n\n"
+            log_message += "".join(format_commit(commit) for commit in reversed(commits))
+            return None, log_message, generate_rollback_markup(project_name, commits)
+
+        reply, log_message, markup = await run_storage(render)
+        if reply:
+            await bot.reply_to(message, reply)
+            return
+        await bot.send_message(message.chat.id, log_message, reply_markup=markup)
+
+    @bot.message_handler(commands=['rollback'])
+    @per_user
+    async def handle_rollback(message: Message):
+        user_id = str(message.chat.id)
+        args = parse_project_args(message.text, 2)
+        if args is None:
+            await bot.reply_to(message, "Использование: /rollback <название.git> <commit_id>")
+            return
+        project_name, commit_id = args[0], args[1].strip()
+        if not project_name.endswith('.git'):
+            await bot.reply_to(message, "Название проекта должно заканчиваться на `.git`.")
+            return
+
+        def rollback():
+            data = load_data()
+            init_user(data, user_id)
+            if project_missing(data, user_id, project_name):
+                return f"Проект `{project_name}` не найден."
+            with project_lock(user_id, project_name):
+                success = rollback_to_commit(data, user_id, project_name, commit_id)
+                if success:
+                    save_data(data)
+            if success:
+                return f"Откат выполнен до коммита `{commit_id}` в проекте `{project_name}`."
+            return f"Коммит с ID `{commit_id}` не найден или откат не удался."
+
+        await bot.reply_to(message, await run_storage(rollback))
+
+    @bot.message_handler(commands=['merge'])
+    @per_user
+    async def handle_merge(message: Message):
+        user_id = str(message.chat.id)
+        args = parse_project_args(message.text, 3)
+        if args is None:
+            await bot.reply_to(message, "Использование: /merge <название.git> <ветка_источник> <ветка_приемник>")
+            return
+        project_name, source_branch_name, target_branch_name = args
+        if not project_name.endswith('.git'):
+            await bot.reply_to(message, "Название проекта должно заканчиваться на `.git`.")
+            return
+
+        def merge():
+            data = load_data()
+            init_user(data, user_id)
+            if project_missing(data, user_id, project_name):
+                return f"Проект `{project_name}` не найден."
+            with project_lock(user_id, project_name):
+                result = merge_branches(data, user_id, project_name, source_branch_name, target_branch_name)
+                if result is not None and result["status"] != "up_to_date":
+                    save_data(data)
+            if result is None:
+                return "Ошибка при слиянии веток. Проверьте, что ветки существуют."
+            if result["status"] == "up_to_date":
+                return f"Ветка `{target_branch_name}` уже содержит все изменения ветки `{source_branch_name}`."
+            return format_merge_result(result, project_name, source_branch_name, target_branch_name)
+
+        await bot.reply_to(message, await run_storage(merge))
+
+    @bot.message_handler(commands=['invite'])
+    @per_user
+    async def handle_invite(message: Message):
+        user_id = str(message.chat.id)
+        username = message.from_user.username
+        args = parse_project_args(message.text, 2)
+        if args is None:
+            await bot.reply_to(message, "Использование: /invite <название.git> <username>")
+            return
+        project_name, invitee_username = args
+        if not project_name.endswith('.git'):
+            await bot.reply_to(message, "Название проекта должно заканчиваться на `.git`.")
+            return
+
+        reply, invitee_user_id = await run_storage(
+            invite_collaborator, user_id, username, project_name, invitee_username
+        )
+        await bot.reply_to(message, reply)
+        if invitee_user_id:
+            # Отправляем приглашенному пользователю уведомление
+            try:
+                await bot.send_message(invitee_user_id, f"Вас пригласили в проект `{project_name}` пользователя @{username}.")
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомления: {e}")
+
+
+def invite_collaborator(user_id, username, project_name, invitee_username):
+    """Добавляет участника в проект; возвращает (ответ, id приглашённого или None)."""
+    data = load_data()
+    init_user(data, user_id, username=username)
+    if "projects" not in data or project_name not in data["projects"].get(user_id, {}):
+        return f"Проект `{project_name}` не найден.", None
+    invitee_user_id = get_user_id_by_username(data, invitee_username)
+    if not invitee_user_id:
+        return f"Пользователь `{invitee_username}` не найден или не взаимодействовал с ботом.", None
+    project = data["projects"][user_id][project_name]
+    with project_lock(user_id, project_name):
+        if "collaborators" not in project:
+            project["collaborators"] = []
+        if invitee_user_id in project["collaborators"]:
+            return f"Пользователь `{invitee_username}` уже является участником проекта `{project_name}`.", None
+        project["collaborators"].append(invitee_user_id)
+        save_data(data)
+    return f"Пользователь `{invitee_username}` приглашен в проект `{project_name}`.", invitee_user_id
@@ -0,0 +1,25 @@
+# handlers/async_inline_handlers.py
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import InlineQuery
+from utils.data_manager import load_data
+from utils.inline import answer_page
+from utils.async_runtime import run_storage
+from config import INLINE_CACHE_TTL
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Асинхронная версия обработчика из inline_handlers.py. Запрос только читает
+# данные, поэтому выполняется без очереди пользователя (per_user)
+
+
+def register_async_inline_handlers(bot: AsyncTeleBot):
+    @bot.inline_handler(func=lambda query: True)
+    async def handle_inline_query(query: InlineQuery):
+        user_id = str(query.from_user.id)
+        try:
+            results, next_offset = await run_storage(answer_page, load_data, user_id, query.query, query.offset)
+            await bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TTL, is_personal=True,
+                                          next_offset=next_offset)
+        except Exception as e:
+            logger.error(f"Ошибка при ответе на inline-запрос: {e}")
@@ -0,0 +1,125 @@
+# handlers/async_message_handlers.py
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Message
+from utils.data_manager import load_data, save_data, init_user, autocommit, autocommit_reply, get_current_branch_structure, set_current_branch_structure, is_project_member, new_short_id, place_file
+from utils.navigation import navigate_to_path
+from utils.objects import touch_path
+from utils.locks import project_lock
+from utils.async_runtime import run_storage, per_user
+from utils.retrieval import message_file_id, message_caption
+from utils.stored_files import upload_key, find_stored, stored_fields
+import logging
+from config import DATA_CHAT_ID
+
+logger = logging.getLogger(__name__)
+
+# Асинхронная версия обработчика из message_handlers.py
+
+
+def locate_target(user_id, username):
+    """Куда сохранять файл: (имя проекта или None, текст ошибки или None)."""
+    data = load_data()
+    if init_user(data, user_id, username=username):
+        save_data(data)
+    current_path = data["users"][user_id]["current_path"]
+    if not (current_path and current_path[-1].endswith('.git')):
+        return None, None
+    project_name = current_path[-1]
+    if not is_project_member(data, user_id, user_id, project_name):
+        return project_name, f"У вас нет доступа к проекту `{project_name}`."
+    if "projects" not in data or project_name not in data["projects"][user_id]:
+        return project_name, f"Проект `{project_name}` не найден."
+    return project_name, None
+
+
+def find_upload(key):
+    """Уже сохранённый в DATA_CHAT_ID файл с ключом key или None."""
+    return find_stored(load_data(), key)
+
+
+def store_file(user_id, file_entry, file_type):
+    """Кладёт запись файла в текущую папку; внутри проекта заменяет одноимённый файл и коммитит.
+
+    short_id (и имя, если его нет) назначаются здесь. Возвращает None вне проекта,
+    иначе окончание ответа о сохранении в проект.
+    """
+    data = load_data()
+    user = data["users"][user_id]
+    current_path = user["current_path"]
+    short_id = file_entry["short_id"] = new_short_id(data)
+    if file_entry.get("name") is None:
+        file_entry["name"] = f"message_{short_id}" if file_type == 'text' else f"file_{short_id}"
+    if not (current_path and current_path[-1].endswith('.git')):
+        place_file(data, navigate_to_path(user["structure"], current_path), file_entry, user_id, current_path)
+        save_data(data)
+        return None
+    project_name = current_path[-1]
+    owner_id = user_id  # По умолчанию владелец - текущий пользователь
+    with project_lock(owner_id, project_name):
+        branch_structure = get_current_branch_structure(data, owner_id, project_name)
+        project_path = current_path[current_path.index(project_name)+1:]
+        place_file(data, navigate_to_path(branch_structure, project_path), file_entry, owner_id, project_path,
+                   project_name=project_name, replace=True)
+        touch_path(branch_structure, project_path)
+        set_current_branch_structure(data, owner_id, project_name, branch_structure)
+        commit_id = autocommit(data, owner_id, project_name, f"{file_type} '{file_entry['name']}'")
+        reply = autocommit_reply(data, owner_id, project_name, commit_id)
+        save_data(data)
+    return reply
+
+
+def register_async_message_handlers(bot: AsyncTeleBot):
+    @bot.message_handler(content_types=['text', 'photo', 'document', 'video', 'audio'])
+    @per_user
+    async def handle_message(message: Message):
+        user_id = str(message.chat.id)
+        username = message.from_user.username
+
+        if message.content_type == 'text' and message.text.startswith('/'):
+            return
+
+        project_name, error = await run_storage(locate_target, user_id, username)
+        if error:
+            await bot.reply_to(message, error)
+            return
+
+        if message.content_type == 'text':
+            file_type = 'text'
+            file_entry = {
+                "type": file_type,
+                "content": message.text,
+                "name": None
+            }
+        else:
+            # Копирование в чат хранения не держит ни поток, ни блокировку проекта;
+            # уже сохранённый там файл повторно не копируется
+            key = upload_key(message)
+            stored = await run_storage(find_upload, key) if key is not None else None
+            if stored is None:
+                try:
+                    copied_message = await bot.copy_message(
+                        chat_id=DATA_CHAT_ID,
+                        from_chat_id=message.chat.id,
+                        message_id=message.message_id
+                    )
+                except Exception as e:
+                    logger.error(f"Ошибка при копировании сообщения: {e}")
+                    await bot.reply_to(message, f"Ошибка при сохранении {message.content_type}.")
+                    return
+                stored = {"message_id": copied_message.message_id, "file_id": message_file_id(message)}
+            file_type = message.content_type
+            file_entry = {
+                "type": file_type,
+                **stored_fields(key, stored),
+                **message_caption(message),
+                "name": message.document.file_name if message.document else None
+            }
+
+        project_reply = await run_storage(store_file, user_id, file_entry, file_type)
+        short_id = file_entry["short_id"]
+        if project_reply:
+            await bot.reply_to(message, f"{file_type.capitalize()} '{file_entry['name']}' сохранено {project_reply}. ID: {short_id}")
+        elif message.content_type == 'text':
+            await bot.reply_to(message, f"Текстовое сообщение сохранено в текущей папке. ID: {short_id}")
+        else:
+            await bot.reply_to(message, f"{message.content_type.capitalize()} сохранено в текущей папке. ID: {short_id}")
@@ -9,276 +9,311 @@ from utils.data_manager import (
     get_current_branch_structure,
     set_current_branch_structure,
     rollback_to_commit,
+    get_branch_commits,
+    format_commit,
     get_user_id_by_username,
-    is_project_member
+    is_project_member,
+    find_file,
+    search_files,
+    format_search_results,
+    jump_to_file,
+    user_page_size
 )
 from utils.navigation import navigate_to_path
-from utils.keyboards import generate_markup
+from utils.keyboards import generate_markup, generate_branch_markup, generate_search_markup
+from utils.callbacks import decode
+from utils.search import PAGE_SIZE
+from utils.locks import project_lock
+from utils.jobs import get_jobs
+from utils.markup_edits import get_markup_editor, remember_markup
+from utils.export import locate_export
+from utils.retrieval import caption_kwargs
 import telebot
+import copy
 import logging
 from config import DATA_CHAT_ID
 
 logger = logging.getLogger(__name__)
 
+def current_folder_markup(data, user_id, start=0):
+    """Клавиатура текущей папки пользователя (обычной или внутри Git-проекта) со страницы start."""
+    current_path = data["users"][user_id]["current_path"]
+    page_size = user_page_size(data, user_id)
+    if current_path and current_path[-1].endswith('.git'):
+        project_name = current_path[-1]
+        branch_structure = get_current_branch_structure(data, user_id, project_name)
+        project_path = current_path[current_path.index(project_name)+1:]
+        current_project_folder = navigate_to_path(branch_structure, project_path)
+        return generate_markup(current_project_folder, current_path, project_name=project_name, start=start,
+                               items_per_page=page_size)
+    current = navigate_to_path(data["users"][user_id]["structure"], current_path)
+    return generate_markup(current, current_path, start=start, items_per_page=page_size)
+
 def register_callback_handlers(bot: telebot.TeleBot):
-    @bot.callback_query_handler(func=lambda call: True)
-    def handle_callback(call: CallbackQuery):
-        user_id = str(call.message.chat.id)
-        username = call.from_user.username
-        data = load_data()
-        init_user(data, user_id, username=username)
+    # Обработчики кнопок: (нажатие, данные, пользователь, аргументы кнопки) -> True, если данные изменены.
+    # Кнопка разбирается utils.callbacks.decode(), обработчик выбирается по словарю ACTION_HANDLERS
 
-        if call.data == "up":
-            if data["users"][user_id]["current_path"]:
-                popped = data["users"][user_id]["current_path"].pop()
-                bot.answer_callback_query(call.id, f"Вернулись из папки '{popped}'.")
-            else:
-                bot.answer_callback_query(call.id, "Вы уже в корневой папке.")
-        elif call.data.startswith("page:"):
-            # Обработка пагинации в обычных папках
-            page = int(call.data.split(":")[1])
-            current_path = data["users"][user_id]["current_path"]
-            if current_path and current_path[-1].endswith('.git'):
-                # Внутри Git-проекта
-                project_name = current_path[-1]
-                branch_structure = get_current_branch_structure(data, user_id, project_name)
-                project_path = current_path[current_path.index(project_name)+1:]
-                current_project_folder = navigate_to_path(branch_structure, project_path)
-                markup = generate_markup(current_project_folder, current_path, project_name=project_name, page=page)
-            else:
-                # Обычная папка
-                current = navigate_to_path(data["users"][user_id]["structure"], current_path)
-                markup = generate_markup(current, current_path, page=page)
-            try:
-                bot.edit_message_reply_markup(chat_id=call.message.chat.id,
-                                              message_id=call.message.message_id,
-                                              reply_markup=markup)
-                bot.answer_callback_query(call.id)
-            except telebot.apihelper.ApiTelegramException as e:
-                logger.error(f"Ошибка при обновлении клавиатуры: {e}")
-                bot.answer_callback_query(call.id, "Ошибка при обновлении клавиатуры.")
-        elif call.data.startswith("shared_page:"):
-            # Обработка пагинации в общих папках
-            _, shared_key, page = call.data.split(":")
-            page = int(page)
-            shared = data.get("shared_folders", {}).get(shared_key)
-            if not shared:
-                bot.answer_callback_query(call.id, "Неверный или несуществующий ключ доступа.")
-                return
-            owner_id = shared["user_id"]
-            path = shared["path"]
-            owner_structure = data["users"][owner_id]["structure"]
-            try:
-                current = navigate_to_path(owner_structure, path)
-            except KeyError:
-                bot.answer_callback_query(call.id, "Папка не найдена.")
-                return
-            markup = generate_markup(current, path, shared_key=shared_key, page=page)
-            try:
-                bot.edit_message_reply_markup(chat_id=call.message.chat.id,
-                                              message_id=call.message.message_id,
-                                              reply_markup=markup)
-                bot.answer_callback_query(call.id)
-            except telebot.apihelper.ApiTelegramException as e:
-                logger.error(f"Ошибка при обновлении клавиатуры: {e}")
-                bot.answer_callback_query(call.id, "Ошибка при обновлении клавиатуры.")
-        elif call.data.startswith("invite_member:"):
-            try:
-                _, project_name = call.data.split(":")
-                # Проверяем, является ли пользователь владельцем проекта
-                if project_name not in data["projects"].get(user_id, {}):
-                    bot.answer_callback_query(call.id, f"У вас нет прав на управление проектом `{project_name}`.")
-                    return
-                msg = bot.send_message(call.message.chat.id, "Введите имя пользователя для приглашения:")
-                bot.register_next_step_handler(msg, lambda m: handle_invite_member(m, project_name))
-                bot.answer_callback_query(call.id)
-            except ValueError:
-                bot.answer_callback_query(call.id, "Неверный формат команды приглашения.")
-                return
-        elif call.data == "retrieve_all":
-            # Обработка команды "Вернуть Все" в обычной папке
-            current_path = data["users"][user_id]["current_path"]
-            current = navigate_to_path(data["users"][user_id]["structure"], current_path)
-            send_all_files(bot, call, current["files"], data, user_id)
-        elif call.data.startswith("shared_retrieve_all:"):
-            # Обработка команды "Вернуть Все" в общей папке
-            _, shared_key = call.data.split(":")
-            shared = data.get("shared_folders", {}).get(shared_key)
-            if not shared:
-                bot.answer_callback_query(call.id, "Неверный или несуществующий ключ доступа.")
-                return
-            owner_id = shared["user_id"]
-            path = shared["path"]
-            owner_structure = data["users"][owner_id]["structure"]
-            try:
-                current = navigate_to_path(owner_structure, path)
-            except KeyError:
-                bot.answer_callback_query(call.id, "Папка не найдена.")
-                return
+    def edit_markup(call, markup):
+        # Правка уходит в фоне; совпадающая с показанной клавиатура не отправляется
+        get_markup_editor().submit(call.message.chat.id, call.message.message_id, markup)
+        bot.answer_callback_query(call.id)
+
+    def shared_folder(call, data, shared_key):
+        # (владелец, путь, папка) общей папки; при ошибке отвечает на нажатие и возвращает None
+        shared = data.get("shared_folders", {}).get(shared_key)
+        if not shared:
+            bot.answer_callback_query(call.id, "Неверный или несуществующий ключ доступа.")
+            return None
+        owner_id = shared["user_id"]
+        path = shared["path"]
+        owner_structure = data["users"][owner_id]["structure"]
+        try:
+            return owner_id, path, navigate_to_path(owner_structure, path)
+        except KeyError:
+            bot.answer_callback_query(call.id, "Папка не найдена.")
+            return None
+
+    def on_up(call, data, user_id):
+        if data["users"][user_id]["current_path"]:
+            popped = data["users"][user_id]["current_path"].pop()
+            bot.answer_callback_query(call.id, f"Вернулись из папки '{popped}'.")
+            return True
+        bot.answer_callback_query(call.id, "Вы уже в корневой папке.")
+
+    def on_page(call, data, user_id, start):
+        # Обработка пагинации в обычных папках и внутри Git-проекта
+        edit_markup(call, current_folder_markup(data, user_id, start))
+
+    def on_shared_page(call, data, user_id, shared_key, start):
+        # Обработка пагинации в общих папках
+        found = shared_folder(call, data, shared_key)
+        if found is not None:
+            _, path, current = found
+            edit_markup(call, generate_markup(current, path, shared_key=shared_key, start=start,
+                                              items_per_page=user_page_size(data, user_id)))
+
+    def on_invite_member(call, data, user_id, project_name):
+        # Проверяем, является ли пользователь владельцем проекта
+        if project_name not in data["projects"].get(user_id, {}):
+            bot.answer_callback_query(call.id, f"У вас нет прав на управление проектом `{project_name}`.")
+            return
+        msg = bot.send_message(call.message.chat.id, "Введите имя пользователя для приглашения:")
+        bot.register_next_step_handler(msg, lambda m: handle_invite_member(m, project_name))
+        bot.answer_callback_query(call.id)
+
+    def on_job_cancel(call, data, user_id, job_id):
+        if get_jobs().cancel(job_id, call.message.chat.id):
+            bot.answer_callback_query(call.id, "Задача будет остановлена.")
+        else:
+            bot.answer_callback_query(call.id, "Задача уже завершена.")
+
+    def on_export(call, data, user_id, shared_key=None):
+        error, folder, name = locate_export(data, user_id, shared_key)
+        if error:
+            bot.answer_callback_query(call.id, error)
+        elif get_jobs().submit("export", call.message.chat.id, {"tree": copy.deepcopy(folder), "name": name}) is None:
+            bot.answer_callback_query(call.id, "Дождитесь завершения предыдущих задач.")
+        else:
+            bot.answer_callback_query(call.id, f"Собираю архив «{name}»...")
+
+    def on_retrieve_all(call, data, user_id):
+        # Обработка команды "Вернуть Все" в обычной папке
+        current_path = data["users"][user_id]["current_path"]
+        current = navigate_to_path(data["users"][user_id]["structure"], current_path)
+        send_all_files(bot, call, current["files"], data, user_id)
+
+    def on_shared_retrieve_all(call, data, user_id, shared_key):
+        # Обработка команды "Вернуть Все" в общей папке
+        found = shared_folder(call, data, shared_key)
+        if found is not None:
+            owner_id, _, current = found
             send_all_files(bot, call, current["files"], data, owner_id)
-        elif call.data == "retrieve_all_project":
-            # Обработка команды "Вернуть Все" в проекте
-            current_path = data["users"][user_id]["current_path"]
-            if current_path and current_path[-1].endswith('.git'):
-                project_name = current_path[-1]
-                branch_structure = get_current_branch_structure(data, user_id, project_name)
-                project_path = current_path[current_path.index(project_name)+1:]
-                current_project_folder = navigate_to_path(branch_structure, project_path)
-                send_all_files(bot, call, current_project_folder["files"], data, user_id)
-            else:
-                bot.answer_callback_query(call.id, "Вы не находитесь в проекте.")
-        elif call.data.startswith("folder:"):
-            folder_name = call.data.split(":", 1)[1]
-            current_path = data["users"][user_id]["current_path"]
-            if current_path and current_path[-1].endswith('.git'):
-                project_name = current_path[-1]
-                branch_structure = get_current_branch_structure(data, user_id, project_name)
-                project_path = current_path[current_path.index(project_name)+1:]
-                current_project_folder = navigate_to_path(branch_structure, project_path)
-                if folder_name in current_project_folder["folders"]:
-                    data["users"][user_id]["current_path"].append(folder_name)
-                    bot.answer_callback_query(call.id, f"Перешли в папку '{folder_name}'.")
-                else:
-                    bot.answer_callback_query(call.id, "Папка не найдена.")
-            else:
-                current = navigate_to_path(data["users"][user_id]["structure"], current_path)
-                if folder_name in current["folders"]:
-                    data["users"][user_id]["current_path"].append(folder_name)
-                    bot.answer_callback_query(call.id, f"Перешли в папку '{folder_name}'.")
-                else:
-                    bot.answer_callback_query(call.id, "Папка не найдена.")
-        elif call.data.startswith("file:"):
-            short_id = call.data.split(":", 1)[1]
-            file_info = None
-            current_path = data["users"][user_id]["current_path"]
-            if current_path and current_path[-1].endswith('.git'):
-                project_name = current_path[-1]
-                branch_structure = get_current_branch_structure(data, user_id, project_name)
-                project_path = current_path[current_path.index(project_name)+1:]
-                current_project_folder = navigate_to_path(branch_structure, project_path)
-                for file in current_project_folder["files"]:
-                    if file.get("short_id") == short_id:
-                        file_info = file
-                        break
-            else:
-                current = navigate_to_path(data["users"][user_id]["structure"], current_path)
-                for file in current["files"]:
-                    if file.get("short_id") == short_id:
-                        file_info = file
-                        break
-            if not file_info:
-                bot.answer_callback_query(call.id, "Файл не найден.")
-                return
-            send_file(bot, call, file_info, data, user_id)
-        elif call.data.startswith("switch_branch_project:"):
-            try:
-                _, project_name = call.data.split(":")
-                if "projects" not in data or project_name not in data["projects"][user_id]:
-                    bot.answer_callback_query(call.id, f"Проект `{project_name}` не найден.")
-                    return
-                project = data["projects"][user_id][project_name]
-                branches = list(project["branches"].keys())
-                markup = telebot.types.InlineKeyboardMarkup()
-                for branch_name in branches:
-                    markup.add(telebot.types.InlineKeyboardButton(branch_name, callback_data=f"switch_to_branch:{project_name}:{branch_name}"))
-                bot.edit_message_text("Выберите ветку для переключения:", chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
-                bot.answer_callback_query(call.id)
-            except ValueError:
-                bot.answer_callback_query(call.id, "Неверный формат команды переключения ветки.")
-                return
-        elif call.data.startswith("switch_to_branch:"):
-            try:
-                _, project_name, branch_name = call.data.split(":")
-                success = switch_branch(data, user_id, project_name, branch_name)
-                if success:
-                    save_data(data)
-                    bot.answer_callback_query(call.id, f"Переключились на ветку `{branch_name}` в проекте `{project_name}`.")
-                    bot.send_message(call.message.chat.id, f"Переключились на ветку `{branch_name}` в проекте `{project_name}`.")
-                else:
-                    bot.answer_callback_query(call.id, f"Ветка `{branch_name}` не найдена в проекте `{project_name}`.")
-            except ValueError:
-                bot.answer_callback_query(call.id, "Неверный формат команды переключения ветки.")
-                return
-        elif call.data.startswith("log_project:"):
-            try:
-                _, project_name = call.data.split(":")
-            except ValueError:
-                bot.answer_callback_query(call.id, "Неверный формат команды логов.")
-                return
 
-            if "projects" not in data or project_name not in data["projects"][user_id]:
-                bot.answer_callback_query(call.id, f"Проект `{project_name}` не найден.")
-                return
+    def on_retrieve_all_project(call, data, user_id):
+        # Обработка команды "Вернуть Все" в проекте
+        current_path = data["users"][user_id]["current_path"]
+        if current_path and current_path[-1].endswith('.git'):
+            project_name = current_path[-1]
+            branch_structure = get_current_branch_structure(data, user_id, project_name)
+            project_path = current_path[current_path.index(project_name)+1:]
+            current_project_folder = navigate_to_path(branch_structure, project_path)
+            send_all_files(bot, call, current_project_folder["files"], data, user_id)
+        else:
+            bot.answer_callback_query(call.id, "Вы не находитесь в проекте.")
+
+    def on_folder(call, data, user_id, folder_name):
+        current_path = data["users"][user_id]["current_path"]
+        if current_path and current_path[-1].endswith('.git'):
+            project_name = current_path[-1]
+            branch_structure = get_current_branch_structure(data, user_id, project_name)
+            project_path = current_path[current_path.index(project_name)+1:]
+            current = navigate_to_path(branch_structure, project_path)
+        else:
+            current = navigate_to_path(data["users"][user_id]["structure"], current_path)
+        if folder_name in current["folders"]:
+            data["users"][user_id]["current_path"].append(folder_name)
+            bot.answer_callback_query(call.id, f"Перешли в папку '{folder_name}'.")
+            return True
+        bot.answer_callback_query(call.id, "Папка не найдена.")
+
+    def on_file(call, data, user_id, short_id):
+        current_path = data["users"][user_id]["current_path"]
+        if current_path and current_path[-1].endswith('.git'):
+            project_name = current_path[-1]
+            branch_structure = get_current_branch_structure(data, user_id, project_name)
+            project_path = current_path[current_path.index(project_name)+1:]
+            current_project_folder = navigate_to_path(branch_structure, project_path)
+            file_info = find_file(data, current_project_folder, short_id, user_id,
+                                  project_name=project_name, path=project_path)
+        else:
+            current = navigate_to_path(data["users"][user_id]["structure"], current_path)
+            file_info = find_file(data, current, short_id, user_id, path=current_path)
+        if not file_info:
+            bot.answer_callback_query(call.id, "Файл не найден.")
+            return
+        send_file(bot, call, file_info, data, user_id)
+
+    def on_switch_branch_project(call, data, user_id, project_name):
+        if "projects" not in data or project_name not in data["projects"][user_id]:
+            bot.answer_callback_query(call.id, f"Проект `{project_name}` не найден.")
+            return
+        project = data["projects"][user_id][project_name]
+        markup = generate_branch_markup(project_name, project["branches"])
+        bot.edit_message_text("Выберите ветку для переключения:", chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+        bot.answer_callback_query(call.id)
 
-            project = data["projects"][user_id][project_name]
-            branch = project["branches"][project["current_branch"]]
-            commits = branch["commits"]
+    def on_switch_to_branch(call, data, user_id, project_name, branch_name):
+        with project_lock(user_id, project_name):
+            success = switch_branch(data, user_id, project_name, branch_name)
+            if success:
+                save_data(data)
+        if success:
+            bot.answer_callback_query(call.id, f"Переключились на ветку `{branch_name}` в проекте `{project_name}`.")
+            bot.send_message(call.message.chat.id, f"Переключились на ветку `{branch_name}` в проекте `{project_name}`.")
+        else:
+            bot.answer_callback_query(call.id, f"Ветка `{branch_name}` не найдена в проекте `{project_name}`.")
 
-            if not commits:
-                bot.send_message(call.message.chat.id, f"В проекте `{project_name}` нет коммитов в ветке `{project['current_branch']}`.")
-                return
+    def on_log_project(call, data, user_id, project_name):
+        if "projects" not in data or project_name not in data["projects"][user_id]:
+            bot.answer_callback_query(call.id, f"Проект `{project_name}` не найден.")
+            return
 
-            log_message = f"История коммитов для `{project_name}` (ветка `{project['current_branch']}`):\n\n"
-            for commit in commits:
-                log_message += f"Commit ID: {commit['commit_id']}\nMessage: {commit['message']}\n\n"
+        project = data["projects"][user_id][project_name]
+        commits = get_branch_commits(data, user_id, project_name)
 
-            bot.send_message(call.message.chat.id, log_message)
-            bot.answer_callback_query(call.id)
-        elif call.data.startswith("rollback_commit:"):
-            try:
-                _, project_name, commit_id_str = call.data.split(":")
-                commit_id = int(commit_id_str)
-                success = rollback_to_commit(data, user_id, project_name, commit_id)
-                if success:
-                    save_data(data)
-                    bot.answer_callback_query(call.id, f"Откатились к коммиту `{commit_id}` в проекте `{project_name}`.")
-                    bot.send_message(call.message.chat.id, f"Откатились к коммиту `{commit_id}` в проекте `{project_name}`.")
-                else:
-                    bot.answer_callback_query(call.id, f"Коммит `{commit_id}` не найден или откат не удался.")
-            except ValueError:
-                bot.answer_callback_query(call.id, "Неверный формат данных для отката.")
-                return
-        elif call.data.startswith("create_branch_project:"):
-            try:
-                _, project_name = call.data.split(":")
-                msg = bot.send_message(call.message.chat.id, "Введите название новой ветки:")
-                bot.register_next_step_handler(msg, lambda m: handle_create_branch(m, project_name))
-                bot.answer_callback_query(call.id)
-            except ValueError:
-                bot.answer_callback_query(call.id, "Неверный формат команды создания ветки.")
-                return
-        elif call.data == "exit_project":
-            data["users"][user_id]["current_path"].pop()
-            save_data(data)
-            bot.answer_callback_query(call.id, "Вы вышли из Git-проекта.")
-            bot.send_message(call.message.chat.id, "Вы вышли из Git-проекта.")
+        if not commits:
+            bot.send_message(call.message.chat.id, f"В проекте `{project_name}` нет коммитов в ветке `{project['current_branch']}`.")
+            return
+
+        log_message = f"История коммитов для `{project_name}` (ветка `{project['current_branch']}`):\n\n"
+        for commit in commits:
+            log_message += format_commit(commit)
+
+        bot.send_message(call.message.chat.id, log_message)
+        bot.answer_callback_query(call.id)
+
+    def on_rollback_commit(call, data, user_id, project_name, commit_id):
+        with project_lock(user_id, project_name):
+            success = rollback_to_commit(data, user_id, project_name, commit_id)
+            if success:
+                save_data(data)
+        if success:
+            bot.answer_callback_query(call.id, f"Откатились к коммиту `{commit_id}` в проекте `{project_name}`.")
+            bot.send_message(call.message.chat.id, f"Откатились к коммиту `{commit_id}` в проекте `{project_name}`.")
         else:
-            bot.answer_callback_query(call.id, "Неизвестная команда.")
+            bot.answer_callback_query(call.id, f"Коммит `{commit_id}` не найден или откат не удался.")
+
+    def on_create_branch_project(call, data, user_id, project_name):
+        msg = bot.send_message(call.message.chat.id, "Введите название новой ветки:")
+        bot.register_next_step_handler(msg, lambda m: handle_create_branch(m, project_name))
+        bot.answer_callback_query(call.id)
+
+    def on_find_page(call, data, user_id, page):
+        query = data["users"][user_id].get("last_search")
+        if not query:
+            bot.answer_callback_query(call.id, "Повторите поиск командой /find.")
+            return
+        total, page, results = search_files(data, user_id, query, page)
+        markup = generate_search_markup(results, page, total, PAGE_SIZE)
+        try:
+            bot.edit_message_text(format_search_results(query, total, page, results),
+                                  chat_id=call.message.chat.id, message_id=call.message.message_id,
+                                  reply_markup=markup)
+            remember_markup(call.message, markup)
+            bot.answer_callback_query(call.id)
+        except telebot.apihelper.ApiTelegramException as e:
+            logger.error(f"Ошибка при обновлении результатов поиска: {e}")
+            bot.answer_callback_query(call.id, "Ошибка при обновлении результатов поиска.")
+
+    def on_find_go(call, data, user_id, short_id):
+        error = jump_to_file(data, user_id, short_id)
+        if error:
+            bot.answer_callback_query(call.id, error)
+            return
+        bot.answer_callback_query(call.id, "Перешли в папку файла.")
+        current_path = data["users"][user_id]["current_path"]
+        markup = current_folder_markup(data, user_id)
+        remember_markup(bot.send_message(call.message.chat.id, "Папка файла: /" + "/".join(current_path),
+                                         reply_markup=markup), markup)
+        return True
+
+    def on_exit_project(call, data, user_id):
+        data["users"][user_id]["current_path"].pop()
+        bot.answer_callback_query(call.id, "Вы вышли из Git-проекта.")
+        bot.send_message(call.message.chat.id, "Вы вышли из Git-проекта.")
+        return True
+
+    ACTION_HANDLERS = {
+        "up": on_up,
+        "page": on_page,
+        "shared_page": on_shared_page,
+        "invite_member": on_invite_member,
+        "job_cancel": on_job_cancel,
+        "export": on_export,
+        "shared_export": on_export,
+        "retrieve_all": on_retrieve_all,
+        "shared_retrieve_all": on_shared_retrieve_all,
+        "retrieve_all_project": on_retrieve_all_project,
+        "folder": on_folder,
+        "file": on_file,
+        "switch_branch_project": on_switch_branch_project,
+        "switch_to_branch": on_switch_to_branch,
+        "log_project": on_log_project,
+        "rollback_commit": on_rollback_commit,
+        "create_branch_project": on_create_branch_project,
+        "find_page": on_find_page,
+        "find_go": on_find_go,
+        "exit_project": on_exit_project,
+    }
+    # После этих действий клавиатура сообщения перерисовывается под текущую папку
+    REFRESH_ACTIONS = {"folder", "up", "exit_project", "retrieve_all", "retrieve_all_project"}
+
+    @bot.callback_query_handler(func=lambda call: True)
+    def handle_callback(call: CallbackQuery):
+        user_id = str(call.message.chat.id)
+        username = call.from_user.username
+        data = load_data()
+        changed = init_user(data, user_id, username=username)
+
+        decoded = decode(call.data)
+        handler = ACTION_HANDLERS.get(decoded[0]) if decoded is not None else None
+        if handler is None:
+            if changed:
+                save_data(data)
+            text = "Кнопка устарела, откройте папку заново." if decoded is None else "Неизвестная команда."
+            bot.answer_callback_query(call.id, text)
+            return
+        action, args = decoded
+        changed = handler(call, data, user_id, *args) or changed
 
         # После обработки действий обновляем клавиатуру, если необходимо
-        if call.data.startswith("folder:") or call.data == "up" or call.data == "exit_project" or call.data in ["retrieve_all", "retrieve_all_project"]:
-            current_path = data["users"][user_id]["current_path"]
-            if current_path and current_path[-1].endswith('.git'):
-                project_name = current_path[-1]
-                branch_structure = get_current_branch_structure(data, user_id, project_name)
-                project_path = current_path[current_path.index(project_name)+1:]
-                current_project_folder = navigate_to_path(branch_structure, project_path)
-                markup = generate_markup(current_project_folder, current_path, project_name=project_name)
-            else:
-                current = navigate_to_path(data["users"][user_id]["structure"], current_path)
-                markup = generate_markup(current, current_path)
-            try:
-                bot.edit_message_reply_markup(chat_id=call.message.chat.id,
-                                              message_id=call.message.message_id,
-                                              reply_markup=markup)
-            except telebot.apihelper.ApiTelegramException as e:
-                if "message is not modified" in str(e):
-                    pass
-                else:
-                    logger.error(f"Ошибка обновления клавиатуры: {e}")
-                    bot.send_message(call.message.chat.id, f"Ошибка обновления клавиатуры: {str(e)}")
-
-        save_data(data)
+        if action in REFRESH_ACTIONS:
+            get_markup_editor().submit(call.message.chat.id, call.message.message_id,
+                                       current_folder_markup(data, user_id))
+
+        # Листание страниц и просмотр файлов ничего не меняют — не помечаем данные к записи
+        if changed:
+            save_data(data)
 
     def handle_invite_member(message, project_name):
         user_id = str(message.chat.id)
@@ -299,12 +334,15 @@ def register_callback_handlers(bot: telebot.TeleBot):
 
         # Добавляем пользователя в список участников проекта
         project = data["projects"][user_id][project_name]
-        if "collaborators" not in project:
-            project["collaborators"] = []
+        with project_lock(user_id, project_name):
+            if "collaborators" not in project:
+                project["collaborators"] = []
+            invited = invitee_user_id not in project["collaborators"]
+            if invited:
+                project["collaborators"].append(invitee_user_id)
+                save_data(data)
 
-        if invitee_user_id not in project["collaborators"]:
-            project["collaborators"].append(invitee_user_id)
-            save_data(data)
+        if invited:
             bot.send_message(message.chat.id, f"Пользователь `{invitee_username}` приглашен в проект `{project_name}`.")
             # Отправляем приглашенному пользователю уведомление
             try:
@@ -328,9 +366,11 @@ def register_callback_handlers(bot: telebot.TeleBot):
             bot.send_message(message.chat.id, f"Проект `{project_name}` не найден.")
             return
 
-        success = create_branch(data, user_id, project_name, branch_name)
+        with project_lock(user_id, project_name):
+            success = create_branch(data, user_id, project_name, branch_name)
+            if success:
+                save_data(data)
         if success:
-            save_data(data)
             bot.send_message(message.chat.id, f"Ветка `{branch_name}` успешно создана и переключились на неё в проекте `{project_name}`.")
         else:
             bot.send_message(message.chat.id, f"Ветка `{branch_name}` уже существует в проекте `{project_name}`.")
@@ -339,9 +379,12 @@ def register_callback_handlers(bot: telebot.TeleBot):
         if not files:
             bot.answer_callback_query(call.id, "В этой папке нет файлов.")
             return
-        for file_info in files:
-            send_file(bot, call, file_info, data, owner_id)
-        bot.answer_callback_query(call.id, "Все файлы отправлены.")
+        # Выдача идёт фоновой задачей, обработчик кнопки сразу освобождается
+        job_id = get_jobs().submit("retrieve", call.message.chat.id, {"files": copy.deepcopy(files)})
+        if job_id is None:
+            bot.answer_callback_query(call.id, "Дождитесь завершения предыдущих выдач.")
+            return
+        bot.answer_callback_query(call.id, "Отправляю файлы...")
 
     def send_file(bot, call, file_info, data, owner_id):
         if file_info["type"] in ["text", "code"]:
@@ -355,7 +398,8 @@ def register_callback_handlers(bot: telebot.TeleBot):
                 bot.copy_message(
                     chat_id=call.message.chat.id,
                     from_chat_id=DATA_CHAT_ID,
-                    message_id=file_info["message_id"]
+                    message_id=file_info["message_id"],
+                    **caption_kwargs(file_info)
                 )
             except Exception as e:
                 logger.error(f"Ошибка при копировании файла: {e}")
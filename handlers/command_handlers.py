@@ -1,5 +1,4 @@
 # handlers/command_handlers.py
-from telebot import types
 from telebot.types import Message
 from utils.data_manager import (
     load_data,
@@ -8,18 +7,83 @@ from utils.data_manager import (
     init_project,
     create_commit,
     create_branch,
-    switch_branch,
     merge_branches,
     get_current_branch_structure,
-    set_current_branch_structure,
     rollback_to_commit,
+    get_branch_commits,
+    format_commit,
+    format_merge_result,
     get_user_id_by_username,
-    is_project_member
+    is_project_member,
+    resolve_file,
+    search_files,
+    format_search_results,
+    search_history,
+    get_autocommit_mode,
+    set_autocommit_mode,
+    format_autocommit_mode,
+    user_page_size,
+    set_page_size
 )
+from utils.autocommit import AUTOCOMMIT_MODES
 from utils.navigation import navigate_to_path
-from utils.keyboards import generate_markup
+from utils.history import short_commit_id
+from utils.keyboards import generate_markup, generate_main_menu, generate_branch_markup, generate_rollback_markup, generate_search_markup
+from utils.locks import project_lock
+from utils.export import locate_export
+from utils.importer import import_target, import_request_error
+from utils.jobs import get_jobs
+from utils.markup_edits import remember_markup
+from utils.retrieval import send_single
+from utils.search import query_tokens, PAGE_SIZE
+import copy
 import uuid
 import telebot
+import logging
+from config import MAX_FOLDER_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+HELP_TEXT = (
+    "Добро пожаловать! Вот что я умею:\n\n"
+    "/mkdir <имя_папки> - Создать новую папку\n"
+    "/cd <имя_папки> - Перейти в папку\n"
+    "/up - Вернуться на уровень выше\n"
+    "/getmydata - Показать содержимое текущей папки\n"
+    "/export - Скачать текущую папку архивом ZIP\n"
+    "/import - Загрузить ZIP-архив в текущую папку\n"
+    "/open <id> - Открыть файл по ID из любой папки\n"
+    "/find [--history] <слова> - Найти файлы по имени и тексту (--history — и в истории коммитов)\n"
+    "@<бот> <имя> - Inline-поиск файла по началу имени для отправки в любой чат\n"
+    "/share - Сделать текущую папку публичной\n"
+    "/access <ключ> - Получить доступ к публичной папке по ключу\n"
+    "/initgit <название.git> - Инициализировать новый Git-проект\n"
+    "/commit <название.git> <сообщение> - Создать коммит\n"
+    "/autocommit <название.git> [immediate|debounced|manual] - Режим автокоммитов\n"
+    "/pagesize [число] - Сколько элементов папки показывать на странице\n"
+    "/branch <название.git> <ветка> - Создать новую ветку\n"
+    "/checkout <название.git> - Переключиться на ветку\n"
+    "/log <название.git> - Просмотреть историю коммитов\n"
+    "/rollback <название.git> <commit_id> - Откатиться к коммиту\n"
+    "/merge <название.git> <ветка_источник> <ветка_приемник> - Слить ветки\n"
+    "/invite <название.git> <username> - Пригласить пользователя в проект"
+)
+
+def parse_page_size(text):
+    """Размер страницы из аргумента /pagesize или None, если он недопустим."""
+    try:
+        page_size = int(text)
+    except ValueError:
+        return None
+    return page_size if 1 <= page_size <= MAX_FOLDER_PAGE_SIZE else None
+
+def parse_find_query(text):
+    """'/find [--history] <слова>' -> (запрос, искать ли в истории коммитов)."""
+    parts = text.split(maxsplit=1)
+    query = parts[1].strip() if len(parts) > 1 else ""
+    if query.startswith("--history"):
+        return query[len("--history"):].strip(), True
+    return query, False
 
 def register_command_handlers(bot: telebot.TeleBot):
     @bot.message_handler(commands=['start', 'help'])
@@ -29,30 +93,52 @@ def register_command_handlers(bot: telebot.TeleBot):
         data = load_data()
         init_user(data, user_id, username=username)
         save_data(data)
-        markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.row('/help', '/mkdir', '/cd', '/up')
-        markup.row('/getmydata', '/share', '/access', '/invite')
-        markup.row('/initgit', '/commit', '/branch')
-        markup.row('/checkout', '/log', '/rollback', '/merge')
-        bot.send_message(
-            message.chat.id,
-            "Добро пожаловать! Вот что я умею:\n\n"
-            "/mkdir <имя_папки> - Создать новую папку\n"
-            "/cd <имя_папки> - Перейти в папку\n"
-            "/up - Вернуться на уровень выше\n"
-            "/getmydata - Показать содержимое текущей папки\n"
-            "/share - Сделать текущую папку публичной\n"
-            "/access <ключ> - Получить доступ к публичной папке по ключу\n"
-            "/initgit <название.git> - Инициализировать новый Git-проект\n"
-            "/commit <название.git> <сообщение> - Создать коммит\n"
-            "/branch <название.git> <ветка> - Создать новую ветку\n"
-            "/checkout <название.git> - Переключиться на ветку\n"
-            "/log <название.git> - Просмотреть историю коммитов\n"
-            "/rollback <название.git> <commit_id> - Откатиться к коммиту\n"
-            "/merge <название.git> <ветка_источник> <ветка_приемник> - Слить ветки\n"
-            "/invite <название.git> <username> - Пригласить пользователя в проект",
-            reply_markup=markup
-        )
+        # Ссылка вида https://t.me/<бот>?start=<id> открывает файл сразу
+        args = message.text.split()[1:]
+        if args and message.text.startswith('/start'):
+            open_file(message, args[0])
+            return
+        bot.send_message(message.chat.id, HELP_TEXT, reply_markup=generate_main_menu())
+
+    @bot.message_handler(commands=['open'])
+    def handle_open(message: Message):
+        args = message.text.split()[1:]
+        if len(args) != 1:
+            bot.reply_to(message, "Укажите ID файла. Пример: /open 1a2b3c4d")
+            return
+        open_file(message, args[0])
+
+    @bot.message_handler(commands=['find'])
+    def handle_find(message: Message):
+        user_id = str(message.chat.id)
+        data = load_data()
+        init_user(data, user_id)
+
+        query, history = parse_find_query(message.text)
+        if not query_tokens(query):
+            bot.reply_to(message, "Укажите, что искать. Пример: /find отчёт 2024")
+            return
+        if history:
+            bot.reply_to(message, search_history(data, user_id, query))
+            return
+        # Запрос запоминается для листания страниц результатов
+        data["users"][user_id]["last_search"] = query
+        save_data(data)
+        total, page, results = search_files(data, user_id, query)
+        bot.reply_to(message, format_search_results(query, total, page, results),
+                     reply_markup=generate_search_markup(results, page, total, PAGE_SIZE))
+
+    def open_file(message: Message, short_id):
+        user_id = str(message.chat.id)
+        data = load_data()
+        init_user(data, user_id)
+        error, file_info, place = resolve_file(data, user_id, short_id)
+        if error:
+            bot.reply_to(message, error)
+            return
+        bot.reply_to(message, f"Файл '{file_info.get('name')}' — {place}")
+        if not send_single(bot, message.chat.id, file_info):
+            bot.send_message(message.chat.id, "Невозможно отобразить содержимое файла.")
 
     @bot.message_handler(commands=['mkdir'])
     def handle_mkdir(message: Message):
@@ -132,25 +218,68 @@ def register_command_handlers(bot: telebot.TeleBot):
                     # Навигация внутри проекта
                     project_path = current_path[current_path.index(project_name) + 1:]
                     current_project_folder = navigate_to_path(branch_structure, project_path)
-                    markup = generate_markup(current_project_folder, current_path, project_name=project_name)
+                    markup = generate_markup(current_project_folder, current_path, project_name=project_name,
+                                             items_per_page=user_page_size(data, user_id))
                     try:
-                        bot.send_message(
+                        sent = bot.send_message(
                             message.chat.id,
                             f"Содержимое Git-проекта `{project_name}` (ветка `{project['current_branch']}`):",
                             reply_markup=markup
                         )
+                        remember_markup(sent, markup)
                     except telebot.apihelper.ApiTelegramException as e:
                         bot.send_message(message.chat.id, f"Ошибка при отправке клавиатуры: {str(e)}")
                     return
 
         # Обычная папка
         current = navigate_to_path(data["users"][user_id]["structure"], current_path)
-        markup = generate_markup(current, current_path)
+        markup = generate_markup(current, current_path, items_per_page=user_page_size(data, user_id))
         try:
-            bot.send_message(message.chat.id, "Ваша папочная структура:", reply_markup=markup)
+            remember_markup(bot.send_message(message.chat.id, "Ваша папочная структура:", reply_markup=markup), markup)
         except telebot.apihelper.ApiTelegramException as e:
             bot.send_message(message.chat.id, f"Ошибка при отправке клавиатуры: {str(e)}")
 
+    @bot.message_handler(commands=['export'])
+    def handle_export(message: Message):
+        user_id = str(message.chat.id)
+        data = load_data()
+        init_user(data, user_id, username=message.from_user.username)
+        error, folder, name = locate_export(data, user_id)
+        if error:
+            bot.reply_to(message, error)
+            return
+        # Архив собирается фоновой задачей и придёт отдельным документом
+        if get_jobs().submit("export", message.chat.id, {"tree": copy.deepcopy(folder), "name": name}) is None:
+            bot.reply_to(message, "Дождитесь завершения предыдущих задач.")
+            return
+        bot.reply_to(message, f"Собираю архив «{name}»...")
+
+    @bot.message_handler(commands=['import'])
+    def handle_import(message: Message):
+        user_id = str(message.chat.id)
+        data = load_data()
+        init_user(data, user_id, username=message.from_user.username)
+        path = list(data["users"][user_id]["current_path"])
+        error, _, _ = import_target(data, user_id, path)
+        if error:
+            bot.reply_to(message, error)
+            return
+        msg = bot.reply_to(message, "Отправьте ZIP-архив: его содержимое будет добавлено в текущую папку.")
+        bot.register_next_step_handler(msg, lambda m: handle_import_archive(m, path))
+
+    def handle_import_archive(message: Message, path):
+        error = import_request_error(message)
+        if error:
+            bot.reply_to(message, error)
+            return
+        params = {"file_id": message.document.file_id, "user_id": str(message.chat.id), "path": path,
+                  "name": message.document.file_name or "archive.zip"}
+        # Распаковка и загрузка файлов идут фоновой задачей, затем — один коммит
+        if get_jobs().submit("import", message.chat.id, params) is None:
+            bot.reply_to(message, "Дождитесь завершения предыдущих задач.")
+            return
+        bot.reply_to(message, "Импортирую архив...")
+
     @bot.message_handler(commands=['share'])
     def handle_share(message: Message):
         user_id = str(message.chat.id)
@@ -223,10 +352,11 @@ def register_command_handlers(bot: telebot.TeleBot):
             return
 
         # Генерация клавиатуры для публичной папки
-        markup = generate_markup(shared_folder, path, shared_key=access_key)
+        markup = generate_markup(shared_folder, path, shared_key=access_key,
+                                 items_per_page=user_page_size(data, user_id))
 
         try:
-            bot.send_message(message.chat.id, "Содержимое публичной папки:", reply_markup=markup)
+            remember_markup(bot.send_message(message.chat.id, "Содержимое публичной папки:", reply_markup=markup), markup)
         except telebot.apihelper.ApiTelegramException as e:
             bot.send_message(message.chat.id, f"Ошибка при отправке клавиатуры: {str(e)}")
 
@@ -254,18 +384,18 @@ def register_command_handlers(bot: telebot.TeleBot):
             bot.reply_to(message, f"Проект `{project_name}` уже существует.")
             return
 
-        # Инициализация Git-проекта
-        init_project(data, user_id, project_name)
-
-        # Также создаём папку с именем проекта для хранения файлов
+        # Также создаём папку с именем проекта для хранения файлов.
+        # Данные общие для всех обработчиков, поэтому проверяем папку до изменения проектов.
         current = navigate_to_path(data["users"][user_id]["structure"], data["users"][user_id]["current_path"])
         if project_name in current["folders"]:
             bot.reply_to(message, f"Папка `{project_name}` уже существует.")
             return
-        else:
-            current["folders"][project_name] = {"folders": {}, "files": []}
 
-        save_data(data)
+        # Инициализация Git-проекта
+        with project_lock(user_id, project_name):
+            init_project(data, user_id, project_name)
+            current["folders"][project_name] = {"folders": {}, "files": []}
+            save_data(data)
         bot.reply_to(message, f"Git-проект `{project_name}` успешно инициализирован.")
 
     @bot.message_handler(commands=['commit'])
@@ -287,9 +417,47 @@ def register_command_handlers(bot: telebot.TeleBot):
             bot.reply_to(message, f"Проект `{project_name}` не найден. Используйте /initgit для его создания.")
             return
 
-        commit_id = create_commit(data, user_id, project_name, commit_message)
-        save_data(data)
-        bot.reply_to(message, f"Коммит создан. ID коммита: {commit_id}")
+        with project_lock(user_id, project_name):
+            commit_id = create_commit(data, user_id, project_name, commit_message)
+            save_data(data)
+        bot.reply_to(message, f"Коммит создан. ID коммита: {short_commit_id(commit_id)}")
+
+    @bot.message_handler(commands=['autocommit'])
+    def handle_autocommit(message: Message):
+        user_id = str(message.chat.id)
+        data = load_data()
+        init_user(data, user_id)
+
+        args = message.text.split()[1:]
+        if len(args) not in (1, 2) or (len(args) == 2 and args[1] not in AUTOCOMMIT_MODES):
+            bot.reply_to(message, "Использование: /autocommit <название.git> [immediate|debounced|manual]")
+            return
+        project_name = args[0]
+        if "projects" not in data or project_name not in data["projects"].get(user_id, {}):
+            bot.reply_to(message, f"Проект `{project_name}` не найден.")
+            return
+
+        if len(args) == 2:
+            with project_lock(user_id, project_name):
+                set_autocommit_mode(data, user_id, project_name, args[1])
+                save_data(data)
+        bot.reply_to(message, format_autocommit_mode(project_name, get_autocommit_mode(data, user_id, project_name)))
+
+    @bot.message_handler(commands=['pagesize'])
+    def handle_pagesize(message: Message):
+        user_id = str(message.chat.id)
+        data = load_data()
+        init_user(data, user_id)
+
+        args = message.text.split()[1:]
+        if args:
+            page_size = parse_page_size(args[0])
+            if page_size is None or len(args) > 1:
+                bot.reply_to(message, f"Использование: /pagesize [1-{MAX_FOLDER_PAGE_SIZE}]")
+                return
+            set_page_size(data, user_id, page_size)
+            save_data(data)
+        bot.reply_to(message, f"Элементов на странице папки: {user_page_size(data, user_id)}.")
 
     @bot.message_handler(commands=['branch'])
     def handle_branch(message: Message):
@@ -310,9 +478,11 @@ def register_command_handlers(bot: telebot.TeleBot):
             bot.reply_to(message, f"Проект `{project_name}` не найден. Используйте /initgit для его создания.")
             return
 
-        success = create_branch(data, user_id, project_name, branch_name)
+        with project_lock(user_id, project_name):
+            success = create_branch(data, user_id, project_name, branch_name)
+            if success:
+                save_data(data)
         if success:
-            save_data(data)
             bot.reply_to(message, f"Ветка `{branch_name}` успешно создана и переключились на неё в проекте `{project_name}`.")
         else:
             bot.reply_to(message, f"Ветка `{branch_name}` уже существует в проекте `{project_name}`.")
@@ -337,14 +507,7 @@ def register_command_handlers(bot: telebot.TeleBot):
             return
 
         project = data["projects"][user_id][project_name]
-        branches = list(project["branches"].keys())
-        markup = types.InlineKeyboardMarkup()
-        for branch_name in branches:
-            markup.add(
-                types.InlineKeyboardButton(
-                    branch_name, callback_data=f"switch_to_branch:{project_name}:{branch_name}"
-                )
-            )
+        markup = generate_branch_markup(project_name, project["branches"])
         bot.send_message(message.chat.id, "Выберите ветку для переключения:", reply_markup=markup)
 
     @bot.message_handler(commands=['log'])
@@ -367,26 +530,16 @@ def register_command_handlers(bot: telebot.TeleBot):
             return
 
         project = data["projects"][user_id][project_name]
-        branch = project["branches"][project["current_branch"]]
-        commits = branch["commits"]
+        commits = get_branch_commits(data, user_id, project_name)
 
         if not commits:
             bot.reply_to(message, f"В проекте `{project_name}` нет коммитов.")
             return
 
         log_message = f"История коммитов для `{project_name}` (ветка `{project['current_branch']}`):\n\n"
-
-        markup = telebot.types.InlineKeyboardMarkup()
-
-        for commit in reversed(commits):  # Отображаем коммиты от новых к старым
-            log_message += f"Commit ID: {commit['commit_id']}\nMessage: {commit['message']}\n\n"
-            # Добавляем кнопку для отката
-            markup.add(telebot.types.InlineKeyboardButton(
-                f"Откатиться к коммиту {commit['commit_id']}",
-                callback_data=f"rollback_commit:{project_name}:{commit['commit_id']}"
-            ))
-
-        bot.send_message(message.chat.id, log_message, reply_markup=markup)
+        # Отображаем коммиты от новых к старым
+        log_message += "".join(format_commit(commit) for commit in reversed(commits))
+        bot.send_message(message.chat.id, log_message, reply_markup=generate_rollback_markup(project_name, commits))
 
     @bot.message_handler(commands=['rollback'])
     def handle_rollback(message: Message):
@@ -399,7 +552,7 @@ def register_command_handlers(bot: telebot.TeleBot):
             if not project_name.endswith('.git'):
                 bot.reply_to(message, "Название проекта должно заканчиваться на `.git`.")
                 return
-            commit_id = int(commit_id)
+            commit_id = commit_id.strip()
         except ValueError:
             bot.reply_to(message, "Использование: /rollback <название.git> <commit_id>")
             return
@@ -408,9 +561,11 @@ def register_command_handlers(bot: telebot.TeleBot):
             bot.reply_to(message, f"Проект `{project_name}` не найден.")
             return
 
-        success = rollback_to_commit(data, user_id, project_name, commit_id)
+        with project_lock(user_id, project_name):
+            success = rollback_to_commit(data, user_id, project_name, commit_id)
+            if success:
+                save_data(data)
         if success:
-            save_data(data)
             bot.reply_to(
                 message,
                 f"Откат выполнен до коммита `{commit_id}` в проекте `{project_name}`."
@@ -437,15 +592,16 @@ def register_command_handlers(bot: telebot.TeleBot):
             bot.reply_to(message, f"Проект `{project_name}` не найден.")
             return
 
-        success = merge_branches(data, user_id, project_name, source_branch_name, target_branch_name)
-        if success:
-            save_data(data)
-            bot.reply_to(
-                message,
-                f"Ветка `{source_branch_name}` успешно влита в ветку `{target_branch_name}` проекта `{project_name}`."
-            )
-        else:
+        with project_lock(user_id, project_name):
+            result = merge_branches(data, user_id, project_name, source_branch_name, target_branch_name)
+            if result is not None and result["status"] != "up_to_date":
+                save_data(data)
+        if result is None:
             bot.reply_to(message, f"Ошибка при слиянии веток. Проверьте, что ветки существуют.")
+        elif result["status"] == "up_to_date":
+            bot.reply_to(message, f"Ветка `{target_branch_name}` уже содержит все изменения ветки `{source_branch_name}`.")
+        else:
+            bot.reply_to(message, format_merge_result(result, project_name, source_branch_name, target_branch_name))
 
     @bot.message_handler(commands=['invite'])
     def handle_invite(message: Message):
@@ -475,12 +631,15 @@ def register_command_handlers(bot: telebot.TeleBot):
 
         # Добавляем пользователя в список участников проекта
         project = data["projects"][user_id][project_name]
-        if "collaborators" not in project:
-            project["collaborators"] = []
-
-        if invitee_user_id not in project["collaborators"]:
-            project["collaborators"].append(invitee_user_id)
-            save_data(data)
+        with project_lock(user_id, project_name):
+            if "collaborators" not in project:
+                project["collaborators"] = []
+            invited = invitee_user_id not in project["collaborators"]
+            if invited:
+                project["collaborators"].append(invitee_user_id)
+                save_data(data)
+
+        if invited:
             bot.reply_to(message, f"Пользователь `{invitee_username}` приглашен в проект `{project_name}`.")
             # Отправляем приглашенному пользователю уведомление
             try:
@@ -0,0 +1,21 @@
+# handlers/inline_handlers.py
+from telebot.types import InlineQuery
+from utils.data_manager import load_data
+from utils.inline import answer_page
+from config import INLINE_CACHE_TTL
+import telebot
+import logging
+
+logger = logging.getLogger(__name__)
+
+def register_inline_handlers(bot: telebot.TeleBot):
+    @bot.inline_handler(func=lambda query: True)
+    def handle_inline_query(query: InlineQuery):
+        # В личном чате id чата совпадает с id пользователя, под ним и лежат его файлы
+        user_id = str(query.from_user.id)
+        try:
+            results, next_offset = answer_page(load_data, user_id, query.query, query.offset)
+            bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_TTL, is_personal=True,
+                                    next_offset=next_offset)
+        except Exception as e:
+            logger.error(f"Ошибка при ответе на inline-запрос: {e}")
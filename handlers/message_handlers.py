@@ -1,9 +1,12 @@
 # handlers/message_handlers.py
 from telebot.types import Message
-from utils.data_manager import load_data, save_data, init_user, create_commit, get_current_branch_structure, set_current_branch_structure, is_project_member
+from utils.data_manager import load_data, save_data, init_user, autocommit, autocommit_reply, get_current_branch_structure, set_current_branch_structure, is_project_member, new_short_id, place_file
 from utils.navigation import navigate_to_path
+from utils.objects import touch_path
+from utils.locks import project_lock
+from utils.retrieval import message_file_id, message_caption
+from utils.stored_files import upload_key, find_stored, stored_fields
 import telebot
-import uuid
 import logging
 from config import DATA_CHAT_ID
 
@@ -35,93 +38,102 @@ def register_message_handlers(bot: telebot.TeleBot):
                 bot.reply_to(message, f"Проект `{project_name}` не найден.")
                 return
 
-            # Получаем структуру текущей ветки
-            branch_structure = get_current_branch_structure(data, owner_id, project_name)
-            # Навигация внутри проекта
-            project_path = current_path[current_path.index(project_name)+1:]
-            current_project_folder = navigate_to_path(branch_structure, project_path)
-
             # Обработка файла
             if message.content_type == 'text':
                 content = message.text
                 file_type = 'text'
-                file_name = f"message_{uuid.uuid4().hex[:8]}"
+                short_id = new_short_id(data)
+                file_name = f"message_{short_id}"
                 file_entry = {
                     "type": file_type,
                     "content": content,
-                    "short_id": uuid.uuid4().hex[:8],
+                    "short_id": short_id,
                     "name": file_name
                 }
             else:
                 try:
-                    copied_message = bot.copy_message(
-                        chat_id=DATA_CHAT_ID,
-                        from_chat_id=message.chat.id,
-                        message_id=message.message_id
-                    )
+                    # Уже сохранённый в DATA_CHAT_ID файл повторно не копируется
+                    key = upload_key(message)
+                    stored = find_stored(data, key)
+                    if stored is None:
+                        copied_message = bot.copy_message(
+                            chat_id=DATA_CHAT_ID,
+                            from_chat_id=message.chat.id,
+                            message_id=message.message_id
+                        )
+                        stored = {"message_id": copied_message.message_id, "file_id": message_file_id(message)}
                     file_type = message.content_type
-                    file_name = message.document.file_name if message.document else f"file_{uuid.uuid4().hex[:8]}"
+                    short_id = new_short_id(data)
+                    file_name = message.document.file_name if message.document else f"file_{short_id}"
                     file_entry = {
                         "type": file_type,
-                        "message_id": copied_message.message_id,
-                        "short_id": uuid.uuid4().hex[:8],
+                        **stored_fields(key, stored),
+                        **message_caption(message),
+                        "short_id": short_id,
                         "name": file_name
                     }
-                    data["users"][user_id]["file_mappings"][file_entry["short_id"]] = copied_message.message_id
                 except Exception as e:
                     logger.error(f"Ошибка при копировании сообщения: {e}")
                     bot.reply_to(message, f"Ошибка при сохранении {message.content_type}.")
                     return
 
-            # Проверяем наличие файла с таким же именем и заменяем его
-            existing_files = current_project_folder["files"]
-            for idx, existing_file in enumerate(existing_files):
-                if existing_file["name"] == file_name:
-                    existing_files[idx] = file_entry
-                    break
-            else:
-                # Если файл с таким именем не найден, добавляем новый
-                existing_files.append(file_entry)
+            # Копирование файла выше выполняется без блокировки проекта,
+            # под ней — только изменение структуры ветки и коммит
+            with project_lock(owner_id, project_name):
+                # Получаем структуру текущей ветки
+                branch_structure = get_current_branch_structure(data, owner_id, project_name)
+                # Навигация внутри проекта
+                project_path = current_path[current_path.index(project_name)+1:]
+                current_project_folder = navigate_to_path(branch_structure, project_path)
+
+                # Файл с таким же именем заменяется, иначе добавляется новый
+                place_file(data, current_project_folder, file_entry, owner_id, project_path,
+                           project_name=project_name, replace=True)
 
-            # Обновляем структуру ветки
-            set_current_branch_structure(data, owner_id, project_name, branch_structure)
+                # Обновляем структуру ветки
+                touch_path(branch_structure, project_path)
+                set_current_branch_structure(data, owner_id, project_name, branch_structure)
 
-            # Создаем коммит автоматически
-            commit_message = f"Автоматический коммит: добавлен/обновлен {file_type} '{file_name}'"
-            commit_id = create_commit(data, owner_id, project_name, commit_message)
+                # Коммит создаётся сразу или откладывается в зависимости от режима проекта
+                commit_id = autocommit(data, owner_id, project_name, f"{file_type} '{file_name}'")
+                reply = autocommit_reply(data, owner_id, project_name, commit_id)
 
-            save_data(data)
-            bot.reply_to(message, f"{file_type.capitalize()} '{file_name}' сохранено и закоммичено в проект `{project_name}`.")
+                save_data(data)
+            bot.reply_to(message, f"{file_type.capitalize()} '{file_name}' сохранено {reply}. ID: {short_id}")
         else:
             # Обычная обработка файлов вне Git-проекта
             current = navigate_to_path(data["users"][user_id]["structure"], current_path)
             if message.content_type == 'text':
-                short_id = uuid.uuid4().hex[:8]
-                current["files"].append({
+                short_id = new_short_id(data)
+                place_file(data, current, {
                     "type": "text",
                     "content": message.text,
                     "short_id": short_id,
                     "name": f"message_{short_id}"
-                })
+                }, user_id, current_path)
                 save_data(data)
-                bot.reply_to(message, "Текстовое сообщение сохранено в текущей папке.")
+                bot.reply_to(message, f"Текстовое сообщение сохранено в текущей папке. ID: {short_id}")
             else:
                 try:
-                    copied_message = bot.copy_message(
-                        chat_id=DATA_CHAT_ID,
-                        from_chat_id=message.chat.id,
-                        message_id=message.message_id
-                    )
-                    short_id = uuid.uuid4().hex[:8]
-                    current["files"].append({
+                    key = upload_key(message)
+                    stored = find_stored(data, key)
+                    if stored is None:
+                        copied_message = bot.copy_message(
+                            chat_id=DATA_CHAT_ID,
+                            from_chat_id=message.chat.id,
+                            message_id=message.message_id
+                        )
+                        stored = {"message_id": copied_message.message_id, "file_id": message_file_id(message)}
+                    short_id = new_short_id(data)
+                    place_file(data, current, {
                         "type": message.content_type,
-                        "message_id": copied_message.message_id,
+                        **stored_fields(key, stored),
+                        **message_caption(message),
                         "short_id": short_id,
                         "name": message.document.file_name if message.document else f"file_{short_id}"
-                    })
-                    data["users"][user_id]["file_mappings"][short_id] = copied_message.message_id
+                    }, user_id, current_path)
                     save_data(data)
-                    bot.reply_to(message, f"{message.content_type.capitalize()} сохранено в текущей папке.")
+                    bot.reply_to(message, f"{message.content_type.capitalize()} сохранено в текущей папке. ID: {short_id}")
                 except Exception as e:
                     logger.error(f"Ошибка при копировании сообщения: {e}")
                     bot.reply_to(message, f"Ошибка при сохранении {message.content_type}.")
@@ -0,0 +1,101 @@
+# utils/async_runtime.py
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from config import STORAGE_THREADS
+from utils.data_manager import data_session
+
+# В асинхронном режиме все обращения к данным выполняются в небольшом пуле
+# потоков: ленивые хранилища (sharded, sqlite) читают диск, а load_data() и
+# save_data() учитывают затронутые шарды по потоку. Поэтому вся цепочка
+# load_data() -> изменения -> save_data() одного обработчика передаётся
+# в run_storage() одной функцией: она же выполняется внутри data_session(),
+# чтобы фоновый сброс не сериализовал данные посреди изменений.
+
+_executor = None
+
+
+def get_storage_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=STORAGE_THREADS, thread_name_prefix="storage")
+    return _executor
+
+
+def shutdown_storage_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _in_session(func, *args, **kwargs):
+    with data_session():
+        return func(*args, **kwargs)
+
+
+async def run_storage(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_storage_executor(), functools.partial(_in_session, func, *args, **kwargs))
+
+
+class AsyncLockManager:
+    """Асинхронный аналог utils.locks.LockManager для корутин одного цикла событий."""
+
+    def __init__(self):
+        self._locks = {}  # ключ -> [asyncio.Lock, число владельцев и ожидающих]
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+_user_locks = AsyncLockManager()
+
+
+def event_user_id(event):
+    """id чата пользователя для сообщения или нажатия кнопки."""
+    message = getattr(event, "message", None) or event
+    return str(message.chat.id)
+
+
+def hold_user(user_id):
+    """Очередь пользователя для кода вне обработчиков (фоновые задачи), как в per_user."""
+    return _user_locks.hold(str(user_id))
+
+
+def per_user(handler):
+    """Обработчики одного пользователя выполняются по очереди, разных — параллельно."""
+    @functools.wraps(handler)
+    async def wrapper(event):
+        async with _user_locks.hold(event_user_id(event)):
+            return await handler(event)
+    return wrapper
+
+
+# Ожидание ввода текста после нажатия кнопки (аналог register_next_step_handler,
+# которого нет в AsyncTeleBot): user_id -> корутина-обработчик следующего сообщения
+_pending_input = {}
+
+
+def expect_input(user_id, callback):
+    _pending_input[str(user_id)] = callback
+
+
+def has_pending_input(message):
+    return str(message.chat.id) in _pending_input
+
+
+def pop_pending_input(user_id):
+    return _pending_input.pop(str(user_id), None)
@@ -0,0 +1,85 @@
+# utils/autocommit.py
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Автоматические коммиты в Git-проектах. Режим задаётся для проекта
+# (project["autocommit"], по умолчанию AUTOCOMMIT_MODE из config.py):
+#   "immediate" — коммит после каждого загруженного файла;
+#   "debounced" — загрузки в ветку копятся и коммитятся одним коммитом,
+#                 когда AUTOCOMMIT_DELAY секунд не было новых (но не позже
+#                 AUTOCOMMIT_MAX_DELAY после первой);
+#   "manual"    — загрузки ждут явного /commit.
+# Любой коммит ветки (/commit, импорт) включает и накопленные изменения.
+# Таймеры "debounced" живут в памяти: при обычной остановке накопленное
+# коммитится сразу (flush_autocommits), а описания изменений хранятся и в
+# ветке ("pending_changes"), так что после аварийной остановки коммит
+# планируется заново при запуске (recover_autocommits).
+
+AUTOCOMMIT_MODES = ("immediate", "debounced", "manual")
+MAX_LISTED_CHANGES = 10
+
+
+def combined_message(changes):
+    if len(changes) == 1:
+        return f"Автоматический коммит: добавлен/обновлен {changes[0]}"
+    listed = ", ".join(changes[:MAX_LISTED_CHANGES])
+    if len(changes) > MAX_LISTED_CHANGES:
+        listed += f" и ещё {len(changes) - MAX_LISTED_CHANGES}"
+    return f"Автоматический коммит: добавлено/обновлено файлов {len(changes)}: {listed}"
+
+
+class CommitCoalescer:
+    """Накопленные незакоммиченные изменения по ключу (владелец, проект, ветка).
+
+    add() с задержкой (пере)запускает таймер ключа; по его срабатыванию
+    вызывается on_due(key) в отдельном потоке. take() забирает изменения
+    и отменяет таймер.
+    """
+
+    def __init__(self, on_due, max_delay=None):
+        self.on_due = on_due
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._pending = {}  # ключ -> {"changes": [...], "first": время первого, "timer": Timer}
+
+    def add(self, key, change, delay=None):
+        with self._lock:
+            entry = self._pending.setdefault(key, {"changes": [], "first": time.monotonic(), "timer": None})
+            entry["changes"].append(change)
+            if delay is None:
+                return
+            if entry["timer"] is not None:
+                entry["timer"].cancel()
+            if self.max_delay is not None:
+                delay = max(0.0, min(delay, entry["first"] + self.max_delay - time.monotonic()))
+            timer = entry["timer"] = threading.Timer(delay, self._fire, args=(key,))
+            timer.daemon = True
+            timer.start()
+
+    def _fire(self, key):
+        try:
+            self.on_due(key)
+        except Exception as e:
+            logger.error(f"Ошибка отложенного автокоммита {key}: {e}")
+
+    def take(self, key):
+        """Забирает накопленные изменения ключа (пустой список, если их нет)."""
+        with self._lock:
+            entry = self._pending.pop(key, None)
+        if entry is None:
+            return []
+        if entry["timer"] is not None:
+            entry["timer"].cancel()
+        return entry["changes"]
+
+    def pending(self, key):
+        with self._lock:
+            entry = self._pending.get(key)
+            return len(entry["changes"]) if entry else 0
+
+    def keys(self, scheduled_only=False):
+        with self._lock:
+            return [key for key, entry in self._pending.items() if not scheduled_only or entry["timer"] is not None]
@@ -0,0 +1,189 @@
+# utils/callbacks.py
+import base64
+import binascii
+import hashlib
+import threading
+from collections import OrderedDict
+from config import CALLBACK_TOKENS
+
+# Кодирование callback_data кнопок (Telegram принимает не больше 64 байт).
+# Действие записывается одним символом, аргументы — через "|":
+#   - "hex" (ключ общей папки, id задачи) — байтами в base64url:
+#     32 шестнадцатеричных символа превращаются в 22;
+#   - "int" (курсор страницы, номер страницы поиска) — в base36;
+#   - "str" (имена папок, проектов, веток, id файлов) — как есть.
+# Строка, которая не влезает в 64 байта, содержит "|" или начинается с "~",
+# заменяется токеном "~<хеш>": значение хранится на сервере в ограниченной
+# LRU-таблице. Токен зависит только от значения, поэтому повторная отрисовка
+# той же клавиатуры даёт те же кнопки, а после перезапуска бота или
+# вытеснения токена кнопка просто просит открыть папку заново.
+#
+# decode() возвращает (действие, аргументы) для словаря обработчиков, так что
+# выбор обработчика — одно обращение к словарю. Кнопки старого формата
+# "действие:аргументы" из уже отправленных сообщений тоже разбираются.
+
+MAX_CALLBACK_BYTES = 64
+SEPARATOR = "|"
+TOKEN_PREFIX = "~"
+CURSOR_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+# В старом формате page и shared_page несли десятичный номер страницы по 5 элементов
+LEGACY_PAGE_SIZE = 5
+LEGACY_CURSOR_ACTIONS = {"page", "shared_page"}
+
+# действие -> (код, типы аргументов)
+ACTIONS = {
+    "up": ("U", ()),
+    "shared_up": ("V", ("hex",)),
+    "page": ("P", ("int",)),
+    "shared_page": ("Q", ("hex", "int")),
+    "folder": ("F", ("str",)),
+    "shared_folder": ("G", ("hex", "str")),
+    "file": ("D", ("str",)),
+    "shared_file": ("E", ("hex", "str")),
+    "retrieve_all": ("R", ()),
+    "shared_retrieve_all": ("S", ("hex",)),
+    "retrieve_all_project": ("T", ()),
+    "export": ("X", ()),
+    "shared_export": ("Y", ("hex",)),
+    "exit_project": ("Z", ()),
+    "create_branch_project": ("B", ("str",)),
+    "log_project": ("L", ("str",)),
+    "switch_branch_project": ("W", ("str",)),
+    "invite_member": ("I", ("str",)),
+    "switch_to_branch": ("C", ("str", "str")),
+    "rollback_commit": ("K", ("str", "str")),
+    "find_page": ("N", ("int",)),
+    "find_go": ("O", ("str",)),
+    "job_cancel": ("J", ("hex",)),
+}
+_BY_CODE = {code: (action, kinds) for action, (code, kinds) in ACTIONS.items()}
+
+
+class TokenTable:
+    """Длинные аргументы кнопок: токен -> значение, вытесняются самые давние."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+
+    def put(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=6).digest()
+        token = TOKEN_PREFIX + base64.urlsafe_b64encode(digest).decode('ascii')
+        with self._lock:
+            self._values[token] = value
+            self._values.move_to_end(token)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+        return token
+
+    def get(self, token):
+        with self._lock:
+            value = self._values.get(token)
+            if value is not None:
+                self._values.move_to_end(token)
+            return value
+
+
+_tokens = TokenTable(CALLBACK_TOKENS)
+
+
+def encode_int(number):
+    text = ""
+    while True:
+        number, digit = divmod(number, 36)
+        text = CURSOR_DIGITS[digit] + text
+        if not number:
+            return text
+
+
+def decode_int(text):
+    try:
+        return max(0, int(text, 36))
+    except ValueError:
+        return 0
+
+
+def _pack_arg(kind, value):
+    value = str(value)
+    if kind == "int":
+        return encode_int(int(value))
+    if kind == "hex" and value and len(value) % 2 == 0 and value == value.lower():
+        try:
+            return base64.urlsafe_b64encode(bytes.fromhex(value)).decode('ascii').rstrip("=")
+        except ValueError:
+            pass  # Не шестнадцатеричная строка — остаётся как есть или уходит в токен
+    if kind == "hex" or SEPARATOR in value or value.startswith(TOKEN_PREFIX):
+        return _tokens.put(value)
+    return value
+
+
+def _unpack_arg(kind, text):
+    if text.startswith(TOKEN_PREFIX):
+        return _tokens.get(text)
+    if kind == "int":
+        return decode_int(text)
+    if kind == "hex":
+        try:
+            return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4)).hex()
+        except (binascii.Error, ValueError):
+            return None
+    return text
+
+
+def encode(action, *args):
+    """callback_data кнопки действия action."""
+    code, kinds = ACTIONS[action]
+    parts = [_pack_arg(kind, value) for kind, value in zip(kinds, args)]
+    data = SEPARATOR.join([code] + parts)
+    # Самые длинные строковые аргументы по очереди заменяются токенами
+    while len(data.encode('utf-8')) > MAX_CALLBACK_BYTES:
+        candidates = [i for i, part in enumerate(parts) if not part.startswith(TOKEN_PREFIX)]
+        if not candidates:
+            raise ValueError(f"callback_data длиннее {MAX_CALLBACK_BYTES} байт: {action}")
+        longest = max(candidates, key=lambda i: len(parts[i].encode('utf-8')))
+        parts[longest] = _tokens.put(str(args[longest]))
+        data = SEPARATOR.join([code] + parts)
+    return data
+
+
+def _decode_legacy(data):
+    action, _, rest = data.partition(":")
+    if action not in ACTIONS:
+        return None
+    kinds = ACTIONS[action][1]
+    if not kinds:
+        return (action, ()) if not rest else None
+    # Последний аргумент забирает остаток строки (имя папки может содержать ":")
+    parts = rest.split(":", len(kinds) - 1)
+    if len(parts) != len(kinds):
+        return None
+    # Старые кнопки отката несут числовой id коммита ветки: он остаётся строкой и
+    # переводится в id-хеш по project["numeric_ids"] при откате (utils/history.py)
+    args = []
+    for kind, part in zip(kinds, parts):
+        if kind == "int":
+            try:
+                number = max(0, int(part))
+            except ValueError:
+                return None
+            part = number * LEGACY_PAGE_SIZE if action in LEGACY_CURSOR_ACTIONS else number
+        args.append(part)
+    return action, tuple(args)
+
+
+def decode(data):
+    """(действие, аргументы) или None для неизвестной или устаревшей кнопки."""
+    if not data:
+        return None
+    entry = _BY_CODE.get(data[0])
+    if entry is None or (len(data) > 1 and data[1] != SEPARATOR):
+        return _decode_legacy(data)
+    action, kinds = entry
+    parts = data.split(SEPARATOR)[1:]
+    if len(parts) != len(kinds):
+        return None
+    args = tuple(_unpack_arg(kind, part) for kind, part in zip(kinds, parts))
+    if any(arg is None for arg in args):
+        return None
+    return action, args
@@ -1,58 +1,124 @@
 # utils/data_manager.py
-import json
-import os
-from config import DATA_FILE
+from config import (
+    DATA_FILE, DATA_DIR, SQLITE_PATH, STORAGE_BACKEND, FLUSH_INTERVAL, FLUSH_MAX_PENDING,
+    AUTOCOMMIT_MODE, AUTOCOMMIT_DELAY, AUTOCOMMIT_MAX_DELAY, FOLDER_PAGE_SIZE
+)
+from utils.data_store import DataStore, read_data_file, write_data_file
+from utils.storage import create_backend
+from utils.objects import ensure_object_store, write_blob, write_tree, read_tree, checkout_tree
+from utils.navigation import navigate_to_path, invalidate_tree, find_file_by_id, find_folder_path, put_file
+from utils.history import (
+    get_commit,
+    add_commit,
+    branch_log,
+    resolve_commit,
+    merge_commits,
+    short_commit_id,
+    prune_history,
+    migrate_branch_commits,
+    migrate_numeric_ids
+)
+from utils.autocommit import CommitCoalescer, combined_message
+from utils.search import get_search_index, walk_files, search_blobs, query_tokens, snippet, PAGE_SIZE
+from utils.locks import project_lock
+from utils.stored_files import register_stored, add_refs, release_refs
+import threading
+import uuid
+from contextlib import nullcontext
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Общее хранилище, инициализируется один раз при запуске бота
+_store = None
+
+def init_data_store(kind=STORAGE_BACKEND):
+    global _store
+    backend = create_backend(kind, DATA_FILE, data_dir=DATA_DIR, sqlite_path=SQLITE_PATH,
+                             normalize_data=update_data_format,
+                             normalize_user=normalize_user,
+                             normalize_project=normalize_project)
+    store = DataStore(backend, flush_interval=FLUSH_INTERVAL, flush_max_pending=FLUSH_MAX_PENDING)
+    store.load()
+    _store = store
+    return store
+
+def get_data_store():
+    return _store
+
 def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {"users": {}, "shared_folders": {}, "projects": {}, "usernames": {}}
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            data = update_data_format(data)
-            return data
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка декодирования JSON: {e}")
-        return {"users": {}, "shared_folders": {}, "projects": {}, "usernames": {}}
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке данных: {e}")
-        return {"users": {}, "shared_folders": {}, "projects": {}, "usernames": {}}
+    if _store is not None:
+        _store.begin()
+        return _store.data
+    return update_data_format(read_data_file(DATA_FILE))
+
+def data_session():
+    """Обработка, меняющая данные: фоновый сброс не сериализует их посреди неё."""
+    if _store is None:
+        return nullcontext()
+    return _store.session()
 
 def save_data(data):
     try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
+        if _store is not None and data is _store.data:
+            # Запись откладывается и объединяется фоновым потоком хранилища
+            _store.mark_dirty()
+        else:
+            write_data_file(DATA_FILE, data)
     except Exception as e:
         logger.error(f"Ошибка при сохранении данных: {e}")
 
+def normalize_user(user_data):
+    if "file_mappings" not in user_data:
+        user_data["file_mappings"] = {}
+    if "username" not in user_data:
+        user_data["username"] = None
+    return user_data
+
+def normalize_project(project_data):
+    if "current_branch" not in project_data:
+        project_data["current_branch"] = "master"
+    if "collaborators" not in project_data:
+        project_data["collaborators"] = []
+    # Снимки коммитов хранятся деревьями объектов, а не полными копиями структуры
+    ensure_object_store(project_data)
+    branches = project_data.setdefault("branches", {})
+    for branch_data in branches.values():
+        for commit in branch_data.get("commits", []):
+            if "structure" in commit:
+                commit["tree"] = write_tree(project_data, commit.pop("structure"))
+    # Списки коммитов в ветках переводим в общий граф, ветки становятся ссылками на коммит
+    if "commits" not in project_data or any("commits" in branch_data for branch_data in branches.values()):
+        migrate_branch_commits(project_data)
+    migrate_numeric_ids(project_data)
+    for branch_data in branches.values():
+        branch_data.setdefault("head", None)
+        if "structure" not in branch_data and not branch_data.get("tree"):
+            branch_data["structure"] = {"folders": {}, "files": []}
+    return project_data
+
 def update_data_format(data):
     # Обновление данных пользователей
     for user_id, user_data in data.get("users", {}).items():
-        if "file_mappings" not in user_data:
-            user_data["file_mappings"] = {}
-        if "username" not in user_data:
-            user_data["username"] = None
+        normalize_user(user_data)
     # Обновление данных проектов
     for user_id, projects in data.get("projects", {}).items():
         for project_name, project_data in projects.items():
-            if "current_branch" not in project_data:
-                project_data["current_branch"] = "master"
-            for branch_name, branch_data in project_data.get("branches", {}).items():
-                if "structure" not in branch_data:
-                    branch_data["structure"] = {"folders": {}, "files": []}
-                if "commits" not in branch_data:
-                    branch_data["commits"] = []
-            if "collaborators" not in project_data:
-                project_data["collaborators"] = []
+            normalize_project(project_data)
     # Инициализация usernames
     if "usernames" not in data:
         data["usernames"] = {}
+    # Глобальный индекс файлов строится один раз для данных, где его ещё нет
+    if "file_ids" not in data:
+        data["file_ids"] = build_file_index(data)
+    # Таблица файлов в DATA_CHAT_ID; у записей, сохранённых до неё, ключа нет
+    if "stored_files" not in data:
+        data["stored_files"] = {}
     return data
 
 def init_user(data, user_id, username=None):
+    # Возвращает True, если данные пользователя были изменены
+    changed = False
     if user_id not in data["users"]:
         data["users"][user_id] = {
             "current_path": [],
@@ -63,14 +129,18 @@ def init_user(data, user_id, username=None):
             "file_mappings": {},
             "username": username
         }
+        changed = True
     else:
         # Обновляем username, если он изменился
         if username and data["users"][user_id].get("username") != username:
             data["users"][user_id]["username"] = username
+            changed = True
 
     # Обновляем mapping username -> user_id
-    if username:
+    if username and data["usernames"].get(username.lower()) != user_id:
         data["usernames"][username.lower()] = user_id
+        changed = True
+    return changed
 
 def init_project(data, user_id, project_name):
     if user_id not in data["projects"]:
@@ -79,55 +149,158 @@ def init_project(data, user_id, project_name):
         data["projects"][user_id][project_name] = {
             "branches": {
                 "master": {
-                    "commits": [],
+                    "head": None,
                     "structure": {
                         "folders": {},
                         "files": []
                     }
                 }
             },
+            "commits": {},
             "current_branch": "master",
-            "collaborators": []
+            "collaborators": [],
+            "trees": {},
+            "blobs": {}
         }
 
-def create_commit(data, user_id, project_name, commit_message):
-    import copy
+def _branch_structure(project, branch):
+    # Рабочая копия ветки создаётся из её дерева только при первом обращении
+    if "structure" not in branch:
+        tree = branch.pop("tree", None)
+        branch["structure"] = read_tree(project, tree) if tree else {"folders": {}, "files": []}
+    return branch["structure"]
+
+def _write_objects(data, project, structure):
+    # Новые объекты blob — новые держатели сохранённых в DATA_CHAT_ID файлов
+    created = []
+    oid = write_tree(project, structure, created)
+    add_refs(data, created)
+    return oid
+
+def create_commit(data, user_id, project_name, commit_message, branch_name=None):
     project = data["projects"][user_id][project_name]
-    branch = project["branches"][project["current_branch"]]
+    branch_name = branch_name or project["current_branch"]
+    branch = project["branches"][branch_name]
+    structure = _branch_structure(project, branch)
+    # Коммит включает все накопленные автоматические изменения ветки
+    _autocommits.take((user_id, project_name, branch_name))
+    branch.pop("pending_changes", None)
+
+    # Сохраняем только изменившиеся объекты, неизменённые поддеревья общие с прошлыми коммитами
+    commit_id = add_commit(project, commit_message, _write_objects(data, project, structure), [branch.get("head")])
+    branch["head"] = commit_id
+    return commit_id
 
-    # Убедимся, что ключ 'structure' существует
-    if "structure" not in branch:
-        branch["structure"] = {"folders": {}, "files": []}
-
-    commit_id = len(branch["commits"]) + 1  # Простая генерация ID коммита
-    # Создаем копию текущей структуры проекта для сохранения в коммит
-    commit_structure = copy.deepcopy(branch["structure"])
-    commit = {
-        "commit_id": commit_id,
-        "message": commit_message,
-        "structure": commit_structure  # Сохраняем структуру в коммите
+def get_autocommit_mode(data, user_id, project_name):
+    return data["projects"][user_id][project_name].get("autocommit", AUTOCOMMIT_MODE)
+
+def set_autocommit_mode(data, user_id, project_name, mode):
+    # Накопленное при прежнем режиме коммитим сразу
+    commit_pending(data, user_id, project_name)
+    data["projects"][user_id][project_name]["autocommit"] = mode
+
+def autocommit(data, user_id, project_name, change):
+    """Учитывает автоматическое изменение ветки (change — описание, например "text 'a.txt'").
+
+    Возвращает id коммита, если он создан сразу (режим "immediate"), иначе None:
+    изменение войдёт в отложенный или следующий явный коммит.
+    """
+    project = data["projects"][user_id][project_name]
+    key = (user_id, project_name, project["current_branch"])
+    mode = get_autocommit_mode(data, user_id, project_name)
+    # Изменение запоминается и в ветке, чтобы после сбоя recover_autocommits() запланировало коммит снова
+    project["branches"][project["current_branch"]].setdefault("pending_changes", []).append(change)
+    _autocommits.add(key, change, AUTOCOMMIT_DELAY if mode == "debounced" else None)
+    if mode == "immediate":
+        return commit_pending(data, user_id, project_name)
+    return None
+
+def format_autocommit_mode(project_name, mode):
+    descriptions = {
+        "immediate": "коммит после каждого файла",
+        "debounced": f"один коммит на серию загрузок (через {AUTOCOMMIT_DELAY:g} с после последней)",
+        "manual": "только по /commit",
     }
-    branch["commits"].append(commit)
-    return commit_id
+    return f"Режим автокоммита проекта `{project_name}`: {mode} — {descriptions[mode]}."
+
+def autocommit_reply(data, user_id, project_name, commit_id):
+    """Окончание ответа о файле, сохранённом в проект, с учётом режима автокоммита."""
+    if commit_id is not None:
+        return f"и закоммичено в проект `{project_name}`"
+    if get_autocommit_mode(data, user_id, project_name) == "manual":
+        return f"в проект `{project_name}`, изменения войдут в следующий /commit"
+    return f"в проект `{project_name}`, коммит будет создан автоматически"
+
+def commit_pending(data, user_id, project_name, branch_name=None):
+    """Коммитит накопленные автоматические изменения ветки; None, если их нет."""
+    project = data["projects"][user_id][project_name]
+    branch_name = branch_name or project["current_branch"]
+    changes = _autocommits.take((user_id, project_name, branch_name))
+    if not changes:
+        return None
+    return create_commit(data, user_id, project_name, combined_message(changes), branch_name=branch_name)
+
+def _commit_due(key):
+    # Срабатывание таймера "debounced": отдельный поток, поэтому своя блокировка проекта
+    user_id, project_name, branch_name = key
+    with data_session(), project_lock(user_id, project_name):
+        data = load_data()
+        project = data["projects"].get(user_id, {}).get(project_name)
+        if project is None or branch_name not in project["branches"]:
+            _autocommits.take(key)
+            return
+        if commit_pending(data, user_id, project_name, branch_name):
+            save_data(data)
+
+def flush_autocommits():
+    """Коммитит все отложенные изменения (при остановке бота); "manual" не затрагивает."""
+    for key in _autocommits.keys(scheduled_only=True):
+        _commit_due(key)
+
+def recover_autocommits(data):
+    """Заново планирует изменения, не закоммиченные до прошлой остановки (при запуске бота).
+
+    Таймеры отложенных коммитов живут только в памяти, а при аварийной
+    остановке flush_autocommits() не вызывается; накопленные изменения
+    остаются в ветках ("pending_changes") и коммитятся через AUTOCOMMIT_DELAY.
+    """
+    recovered = 0
+    for user_id, projects in data["projects"].items():
+        for project_name, project in projects.items():
+            delay = None if project.get("autocommit", AUTOCOMMIT_MODE) == "manual" else AUTOCOMMIT_DELAY
+            for branch_name, branch in project["branches"].items():
+                changes = branch.get("pending_changes")
+                if not changes:
+                    continue
+                key = (user_id, project_name, branch_name)
+                for change in changes[:-1]:
+                    _autocommits.add(key, change)
+                _autocommits.add(key, changes[-1], delay)
+                recovered += 1
+    if recovered:
+        logger.info(f"Восстановлены незакоммиченные изменения веток: {recovered}")
+    return recovered
+
+_autocommits = CommitCoalescer(_commit_due, max_delay=AUTOCOMMIT_MAX_DELAY)
 
 def create_branch(data, user_id, project_name, branch_name):
-    import copy
     project = data["projects"][user_id][project_name]
     if branch_name in project["branches"]:
         return False
-    current_branch = project["current_branch"]
-    current_branch_data = project["branches"][current_branch]
-
-    # Убедимся, что ключи существуют
-    if "structure" not in current_branch_data:
-        current_branch_data["structure"] = {"folders": {}, "files": []}
-    if "commits" not in current_branch_data:
-        current_branch_data["commits"] = []
-
-    # Копируем структуру и коммиты текущей ветки
+    # Новая ветка начинается от коммита, в котором уже есть накопленные изменения
+    commit_pending(data, user_id, project_name)
+    current_branch_data = project["branches"][project["current_branch"]]
+
+    # Новая ветка — только ссылка на тот же коммит и дерево рабочей копии.
+    # Несохранённые изменения текущей ветки записываются в объекты (лишь изменённый путь),
+    # а сама рабочая копия новой ветки создаётся при первом обращении к ней.
+    if "structure" in current_branch_data:
+        base_tree = _write_objects(data, project, current_branch_data["structure"])
+    else:
+        base_tree = current_branch_data.get("tree")
     project["branches"][branch_name] = {
-        "commits": copy.deepcopy(current_branch_data["commits"]),
-        "structure": copy.deepcopy(current_branch_data["structure"])
+        "head": current_branch_data.get("head"),
+        "tree": base_tree
     }
     project["current_branch"] = branch_name
     return True
@@ -136,94 +309,109 @@ def switch_branch(data, user_id, project_name, branch_name):
     project = data["projects"][user_id][project_name]
     if branch_name not in project["branches"]:
         return False
+    commit_pending(data, user_id, project_name)
     project["current_branch"] = branch_name
     return True
 
 def get_current_branch_structure(data, user_id, project_name):
     project = data["projects"][user_id][project_name]
     branch = project["branches"][project["current_branch"]]
-
-    # Убедимся, что ключ 'structure' существует
-    if "structure" not in branch:
-        branch["structure"] = {"folders": {}, "files": []}
-
-    return branch["structure"]
+    return _branch_structure(project, branch)
 
 def set_current_branch_structure(data, user_id, project_name, structure):
     project = data["projects"][user_id][project_name]
     branch = project["branches"][project["current_branch"]]
-
-    # Убедимся, что ключ 'structure' существует
-    if "structure" not in branch:
-        branch["structure"] = {"folders": {}, "files": []}
-
+    branch.pop("tree", None)
     branch["structure"] = structure
 
-def rollback_to_commit(data, user_id, project_name, commit_id):
-    import copy
+def get_branch_commits(data, user_id, project_name):
     project = data["projects"][user_id][project_name]
     branch = project["branches"][project["current_branch"]]
+    return branch_log(project, branch.get("head"))
+
+def format_commit(commit):
+    text = f"Commit ID: {short_commit_id(commit['commit_id'])}\n"
+    if len(commit["parents"]) > 1:
+        text += "Merge: " + " ".join(short_commit_id(parent) for parent in commit["parents"]) + "\n"
+    return text + f"Message: {commit['message']}\n\n"
+
+def format_merge_result(result, project_name, source_branch_name, target_branch_name):
+    reply = f"Ветка `{source_branch_name}` успешно влита в ветку `{target_branch_name}` проекта `{project_name}`."
+    if result["status"] == "fast_forward":
+        reply += f"\nПеремотка до коммита `{short_commit_id(result['commit_id'])}`."
+    else:
+        reply += f"\nКоммит слияния: `{short_commit_id(result['commit_id'])}`."
+    conflicts = result["conflicts"]
+    if conflicts:
+        reply += f"\n\nКонфликты ({len(conflicts)}), оставлена версия из `{source_branch_name}`:\n"
+        reply += "\n".join(conflicts[:20])
+        if len(conflicts) > 20:
+            reply += f"\n... и ещё {len(conflicts) - 20}"
+    return reply
 
-    # Убедимся, что ключи существуют
-    if "commits" not in branch:
-        branch["commits"] = []
-    if "structure" not in branch:
-        branch["structure"] = {"folders": {}, "files": []}
+def rollback_to_commit(data, user_id, project_name, commit_id):
+    project = data["projects"][user_id][project_name]
+    branch = project["branches"][project["current_branch"]]
+    commit_pending(data, user_id, project_name)
 
-    commits = branch["commits"]
-    if commit_id < 1 or commit_id > len(commits):
+    # Откатиться можно только к коммиту из истории текущей ветки (id или его начало)
+    commit_id = resolve_commit(project, commit_id, branch.get("head"), project["current_branch"])
+    if commit_id is None:
         return False
-    # Откатываем коммиты
-    branch["commits"] = commits[:commit_id]
-    # Восстанавливаем структуру из указанного коммита
-    commit = commits[commit_id - 1]
-    branch["structure"] = copy.deepcopy(commit["structure"])
+    commit = get_commit(project, commit_id)
+    branch["head"] = commit_id
+    # Восстанавливаем структуру из указанного коммита, перестраивая только изменённые папки
+    structure = _branch_structure(project, branch)
+    checkout_tree(project, structure, commit["tree"])
+    invalidate_tree(structure)
+    reindex_branch(data, user_id, project_name, project["current_branch"])
+    # Убираем коммиты и объекты, недостижимые ни из одной ветки
+    release_refs(data, prune_history(project))
     return True
 
 def merge_branches(data, user_id, project_name, source_branch_name, target_branch_name):
-    import copy
+    """Трёхстороннее слияние ветки-источника в ветку-приёмник.
+
+    Возвращает None, если ветки не найдены, иначе словарь со статусом
+    ("up_to_date", "fast_forward", "merged"), id нового head приёмника
+    и списком конфликтных путей (при конфликте берётся версия источника).
+    """
     project = data["projects"][user_id][project_name]
 
     if source_branch_name not in project["branches"] or target_branch_name not in project["branches"]:
-        return False
+        return None
 
+    # Сливаются зафиксированные состояния веток, поэтому сначала коммитим накопленное
+    commit_pending(data, user_id, project_name, source_branch_name)
+    commit_pending(data, user_id, project_name, target_branch_name)
     source_branch = project["branches"][source_branch_name]
     target_branch = project["branches"][target_branch_name]
 
-    # Убедимся, что ключи существуют
-    if "commits" not in source_branch:
-        source_branch["commits"] = []
-    if "structure" not in source_branch:
-        source_branch["structure"] = {"folders": {}, "files": []}
-    if "commits" not in target_branch:
-        target_branch["commits"] = []
-    if "structure" not in target_branch:
-        target_branch["structure"] = {"folders": {}, "files": []}
-
-    # Слияние коммитов
-    target_branch["commits"].extend(copy.deepcopy(source_branch["commits"][len(target_branch["commits"]):]))
-
-    # Слияние структур
-    def merge_structures(target_structure, source_structure):
-        # Слияние файлов
-        source_files = {file['name']: file for file in source_structure.get('files', [])}
-        target_files = {file['name']: file for file in target_structure.get('files', [])}
-
-        # Заменяем файлы в ветке-приемнике файлами из ветки-источника
-        target_files.update(source_files)
-
-        target_structure['files'] = list(target_files.values())
-
-        # Рекурсивное слияние папок
-        for folder_name, source_folder in source_structure.get('folders', {}).items():
-            if folder_name not in target_structure['folders']:
-                target_structure['folders'][folder_name] = copy.deepcopy(source_folder)
-            else:
-                merge_structures(target_structure['folders'][folder_name], source_folder)
-
-    merge_structures(target_branch['structure'], source_branch['structure'])
-
-    return True
+    # Рабочую копию приёмника не создаём, если она ещё не открывалась — хватает её дерева
+    if "structure" in target_branch:
+        ours_tree = _write_objects(data, project, target_branch["structure"])
+    else:
+        ours_tree = target_branch.get("tree")
+
+    status, tree, conflicts = merge_commits(project, ours_tree, target_branch.get("head"), source_branch.get("head"))
+    if status == "fast_forward":
+        target_branch["head"] = source_branch["head"]
+    elif status == "merged":
+        target_branch["head"] = add_commit(
+            project,
+            f"Слияние ветки {source_branch_name} в {target_branch_name}",
+            tree,
+            [target_branch.get("head"), source_branch["head"]]
+        )
+    if status != "up_to_date":
+        if "structure" in target_branch:
+            checkout_tree(project, target_branch["structure"], tree)
+            invalidate_tree(target_branch["structure"])
+            reindex_branch(data, user_id, project_name, target_branch_name)
+        else:
+            target_branch["tree"] = tree
+
+    return {"status": status, "commit_id": target_branch.get("head"), "conflicts": conflicts}
 
 def is_project_member(data, user_id, owner_id, project_name):
     if owner_id == user_id:
@@ -231,6 +419,208 @@ def is_project_member(data, user_id, owner_id, project_name):
     project = data["projects"][owner_id][project_name]
     return user_id in project.get("collaborators", [])
 
+def user_page_size(data, user_id):
+    """Сколько элементов папки показывать пользователю на странице."""
+    return data["users"][user_id].get("page_size", FOLDER_PAGE_SIZE)
+
+def set_page_size(data, user_id, page_size):
+    if page_size == FOLDER_PAGE_SIZE:
+        data["users"][user_id].pop("page_size", None)
+    else:
+        data["users"][user_id]["page_size"] = page_size
+
 def get_user_id_by_username(data, username):
     return data["usernames"].get(username.lower())
 
+def find_file(data, folder, short_id, owner_id, project_name=None, path=None):
+    """Ищет файл по short_id в папке folder (путь path от корня дерева владельца или ветки)."""
+    locate = getattr(_store.backend, "locate_file", None) if _store is not None and data is _store.data else None
+    if locate is not None and path is not None:
+        if project_name:
+            branch_name = data["projects"][owner_id][project_name]["current_branch"]
+            tree = ("branch", owner_id, project_name, branch_name)
+        else:
+            tree = ("user", owner_id)
+        # Индексированный поиск: позиция проверяется по данным в памяти, иначе — обычный просмотр
+        for location_path, position in locate(tree, short_id):
+            files = folder["files"]
+            if location_path == list(path) and position < len(files) and files[position].get("short_id") == short_id:
+                return files[position]
+    return find_file_by_id(folder, short_id)
+
+# Глобальный индекс файлов: data["file_ids"][short_id] = {"owner", "project", "branch", "path"}.
+# Для файла вне проекта project и branch — None, path — путь в структуре владельца;
+# для файла проекта path — путь внутри рабочей копии ветки. Запись обновляется при
+# каждой загрузке, а при чтении проверяется по дереву, поэтому откат или слияние,
+# убравшие файл, дают «файл не найден», а не чужой файл.
+
+_id_lock = threading.Lock()
+_reserved_ids = set()  # Выданные, но ещё не записанные в индекс id
+
+def new_short_id(data):
+    """Короткий id файла, не занятый ни в индексе, ни среди только что выданных."""
+    file_ids = data["file_ids"]
+    with _id_lock:
+        while True:
+            short_id = uuid.uuid4().hex[:8]
+            if short_id not in _reserved_ids and short_id not in file_ids:
+                _reserved_ids.add(short_id)
+                return short_id
+
+def register_file(data, short_id, owner_id, path, project_name=None, branch_name=None):
+    data["file_ids"][short_id] = {"owner": owner_id, "project": project_name, "branch": branch_name, "path": list(path)}
+    with _id_lock:
+        _reserved_ids.discard(short_id)
+
+def unregister_file(data, short_id):
+    if short_id in data["file_ids"]:
+        del data["file_ids"][short_id]
+
+def place_file(data, folder, entry, owner_id, path, project_name=None, replace=False):
+    """Кладёт запись файла в папку folder (путь path) и записывает её место в индекс.
+
+    Для проекта path — путь внутри текущей ветки, replace заменяет одноимённый файл.
+    """
+    branch_name = data["projects"][owner_id][project_name]["current_branch"] if project_name else None
+    register_stored(data, entry)
+    replaced = put_file(folder, entry, replace=replace)
+    if project_name:
+        # Файл проекта сразу становится объектом: его держат объекты, а не рабочая копия,
+        # и заменённая версия остаётся учтённой, пока её объект не удалён
+        created = []
+        write_blob(data["projects"][owner_id][project_name], entry, created)
+        add_refs(data, created)
+    else:
+        add_refs(data, [entry])
+        if replaced is not None:
+            release_refs(data, [replaced])
+    search_index = get_search_index()
+    if replaced is not None and replaced.get("short_id") and replaced["short_id"] != entry["short_id"]:
+        unregister_file(data, replaced["short_id"])
+        if search_index is not None:
+            search_index.drop(replaced["short_id"])
+    register_file(data, entry["short_id"], owner_id, path, project_name, branch_name)
+    if search_index is not None:
+        search_index.put(entry["short_id"], entry, owner_id, path, project_name, branch_name)
+
+def reindex_branch(data, owner_id, project_name, branch_name):
+    """Обновляет индексы файлов после замены рабочей копии ветки (откат, слияние)."""
+    structure = data["projects"][owner_id][project_name]["branches"][branch_name]["structure"]
+    # Вернувшиеся старые версии файлов снова находятся по ID
+    for short_id, _, path in walk_files(structure):
+        location = data["file_ids"].get(short_id)
+        if location is None or (location["project"], location["branch"]) != (project_name, branch_name):
+            register_file(data, short_id, owner_id, path, project_name, branch_name)
+    search_index = get_search_index()
+    if search_index is not None:
+        search_index.replace_tree(structure, owner_id, project_name, branch_name)
+
+def _index_tree(file_ids, folder, owner_id, project_name=None, branch_name=None):
+    for short_id, _, path in walk_files(folder):
+        file_ids[short_id] = {"owner": owner_id, "project": project_name, "branch": branch_name, "path": path}
+
+def build_file_index(data):
+    file_ids = {}
+    for user_id, user_data in data.get("users", {}).items():
+        _index_tree(file_ids, user_data.get("structure", {}), user_id)
+    for owner_id, projects in data.get("projects", {}).items():
+        for project_name, project in projects.items():
+            for branch_name, branch in project.get("branches", {}).items():
+                if "structure" in branch:
+                    _index_tree(file_ids, branch["structure"], owner_id, project_name, branch_name)
+    return file_ids
+
+def resolve_file(data, user_id, short_id):
+    """Файл по short_id одним обращением к индексу: (ошибка, запись файла, описание места)."""
+    location = data["file_ids"].get(short_id)
+    if location is None:
+        return "Файл не найден.", None, None
+    owner_id, project_name = location["owner"], location["project"]
+    if project_name is None:
+        if owner_id != user_id or owner_id not in data["users"]:
+            return "У вас нет доступа к этому файлу.", None, None
+        root = data["users"][owner_id]["structure"]
+        place = "/" + "/".join(location["path"])
+    else:
+        project = data["projects"].get(owner_id, {}).get(project_name)
+        if project is None or location["branch"] not in project["branches"]:
+            return "Файл не найден.", None, None
+        if not is_project_member(data, user_id, owner_id, project_name):
+            return "У вас нет доступа к этому файлу.", None, None
+        root = _branch_structure(project, project["branches"][location["branch"]])
+        place = f"{project_name} ({location['branch']}): /" + "/".join(location["path"])
+    try:
+        folder = navigate_to_path(root, location["path"])
+    except KeyError:
+        return "Файл не найден: папка была удалена или изменена.", None, None
+    file_info = find_file_by_id(folder, short_id)
+    if file_info is None:
+        return "Файл не найден: он был заменён или удалён откатом.", None, None
+    return None, file_info, place
+
+def search_files(data, user_id, query, page=0):
+    """Страница результатов /find: (всего найдено, номер страницы, [(short_id, запись, место)]).
+
+    Попадания страницы сверяются с деревом; устаревшие (файл удалён откатом) пропускаются.
+    """
+    search_index = get_search_index()
+    hits = search_index.search(user_id, query) if search_index is not None else []
+    pages = max(1, (len(hits) + PAGE_SIZE - 1) // PAGE_SIZE)
+    page = max(0, min(page, pages - 1))
+    results = []
+    for short_id, _ in hits[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]:
+        error, file_info, place = resolve_file(data, user_id, short_id)
+        if error is None:
+            results.append((short_id, file_info, place))
+    return len(hits), page, results
+
+def format_search_results(query, total, page, results):
+    if not total:
+        return f"По запросу «{query}» ничего не найдено."
+    pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+    lines = [f"Найдено файлов: {total} (страница {page + 1} из {pages}) по запросу «{query}»:"]
+    tokens = query_tokens(query)
+    for number, (short_id, file_info, place) in enumerate(results, start=page * PAGE_SIZE + 1):
+        lines.append(f"\n{number}. {file_info.get('name')} — {place} (ID: {short_id})")
+        text = snippet(file_info, tokens)
+        if text:
+            lines.append(text)
+    return "\n".join(lines)
+
+def search_history(data, user_id, query):
+    """Поиск по всем версиям файлов в истории коммитов проектов пользователя; текст ответа."""
+    hits = search_blobs(data["projects"].get(user_id, {}), query)
+    if not hits:
+        return f"В истории коммитов по запросу «{query}» ничего не найдено."
+    tokens = query_tokens(query)
+    lines = [f"Найдено в истории коммитов по запросу «{query}»:"]
+    for number, (_, project_name, blob) in enumerate(hits, start=1):
+        lines.append(f"\n{number}. {blob.get('name')} — {project_name}")
+        text = snippet(blob, tokens)
+        if text:
+            lines.append(text)
+    return "\n".join(lines)
+
+def jump_to_file(data, user_id, short_id):
+    """Делает папку файла текущей; текст ошибки или None.
+
+    Для файла проекта открывается корень проекта в ветке файла: путь внутри
+    проекта в current_path не хранится (проект — всегда последний элемент),
+    а путь к папке проекта ищется в дереве владельца.
+    """
+    error, _, _ = resolve_file(data, user_id, short_id)
+    if error:
+        return error
+    location = data["file_ids"][short_id]
+    if location["owner"] != user_id:
+        return "Перейти можно только в свои папки."
+    project_name = location["project"]
+    if project_name is None:
+        data["users"][user_id]["current_path"] = list(location["path"])
+        return None
+    with project_lock(user_id, project_name):
+        if data["projects"][user_id][project_name]["current_branch"] != location["branch"]:
+            switch_branch(data, user_id, project_name, location["branch"])
+    user_data = data["users"][user_id]
+    user_data["current_path"] = find_folder_path(user_data["structure"], project_name) or [project_name]
+    return None
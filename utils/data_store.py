@@ -0,0 +1,234 @@
+# utils/data_store.py
+import json
+import os
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+
+def empty_data():
+    return {"users": {}, "shared_folders": {}, "projects": {}, "usernames": {}, "file_ids": {}, "stored_files": {}}
+
+
+def read_data_file(path):
+    if not os.path.exists(path):
+        return empty_data()
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except json.JSONDecodeError as e:
+        logger.error(f"Ошибка декодирования JSON: {e}")
+        return empty_data()
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке данных: {e}")
+        return empty_data()
+
+
+def dump_data(data):
+    return json.dumps(data, ensure_ascii=False, indent=4)
+
+
+def write_data_file(path, data):
+    atomic_write(path, dump_data(data))
+
+
+def atomic_write(path, text):
+    # Пишем во временный файл рядом с целевым и атомарно подменяем его,
+    # чтобы при сбое на диске оставалась либо старая, либо новая версия
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class SharedLock:
+    """Блокировка «много совместных владельцев или один монопольный».
+
+    Обработчики держат её совместно, пока меняют данные, фоновый сброс —
+    монопольно, пока сериализует их. Ожидающий монопольный захват
+    пропускается вперёд новых совместных, иначе под нагрузкой сброс
+    не дождался бы своей очереди. Совместный захват повторно входим
+    в пределах потока.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+        self._local = threading.local()
+
+    def held_shared(self):
+        return getattr(self._local, 'depth', 0) > 0
+
+    @contextmanager
+    def shared(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            with self._cond:
+                while self._exclusive or self._waiting:
+                    self._cond.wait()
+                self._shared += 1
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                with self._cond:
+                    self._shared -= 1
+                    if self._shared == 0:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self._exclusive or self._shared:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+class DataStore:
+    """Данные бота, загруженные один раз и разделяемые всеми обработчиками.
+
+    Изменения только помечают хранилище «грязным», а фоновый поток
+    сбрасывает их на диск не чаще раза в flush_interval секунд или сразу
+    после flush_max_pending изменений. При сбое теряется не больше одного
+    окна сброса. Как именно данные лежат на диске, решает backend
+    (см. utils/storage.py).
+
+    Код, меняющий данные, выполняется внутри session(): сброс сериализует
+    данные только между такими участками, поэтому на диск не попадает
+    состояние посреди изменения (например, файл в file_ids без записи
+    в дереве папок).
+    """
+
+    def __init__(self, backend, flush_interval=1.0, flush_max_pending=50):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.flush_max_pending = flush_max_pending
+        self.data = None
+        self.lock = threading.RLock()
+        self.sessions = SharedLock()
+        self._pending = 0
+        self._flushed = False
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher = None
+
+    def load(self):
+        with self.lock:
+            self.data = self.backend.load()
+            self._pending = 0
+            return self.data
+
+    @property
+    def dirty(self):
+        return self._pending > 0
+
+    def session(self):
+        """Участок load_data() -> изменения -> save_data() одного обработчика."""
+        return self.sessions.shared()
+
+    def begin(self):
+        # Начало обработки обновления в текущем потоке
+        self.backend.begin()
+
+    def mark_dirty(self):
+        with self.lock:
+            self.backend.mark_dirty()
+            self._pending += 1
+            pending = self._pending
+        if self._flusher is None:
+            # Фоновый сброс не запущен (например, в скриптах) — пишем сразу
+            self.flush()
+        elif pending >= self.flush_max_pending:
+            self._wakeup.set()
+
+    def flush(self):
+        # Сброс прямо из mark_dirty() выполняется внутри сессии того же потока:
+        # повысить её до монопольной нельзя, а других изменяющих потоков без
+        # фонового сброса нет
+        if self.sessions.held_shared():
+            gate = nullcontext()
+        else:
+            gate = self.sessions.exclusive()
+        with gate, self.lock:
+            if self._pending == 0 and self._flushed:
+                return False
+            pending, self._pending = self._pending, 0
+            try:
+                wrote = self.backend.flush(self.data)
+                self._flushed = True
+                return wrote
+            except RuntimeError as e:
+                # Словарь изменили вне session() во время сериализации — повторим в следующем окне
+                self._pending += pending
+                logger.warning(f"Данные изменились во время сохранения, повтор позже: {e}")
+                return False
+            except Exception:
+                self._pending += pending
+                raise
+
+    def start(self):
+        if self._flusher is not None:
+            return
+        self._stopped.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, name="data-store-flusher", daemon=True)
+        self._flusher.start()
+
+    def close(self):
+        flusher = self._flusher
+        if flusher is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            flusher.join()
+            self._flusher = None
+        self.flush()
+        close_backend = getattr(self.backend, "close", None)
+        if close_backend is not None:
+            close_backend()
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении данных: {e}")
@@ -0,0 +1,478 @@
+# utils/export.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from config import DATA_CHAT_ID, EXPORT_CACHE_DIR, EXPORT_CACHE_ENTRIES
+from utils.data_store import atomic_write
+from utils.data_manager import get_current_branch_structure
+from utils.navigation import navigate_to_path
+from utils.retrieval import message_file_id
+
+logger = logging.getLogger(__name__)
+
+# Экспорт папки или ветки проекта целиком в ZIP-архив:
+#   - дерево обходится рекурсивно; тексты пишутся в архив как .txt,
+#     файлы из DATA_CHAT_ID скачиваются (get_file / download_file) по одному;
+#   - архив пишется во временный файл по мере обхода, в памяти держится
+#     не больше одного файла;
+#   - готовые архивы кэшируются по хешу содержимого папки: повторный экспорт
+#     неизменённой папки отправляется по file_id без загрузки;
+#   - для каждого архива запоминается, под каким префиксом в нём лежит каждая
+#     подпапка (по её хешу), поэтому неизменённая подпапка копируется из любого
+#     кэшированного архива, где она уже есть — своего или родительского;
+#   - архивы, из которых идёт чтение, закреплены и не вытесняются.
+
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # Ограничение Bot API на отправку документа
+CHUNK_SIZE = 64 * 1024
+FAILED_LIST_NAME = "_не_выгружено.txt"
+
+
+def content_hash(folder, hashes=None):
+    """Хеш содержимого папки (без служебных oid); hashes — id(папки) -> хеш для всех подпапок."""
+    if hashes is None:
+        hashes = {}
+    payload = {
+        "folders": {name: content_hash(child, hashes) for name, child in folder.get("folders", {}).items()},
+        "files": [{key: value for key, value in entry.items() if key != "oid"} for entry in folder.get("files", [])],
+    }
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+    hashes[id(folder)] = digest
+    return digest
+
+
+def _safe_name(name):
+    return name.replace('/', '_').replace('\\', '_') or '_'
+
+
+def _unique(name, used):
+    # Одноимённые файлы в папке получают суффикс: file.txt, file (2).txt, ...
+    base, ext = os.path.splitext(name)
+    candidate, number = name, 2
+    while candidate in used:
+        candidate = f"{base} ({number}){ext}"
+        number += 1
+    used.add(candidate)
+    return candidate
+
+
+def file_arcname(entry, idx):
+    name = _safe_name(entry.get("name") or entry.get("short_id") or f"file_{idx}")
+    if entry.get("type") in ("text", "code") and not os.path.splitext(name)[1]:
+        name += ".txt"
+    return name
+
+
+class ExportCache:
+    """Готовые архивы в EXPORT_CACHE_DIR: <хеш>.zip и index.json с file_id отправленных архивов."""
+
+    def __init__(self, directory=EXPORT_CACHE_DIR, max_entries=EXPORT_CACHE_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._index = None
+        self._subtrees = {}  # хеш подпапки -> ключ архива, в котором она есть
+        self._pins = {}  # ключ архива -> число экспортов, читающих его сейчас
+
+    def _index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _load(self):
+        if self._index is None:
+            os.makedirs(self.directory, exist_ok=True)
+            try:
+                with open(self._index_path(), 'r', encoding='utf-8') as file:
+                    self._index = json.load(file)
+            except (OSError, ValueError):
+                self._index = {}
+            for key, entry in self._index.items():
+                for subtree in entry.get("subtrees", {}):
+                    self._subtrees.setdefault(subtree, key)
+        return self._index
+
+    def _save(self):
+        atomic_write(self._index_path(), json.dumps(self._index, ensure_ascii=False))
+
+    def archive_path(self, key):
+        return os.path.join(self.directory, f"{key}.zip")
+
+    def _pin(self, key):
+        self._index[key]["used"] = time.time()
+        self._pins[key] = self._pins.get(key, 0) + 1
+        return self.archive_path(key)
+
+    def get(self, key):
+        """Путь к архиву папки с хешем key или None; найденный архив закрепляется до release()."""
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None or not os.path.exists(self.archive_path(key)):
+                return None
+            return self._pin(key)
+
+    def locate(self, subtree):
+        """(ключ архива, путь, префикс) архива, где уже есть папка с хешем subtree, или None.
+
+        Найденный архив закрепляется до release().
+        """
+        with self._lock:
+            index = self._load()
+            for key, prefix in ((subtree, ""), (self._subtrees.get(subtree), None)):
+                entry = index.get(key) if key else None
+                if entry is None or not os.path.exists(self.archive_path(key)):
+                    continue
+                if prefix is None:
+                    prefix = entry.get("subtrees", {}).get(subtree)
+                    if prefix is None:
+                        continue
+                return key, self._pin(key), prefix
+            return None
+
+    def release(self, keys):
+        with self._lock:
+            for key in keys:
+                count = self._pins.get(key, 0) - 1
+                if count > 0:
+                    self._pins[key] = count
+                else:
+                    self._pins.pop(key, None)
+
+    def file_id(self, key):
+        with self._lock:
+            entry = self._load().get(key)
+            return entry.get("file_id") if entry else None
+
+    def put(self, key, tmp_path, subtrees=None):
+        """Переносит готовый архив в кэш и возвращает его новый путь (закреплённый до release()).
+
+        subtrees — хеш подпапки -> префикс, под которым она лежит в архиве.
+        """
+        with self._lock:
+            index = self._load()
+            os.replace(tmp_path, self.archive_path(key))
+            index[key] = {"file_id": None, "used": time.time(), "subtrees": subtrees or {}}
+            for subtree in index[key]["subtrees"]:
+                self._subtrees[subtree] = key
+            path = self._pin(key)
+            # Вытесняем давно не использованные архивы, кроме тех, что сейчас читаются
+            candidates = sorted((k for k in index if k not in self._pins), key=lambda k: index[k]["used"])
+            for old_key in candidates[:max(0, len(index) - self.max_entries)]:
+                for subtree in index.pop(old_key).get("subtrees", {}):
+                    if self._subtrees.get(subtree) == old_key:
+                        del self._subtrees[subtree]
+                try:
+                    os.remove(self.archive_path(old_key))
+                except OSError:
+                    pass
+            self._save()
+            return path
+
+    def set_file_id(self, key, file_id):
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is not None:
+                entry["file_id"] = file_id
+                self._save()
+
+    def forget_file_id(self, key):
+        self.set_file_id(key, None)
+
+
+export_cache = ExportCache()
+
+
+def plan_export(folder, hashes, cache=export_cache, prefix="", pinned=None):
+    """Действия для записи папки в архив, в порядке обхода.
+
+    ("dir", путь, хеш папки), ("text", путь, содержимое), ("file", путь, запись файла)
+    или ("archive", путь, кэшированный архив, префикс подпапки в нём, хеш папки).
+    Ключи закреплённых кэшированных архивов добавляются в pinned.
+    """
+    actions = []
+    used = set()
+    for name, child in folder.get("folders", {}).items():
+        child_prefix = prefix + _unique(_safe_name(name), used) + "/"
+        found = cache.locate(hashes[id(child)])
+        if found:
+            key, path, source_prefix = found
+            if pinned is not None:
+                pinned.append(key)
+            actions.append(("archive", child_prefix, path, source_prefix, hashes[id(child)]))
+            continue
+        actions.append(("dir", child_prefix, hashes[id(child)]))
+        actions.extend(plan_export(child, hashes, cache, child_prefix, pinned))
+    for idx, entry in enumerate(folder.get("files", []), start=1):
+        arcname = prefix + _unique(file_arcname(entry, idx), used)
+        if entry.get("type") in ("text", "code"):
+            actions.append(("text", arcname, entry.get("content") or ""))
+        elif entry.get("file_id") or entry.get("message_id") is not None:
+            actions.append(("file", arcname, entry))
+    return actions
+
+
+def archived_subtrees(actions):
+    """Хеш подпапки -> её префикс в архиве, собранном по actions."""
+    return {action[-1]: action[1] for action in actions if action[0] in ("dir", "archive")}
+
+
+class ArchiveWriter:
+    """ZIP-архив, который пишется во временный файл по одному элементу."""
+
+    def __init__(self, directory=EXPORT_CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.export.', suffix='.zip')
+        os.close(fd)
+        self._zip = zipfile.ZipFile(self.path, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def add(self, action, content=None):
+        """Записывает действие из plan_export; для "file" content — скачанные байты."""
+        kind, arcname = action[0], action[1]
+        if kind == "dir":
+            self._zip.writestr(arcname, b"")
+        elif kind == "text":
+            self._zip.writestr(arcname, action[2])
+        elif kind == "file":
+            with self._zip.open(arcname, 'w') as target:
+                target.write(content)
+        else:
+            source_prefix = action[3]
+            self._zip.writestr(arcname, b"")
+            with zipfile.ZipFile(action[2]) as source:
+                for info in source.infolist():
+                    if not info.filename.startswith(source_prefix) or info.filename == source_prefix:
+                        continue
+                    target_name = arcname + info.filename[len(source_prefix):]
+                    if info.is_dir():
+                        self._zip.writestr(target_name, b"")
+                        continue
+                    with source.open(info) as fin, self._zip.open(target_name, 'w') as fout:
+                        shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+
+    def close(self, failed=()):
+        if failed:
+            self._zip.writestr(FAILED_LIST_NAME, "\n".join(failed))
+        self._zip.close()
+        return self.path
+
+    def discard(self):
+        self._zip.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _with_extension(arcname, file_path):
+    # Имя файла без расширения дополняем расширением из Telegram (photos/file_1.jpg)
+    if os.path.splitext(arcname)[1] or not file_path:
+        return arcname
+    return arcname + os.path.splitext(file_path)[1]
+
+
+def resolve_file_id(bot, message_id):
+    """file_id файла из чата хранения, если в записи сохранён только message_id."""
+    forwarded = bot.forward_message(DATA_CHAT_ID, DATA_CHAT_ID, message_id, disable_notification=True)
+    try:
+        return message_file_id(forwarded)
+    finally:
+        bot.delete_message(DATA_CHAT_ID, forwarded.message_id)
+
+
+async def resolve_file_id_async(bot, message_id):
+    forwarded = await bot.forward_message(DATA_CHAT_ID, DATA_CHAT_ID, message_id, disable_notification=True)
+    try:
+        return message_file_id(forwarded)
+    finally:
+        await bot.delete_message(DATA_CHAT_ID, forwarded.message_id)
+
+
+def export_caption(name, failed):
+    caption = f"🗜 Экспорт «{name}»"
+    if failed:
+        caption += f"\nНе удалось выгрузить файлов: {len(failed)} (список в {FAILED_LIST_NAME})."
+    return caption
+
+
+def export_folder(bot, chat_id, folder, name, cache=export_cache, cancelled=None):
+    """Собирает архив папки и отправляет его одним документом; False — если отправить не удалось.
+
+    cancelled() проверяется перед каждым файлом: отменённый экспорт ничего не отправляет.
+    """
+    hashes = {}
+    key = content_hash(folder, hashes)
+    file_id = cache.file_id(key)
+    if file_id:
+        try:
+            bot.send_document(chat_id, file_id, caption=export_caption(name, ()))
+            return True
+        except Exception as e:
+            logger.warning(f"Кэшированный архив не отправлен по file_id ({e}), отправляем заново")
+            cache.forget_file_id(key)
+
+    failed = []
+    pinned = []  # ключи архивов кэша, которые читает этот экспорт
+    try:
+        path = cache.get(key)
+        if path is not None:
+            pinned.append(key)
+        else:
+            bot.send_chat_action(chat_id, 'upload_document')
+            writer = ArchiveWriter(cache.directory)
+            try:
+                actions = plan_export(folder, hashes, cache, pinned=pinned)
+                for action in actions:
+                    if cancelled is not None and cancelled():
+                        writer.discard()
+                        return False
+                    if action[0] != "file":
+                        writer.add(action)
+                        continue
+                    entry = action[2]
+                    try:
+                        file_id = entry.get("file_id") or resolve_file_id(bot, entry["message_id"])
+                        file_path = bot.get_file(file_id).file_path
+                        content = bot.download_file(file_path)
+                    except Exception as e:
+                        logger.error(f"Не удалось скачать файл {action[1]}: {e}")
+                        failed.append(action[1])
+                        continue
+                    writer.add(("file", _with_extension(action[1], file_path)), content)
+            except BaseException:
+                writer.discard()
+                raise
+            path = writer.close(failed)
+            # Неполный архив не кэшируем, чтобы следующий экспорт попробовал ещё раз
+            if not failed:
+                path = cache.put(key, path, archived_subtrees(actions))
+                pinned.append(key)
+        return _send_archive(bot, chat_id, key, path, name, failed, cache)
+    finally:
+        cache.release(pinned)
+
+
+def _send_archive(bot, chat_id, key, path, name, failed, cache):
+    try:
+        size = os.path.getsize(path)
+        if size > MAX_UPLOAD_SIZE:
+            bot.send_message(chat_id, f"Архив «{name}» слишком большой для отправки ({size // (1024 * 1024)} МБ).")
+            return False
+        with open(path, 'rb') as file:
+            message = bot.send_document(chat_id, file, caption=export_caption(name, failed),
+                                        visible_file_name=f"{_safe_name(name)}.zip")
+        if not failed:
+            cache.set_file_id(key, message.document.file_id)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при отправке архива: {e}")
+        bot.send_message(chat_id, f"Ошибка при отправке архива: {str(e)}")
+        return False
+    finally:
+        if failed:
+            os.remove(path)
+
+
+async def export_folder_async(bot, chat_id, folder, name, cache=export_cache, cancelled=None):
+    """Асинхронная версия export_folder: запросы к Telegram в цикле событий, запись архива — в потоке."""
+    hashes = {}
+    key = content_hash(folder, hashes)
+    file_id = cache.file_id(key)
+    if file_id:
+        try:
+            await bot.send_document(chat_id, file_id, caption=export_caption(name, ()))
+            return True
+        except Exception as e:
+            logger.warning(f"Кэшированный архив не отправлен по file_id ({e}), отправляем заново")
+            cache.forget_file_id(key)
+
+    failed = []
+    pinned = []
+    try:
+        path = await asyncio.to_thread(cache.get, key)
+        if path is not None:
+            pinned.append(key)
+        else:
+            await bot.send_chat_action(chat_id, 'upload_document')
+            writer = await asyncio.to_thread(ArchiveWriter, cache.directory)
+            try:
+                actions = await asyncio.to_thread(plan_export, folder, hashes, cache, "", pinned)
+                for action in actions:
+                    if cancelled is not None and cancelled():
+                        await asyncio.to_thread(writer.discard)
+                        return False
+                    if action[0] != "file":
+                        await asyncio.to_thread(writer.add, action)
+                        continue
+                    entry = action[2]
+                    try:
+                        file_id = entry.get("file_id") or await resolve_file_id_async(bot, entry["message_id"])
+                        file_path = (await bot.get_file(file_id)).file_path
+                        content = await bot.download_file(file_path)
+                    except Exception as e:
+                        logger.error(f"Не удалось скачать файл {action[1]}: {e}")
+                        failed.append(action[1])
+                        continue
+                    await asyncio.to_thread(writer.add, ("file", _with_extension(action[1], file_path)), content)
+            except BaseException:
+                await asyncio.to_thread(writer.discard)
+                raise
+            path = await asyncio.to_thread(writer.close, failed)
+            if not failed:
+                path = await asyncio.to_thread(cache.put, key, path, archived_subtrees(actions))
+                pinned.append(key)
+
+        try:
+            size = os.path.getsize(path)
+            if size > MAX_UPLOAD_SIZE:
+                await bot.send_message(chat_id, f"Архив «{name}» слишком большой для отправки ({size // (1024 * 1024)} МБ).")
+                return False
+            with open(path, 'rb') as file:
+                message = await bot.send_document(chat_id, file, caption=export_caption(name, failed),
+                                                  visible_file_name=f"{_safe_name(name)}.zip")
+            if not failed:
+                cache.set_file_id(key, message.document.file_id)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при отправке архива: {e}")
+            await bot.send_message(chat_id, f"Ошибка при отправке архива: {str(e)}")
+            return False
+        finally:
+            if failed:
+                os.remove(path)
+    finally:
+        await asyncio.to_thread(cache.release, pinned)
+
+
+def locate_export(data, user_id, shared_key=None):
+    """Что экспортировать: (ошибка, папка, имя архива)."""
+    if shared_key is not None:
+        shared = data.get("shared_folders", {}).get(shared_key)
+        if not shared:
+            return "Неверный или несуществующий ключ доступа.", None, None
+        path = shared["path"]
+        try:
+            folder = navigate_to_path(data["users"][shared["user_id"]]["structure"], path)
+        except KeyError:
+            return "Папка не найдена.", None, None
+        name = path[-1] if path else "shared"
+    else:
+        current_path = data["users"][user_id]["current_path"]
+        if current_path and current_path[-1].endswith('.git'):
+            project_name = current_path[-1]
+            if project_name not in data.get("projects", {}).get(user_id, {}):
+                return f"Проект `{project_name}` не найден.", None, None
+            project = data["projects"][user_id][project_name]
+            branch_structure = get_current_branch_structure(data, user_id, project_name)
+            folder = navigate_to_path(branch_structure, current_path[current_path.index(project_name)+1:])
+            name = f"{project_name[:-4]}-{project['current_branch']}"
+        else:
+            folder = navigate_to_path(data["users"][user_id]["structure"], current_path)
+            name = current_path[-1] if current_path else "root"
+    if not folder.get("folders") and not folder.get("files"):
+        return "Папка пуста.", None, None
+    return None, folder, name
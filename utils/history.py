@@ -0,0 +1,230 @@
+# utils/history.py
+import hashlib
+import json
+from utils.objects import prune_objects, merge_trees, working_objects
+
+# История проекта — общий для всех веток граф коммитов:
+#
+#   project["commits"][id] = {"commit_id", "message", "tree", "parents": [id, ...],
+#                             "seq", "generation"}
+#   project["branches"][name]["head"] = id последнего коммита ветки (или None)
+#
+# id коммита — хеш его содержимого, поэтому он не зависит от ветки и не
+# переиспользуется после отката. generation — длина самого длинного пути
+# до корня, по ней ищется ближайший общий предок при слиянии.
+# project["numeric_ids"][ветка][старый id] — соответствие старых числовых id
+# коммитов ветки новым (заполняется при переводе истории на граф), чтобы
+# /rollback 2 и старые кнопки отката находили тот же коммит, а не коммит,
+# id которого начинается на «2». Старые id нумеровались в каждой ветке
+# отдельно, поэтому и соответствие своё у каждой ветки.
+
+SHORT_ID_LENGTH = 8
+MIN_PREFIX_LENGTH = 6  # Короче — слишком легко попасть в чужой коммит (и спутать со старым числовым id)
+
+
+def _commit_hash(payload):
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(f"commit\0{text}".encode('utf-8'), digest_size=12).hexdigest()
+
+
+def short_commit_id(commit_id):
+    return str(commit_id)[:SHORT_ID_LENGTH]
+
+
+def get_commit(project, commit_id):
+    return project["commits"].get(commit_id)
+
+
+def add_commit(project, message, tree, parents):
+    parents = [parent for parent in parents if parent is not None]
+    seq = project.get("commit_seq", 0) + 1
+    project["commit_seq"] = seq
+    payload = {"message": message, "tree": tree, "parents": parents, "seq": seq}
+    commit_id = _commit_hash(payload)
+    generation = 1 + max((project["commits"][parent]["generation"] for parent in parents), default=0)
+    project["commits"][commit_id] = dict(payload, commit_id=commit_id, generation=generation)
+    return commit_id
+
+
+def branch_log(project, head):
+    """Коммиты ветки по первому родителю, от старых к новым."""
+    log = []
+    commit = get_commit(project, head) if head is not None else None
+    while commit is not None:
+        log.append(commit)
+        commit = get_commit(project, commit["parents"][0]) if commit["parents"] else None
+    log.reverse()
+    return log
+
+
+def ancestors(project, head):
+    """Множество id всех коммитов, достижимых из head (включая его самого)."""
+    seen = set()
+    stack = [head] if head is not None else []
+    while stack:
+        commit_id = stack.pop()
+        if commit_id in seen:
+            continue
+        commit = project["commits"].get(commit_id)
+        if commit is None:
+            continue
+        seen.add(commit_id)
+        stack.extend(commit["parents"])
+    return seen
+
+
+def is_ancestor(project, ancestor, head):
+    """Достижим ли ancestor из head; обход не опускается ниже поколения ancestor."""
+    if ancestor is None:
+        return True
+    target = project["commits"].get(ancestor)
+    if target is None:
+        return False
+    seen = set()
+    stack = [head] if head is not None else []
+    while stack:
+        commit_id = stack.pop()
+        if commit_id == ancestor:
+            return True
+        if commit_id in seen:
+            continue
+        seen.add(commit_id)
+        commit = project["commits"].get(commit_id)
+        if commit is not None and commit["generation"] > target["generation"]:
+            stack.extend(commit["parents"])
+    return False
+
+
+def merge_base(project, first, second):
+    """Ближайший общий предок двух коммитов (с наибольшим generation)."""
+    if first is None or second is None:
+        return None
+    first_ancestors = ancestors(project, first)
+    best = None
+    seen = set()
+    stack = [second]
+    while stack:
+        commit_id = stack.pop()
+        if commit_id in seen:
+            continue
+        seen.add(commit_id)
+        commit = project["commits"].get(commit_id)
+        if commit is None:
+            continue
+        if commit_id in first_ancestors:
+            # Предков общего предка дальше не обходим — они заведомо старше
+            if best is None or commit["generation"] > project["commits"][best]["generation"]:
+                best = commit_id
+            continue
+        stack.extend(commit["parents"])
+    return best
+
+
+def resolve_commit(project, prefix, head, branch_name=None):
+    """Ищет коммит истории ветки по полному id, его началу (от MIN_PREFIX_LENGTH символов) или старому числовому id."""
+    prefix = str(prefix).strip().lower()
+    numeric_ids = project.get("numeric_ids", {}).get(branch_name, {})
+    if prefix.isdigit() and prefix in numeric_ids:
+        prefix = numeric_ids[prefix]
+    if len(prefix) < MIN_PREFIX_LENGTH:
+        return None
+    if prefix in project["commits"]:
+        return prefix if is_ancestor(project, prefix, head) else None
+    matches = [commit_id for commit_id in ancestors(project, head) if commit_id.startswith(prefix)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def merge_commits(project, ours_tree, ours_head, theirs_head):
+    """Сливает коммит theirs_head в ветку с рабочим деревом ours_tree.
+
+    Возвращает (статус, oid итогового дерева, конфликты), статус —
+    "up_to_date", "fast_forward" или "merged".
+    """
+    if theirs_head is None or is_ancestor(project, theirs_head, ours_head):
+        return "up_to_date", ours_tree, []
+    theirs_tree = project["commits"][theirs_head]["tree"]
+    head_tree = project["commits"][ours_head]["tree"] if ours_head is not None else None
+    if ours_tree == head_tree and is_ancestor(project, ours_head, theirs_head):
+        return "fast_forward", theirs_tree, []
+    base = merge_base(project, ours_head, theirs_head)
+    base_tree = project["commits"][base]["tree"] if base is not None else None
+    tree, conflicts = merge_trees(project, base_tree, ours_tree, theirs_tree)
+    return "merged", tree, conflicts
+
+
+def prune_history(project):
+    """Удаляет коммиты, недостижимые ни из одной ветки, и их объекты; возвращает удалённые записи файлов."""
+    reachable = set()
+    for branch in project["branches"].values():
+        reachable |= ancestors(project, branch.get("head"))
+    for commit_id in [commit_id for commit_id in project["commits"] if commit_id not in reachable]:
+        del project["commits"][commit_id]
+    if "numeric_ids" in project:
+        project["numeric_ids"] = {
+            branch_name: {old: new for old, new in ids.items() if new in project["commits"]}
+            for branch_name, ids in project["numeric_ids"].items() if branch_name in project["branches"]
+        }
+    roots = [commit["tree"] for commit in project["commits"].values()]
+    roots += [branch["tree"] for branch in project["branches"].values() if branch.get("tree")]
+    # Незакоммиченные файлы открытых рабочих копий тоже держат свои объекты
+    blobs = []
+    for branch in project["branches"].values():
+        if "structure" in branch:
+            trees, branch_blobs = working_objects(project, branch["structure"])
+            roots += trees
+            blobs += branch_blobs
+    return prune_objects(project, roots, blobs)
+
+
+def migrate_branch_commits(project):
+    """Переводит старые списки коммитов в ветках в общий граф.
+
+    Ветки создавались копированием списка, поэтому одинаковые коммиты
+    в общем префиксе нескольких веток склеиваются в один.
+    """
+    if "commits" not in project:
+        project["commits"] = {}
+    known = {}
+    for branch_name, branch in project["branches"].items():
+        if "commits" not in branch:
+            continue
+        parent = None
+        numeric_ids = project.setdefault("numeric_ids", {}).setdefault(branch_name, {})
+        for commit in branch.pop("commits"):
+            key = (parent, commit.get("commit_id"), commit.get("message"), commit.get("tree"))
+            if key not in known:
+                known[key] = add_commit(project, commit.get("message"), commit["tree"], [parent])
+            parent = known[key]
+            if commit.get("commit_id") is not None:
+                numeric_ids[str(commit["commit_id"])] = parent
+        branch["head"] = parent
+
+
+def migrate_numeric_ids(project):
+    """Переводит граф с числовыми id коммитов на id-хеши."""
+    numeric_ids = project.get("numeric_ids")
+    if numeric_ids and any(isinstance(new, str) for new in numeric_ids.values()):
+        # Общее для всех веток соответствие раскладываем по веткам
+        _split_numeric_ids(project, numeric_ids)
+    old_commits = project["commits"]
+    if not any(isinstance(commit.get("commit_id"), int) for commit in old_commits.values()):
+        return
+    project["commits"] = {}
+    project.pop("next_commit_id", None)
+    new_ids = {}
+    # Числовые id выдавались по порядку, так что родители всегда идут раньше потомков
+    for commit in sorted(old_commits.values(), key=lambda commit: int(commit["commit_id"])):
+        parents = [new_ids[str(parent)] for parent in commit.get("parents", []) if str(parent) in new_ids]
+        new_ids[str(commit["commit_id"])] = add_commit(project, commit.get("message"), commit["tree"], parents)
+    for branch in project["branches"].values():
+        head = branch.get("head")
+        branch["head"] = new_ids.get(str(head)) if head is not None else None
+    _split_numeric_ids(project, new_ids)
+
+
+def _split_numeric_ids(project, ids):
+    # В графе с числовыми id они были общими для проекта: ветке достаются id коммитов её истории
+    project["numeric_ids"] = {}
+    for branch_name, branch in project["branches"].items():
+        history = ancestors(project, branch.get("head"))
+        project["numeric_ids"][branch_name] = {old: new for old, new in ids.items() if new in history}
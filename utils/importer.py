@@ -0,0 +1,276 @@
+# utils/importer.py
+import io
+import logging
+import os
+import zipfile
+from config import DATA_CHAT_ID
+from utils.data_manager import (
+    data_session,
+    load_data,
+    save_data,
+    create_commit,
+    get_current_branch_structure,
+    set_current_branch_structure,
+    is_project_member,
+    new_short_id,
+    place_file
+)
+from utils.navigation import navigate_to_path
+from utils.objects import touch_path
+from utils.locks import project_lock, user_lock
+from utils.retrieval import message_file_id
+from utils.stored_files import content_key, find_stored, stored_fields
+from utils.async_runtime import run_storage, hold_user
+
+logger = logging.getLogger(__name__)
+
+# Импорт ZIP-архива в текущую папку или Git-проект (/import):
+#   - архив читается по одному элементу, иерархия папок воссоздаётся;
+#   - тексты и код (UTF-8, до INLINE_TEXT_LIMIT) хранятся прямо в записи файла,
+#     остальные файлы отправляются в DATA_CHAT_ID по одному сообщению на файл,
+#     кроме уже сохранённых там (совпадение по хешу содержимого, в том числе
+#     с другим элементом того же архива);
+#   - все записи добавляются за одну загрузку данных: один коммит и одно
+#     сохранение на весь архив вместо автокоммита на каждый файл.
+
+MAX_ARCHIVE_SIZE = 20 * 1024 * 1024  # Больше Bot API скачать не даст
+MAX_FILES = 1000
+MAX_UNPACKED_SIZE = 200 * 1024 * 1024  # Защита от «zip-бомб»
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+INLINE_TEXT_LIMIT = 64 * 1024
+
+TEXT_EXTENSIONS = {".txt", ".md", ".csv", ".log", ".json", ".xml", ".yaml", ".yml", ".ini", ".cfg", ".toml"}
+CODE_EXTENSIONS = {
+    ".py", ".js", ".ts", ".java", ".c", ".h", ".cpp", ".hpp", ".cs", ".go", ".rs", ".rb", ".php",
+    ".kt", ".swift", ".sh", ".sql", ".html", ".css",
+}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def import_request_error(message):
+    """Почему присланное после /import сообщение нельзя импортировать (None — можно)."""
+    document = message.document if message.content_type == 'document' else None
+    if document is None:
+        return "Импорт отменён: ожидался ZIP-архив."
+    name = (document.file_name or "").lower()
+    if not name.endswith(".zip") and document.mime_type not in ("application/zip", "application/x-zip-compressed"):
+        return "Импорт отменён: файл не является ZIP-архивом."
+    if document.file_size and document.file_size > MAX_ARCHIVE_SIZE:
+        return f"Архив слишком большой: бот может скачать не больше {MAX_ARCHIVE_SIZE // (1024 * 1024)} МБ."
+    return None
+
+
+def import_target(data, user_id, path):
+    """Куда импортировать: (ошибка, имя проекта или None, путь внутри проекта или папки)."""
+    if path and path[-1].endswith('.git'):
+        project_name = path[-1]
+        if "projects" not in data or project_name not in data["projects"].get(user_id, {}):
+            return f"Проект `{project_name}` не найден.", None, None
+        if not is_project_member(data, user_id, user_id, project_name):
+            return f"У вас нет доступа к проекту `{project_name}`.", None, None
+        return None, project_name, path[path.index(project_name)+1:]
+    try:
+        navigate_to_path(data["users"][user_id]["structure"], path)
+    except KeyError:
+        return "Папка не найдена.", None, None
+    return None, None, list(path)
+
+
+def plan_members(archive):
+    """Файлы архива: [(папки, имя файла, ZipInfo)]; служебные и пустые элементы пропускаются."""
+    members = []
+    unpacked = 0
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        parts = [part for part in info.filename.replace('\\', '/').split('/') if part not in ("", ".", "..")]
+        if not parts or parts[0] == "__MACOSX" or parts[-1] in (".DS_Store", "Thumbs.db"):
+            continue
+        members.append((parts[:-1], parts[-1], info))
+        unpacked += info.file_size
+    if len(members) > MAX_FILES:
+        raise ArchiveError(f"В архиве больше {MAX_FILES} файлов.")
+    if unpacked > MAX_UNPACKED_SIZE:
+        raise ArchiveError(f"Архив распаковывается больше чем в {MAX_UNPACKED_SIZE // (1024 * 1024)} МБ.")
+    return members
+
+
+def read_member(archive, info):
+    # Размер из заголовка не доверяем: читаем не больше заявленного + 1 байт
+    with archive.open(info) as member:
+        content = member.read(info.file_size + 1)
+    if len(content) > info.file_size:
+        raise ArchiveError(f"Повреждённый элемент архива: {info.filename}")
+    return content
+
+
+def inline_entry(name, content):
+    """Запись текстового файла или None, если файл нужно хранить в DATA_CHAT_ID."""
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in TEXT_EXTENSIONS and extension not in CODE_EXTENSIONS:
+        return None
+    if len(content) > INLINE_TEXT_LIMIT:
+        return None
+    try:
+        text = content.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    return {
+        "type": "code" if extension in CODE_EXTENSIONS else "text",
+        "content": text,
+        "name": name,
+    }
+
+
+def stored_entry(name, key, stored):
+    return {
+        "type": "document",
+        **stored_fields(key, stored),
+        "name": name,
+    }
+
+
+def find_imported(key):
+    """Файл с тем же содержимым, уже сохранённый в DATA_CHAT_ID, или None."""
+    return find_stored(load_data(), key)
+
+
+def apply_import(user_id, path, entries, archive_name):
+    """Добавляет записи [(папки, запись)] в папку path за одно сохранение; возвращает текст ответа.
+
+    Выполняется в потоке фоновой задачи, поэтому встаёт в очередь пользователя,
+    как его обработчики (изменения папок пользователя защищены только ею).
+    """
+    with user_lock(user_id), data_session():
+        return _apply_import(user_id, path, entries, archive_name)
+
+
+def _apply_import(user_id, path, entries, archive_name):
+    data = load_data()
+    error, project_name, target_path = import_target(data, user_id, path)
+    if error:
+        return error
+    user = data["users"][user_id]
+    for _, entry in entries:
+        entry["short_id"] = new_short_id(data)
+
+    if project_name is None:
+        _merge_entries(data, navigate_to_path(user["structure"], target_path), entries, user_id, target_path)
+        save_data(data)
+        return f"Архив '{archive_name}' импортирован: файлов {len(entries)}."
+
+    with project_lock(user_id, project_name):
+        branch_structure = get_current_branch_structure(data, user_id, project_name)
+        target = navigate_to_path(branch_structure, target_path)
+        for folders in _merge_entries(data, target, entries, user_id, target_path, project_name):
+            touch_path(branch_structure, target_path + folders)
+        touch_path(branch_structure, target_path)
+        set_current_branch_structure(data, user_id, project_name, branch_structure)
+        create_commit(data, user_id, project_name, f"Импорт архива '{archive_name}': файлов {len(entries)}")
+        save_data(data)
+    return f"Архив '{archive_name}' импортирован и закоммичен в проект `{project_name}`: файлов {len(entries)}."
+
+
+def _merge_entries(data, target, entries, owner_id, target_path, project_name=None):
+    # Возвращает пути изменённых папок относительно target. Внутри проекта файл
+    # с тем же именем заменяется (как при обычной загрузке), в папках — добавляется
+    touched = set()
+    for folders, entry in entries:
+        folder = target
+        for name in folders:
+            folder = folder["folders"].setdefault(name, {"folders": {}, "files": []})
+        place_file(data, folder, entry, owner_id, target_path + folders,
+                   project_name=project_name, replace=project_name is not None)
+        touched.add(tuple(folders))
+    return [list(folders) for folders in touched if folders]
+
+
+def _open_archive(content):
+    try:
+        return zipfile.ZipFile(io.BytesIO(content))
+    except zipfile.BadZipFile:
+        raise ArchiveError("Файл не является ZIP-архивом.")
+
+
+def _check_cancelled(cancelled):
+    if cancelled is not None and cancelled():
+        raise ArchiveError("отменён.")
+
+
+def import_archive(bot, chat_id, params, cancelled=None):
+    """Фоновая задача импорта: params = {"file_id", "user_id", "path", "name"}.
+
+    cancelled() проверяется перед каждым файлом архива: отменённый импорт папки не меняет.
+    """
+    try:
+        content = bot.download_file(bot.get_file(params["file_id"]).file_path)
+        entries = []
+        sent = {}  # хеш содержимого -> отправленное из этого архива сообщение
+        with _open_archive(content) as archive:
+            for folders, name, info in plan_members(archive):
+                _check_cancelled(cancelled)
+                data = read_member(archive, info)
+                entry = inline_entry(name, data)
+                if entry is None:
+                    if len(data) > MAX_UPLOAD_SIZE:
+                        raise ArchiveError(f"Файл {info.filename} слишком большой.")
+                    key = content_key(data)
+                    stored = sent.get(key) or find_imported(key)
+                    if stored is None:
+                        message = bot.send_document(DATA_CHAT_ID, data, visible_file_name=name, disable_notification=True)
+                        stored = sent[key] = {"message_id": message.message_id, "file_id": message_file_id(message)}
+                    entry = stored_entry(name, key, stored)
+                entries.append((folders, entry))
+        if not entries:
+            raise ArchiveError("В архиве нет файлов.")
+        _check_cancelled(cancelled)
+        result = apply_import(params["user_id"], params["path"], entries, params["name"])
+        ok = True
+    except ArchiveError as e:
+        result, ok = f"Импорт не выполнен: {e}", False
+    except Exception as e:
+        logger.error(f"Ошибка при импорте архива: {e}")
+        result, ok = f"Ошибка при импорте архива: {str(e)}", False
+    bot.send_message(chat_id, result)
+    return ok
+
+
+async def import_archive_async(bot, chat_id, params, cancelled=None):
+    """Асинхронная версия import_archive; изменение данных — в пуле run_storage()."""
+    try:
+        content = await bot.download_file((await bot.get_file(params["file_id"])).file_path)
+        entries = []
+        sent = {}  # хеш содержимого -> отправленное из этого архива сообщение
+        with _open_archive(content) as archive:
+            for folders, name, info in plan_members(archive):
+                _check_cancelled(cancelled)
+                data = read_member(archive, info)
+                entry = inline_entry(name, data)
+                if entry is None:
+                    if len(data) > MAX_UPLOAD_SIZE:
+                        raise ArchiveError(f"Файл {info.filename} слишком большой.")
+                    key = content_key(data)
+                    stored = sent.get(key) or await run_storage(find_imported, key)
+                    if stored is None:
+                        message = await bot.send_document(DATA_CHAT_ID, data, visible_file_name=name,
+                                                          disable_notification=True)
+                        stored = sent[key] = {"message_id": message.message_id, "file_id": message_file_id(message)}
+                    entry = stored_entry(name, key, stored)
+                entries.append((folders, entry))
+        if not entries:
+            raise ArchiveError("В архиве нет файлов.")
+        _check_cancelled(cancelled)
+        # В асинхронном режиме обработчики пользователя упорядочивает per_user, а не user_lock
+        async with hold_user(params["user_id"]):
+            result = await run_storage(_apply_import, params["user_id"], params["path"], entries, params["name"])
+        ok = True
+    except ArchiveError as e:
+        result, ok = f"Импорт не выполнен: {e}", False
+    except Exception as e:
+        logger.error(f"Ошибка при импорте архива: {e}")
+        result, ok = f"Ошибка при импорте архива: {str(e)}", False
+    await bot.send_message(chat_id, result)
+    return ok
@@ -0,0 +1,113 @@
+# utils/inline.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from telebot import types
+from config import INLINE_CACHE_TTL, INLINE_CACHE_ENTRIES
+from utils.data_manager import resolve_file
+from utils.keyboards import get_file_display_name
+from utils.retrieval import TEXT_LIMIT
+from utils.search import get_search_index
+
+logger = logging.getLogger(__name__)
+
+# Inline-режим (@бот запрос): файлы пользователя ищутся по началу слов имени
+# (при промахе — по похожим словам) в поисковом индексе и отдаются как
+# InlineQueryResultCached* по file_id, сохранённому при загрузке, — Telegram
+# отправляет уже загруженный файл, без повторной загрузки. Тексты и код
+# отдаются статьёй с содержимым. Готовые ответы запоминаются на несколько
+# секунд по (пользователь, запрос): пока пользователь набирает запрос,
+# одинаковые запросы и листание результатов не обращаются к данным.
+
+MAX_INLINE_RESULTS = 200
+INLINE_PAGE_SIZE = 50  # Больше Telegram не принимает в одном ответе
+DESCRIPTION_LENGTH = 100
+
+
+class TtlCache:
+    """Небольшой LRU-кэш, записи которого живут ttl секунд."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ключ -> (момент устаревания, значение)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_answers = TtlCache(INLINE_CACHE_TTL, INLINE_CACHE_ENTRIES)
+
+
+def inline_result(short_id, file_info):
+    """Результат inline-запроса для файла или None, если отдать его без загрузки нельзя."""
+    file_type = file_info.get("type")
+    title = get_file_display_name(file_info, 0)
+    if file_type in ("text", "code"):
+        content = file_info.get("content") or ""
+        if not content:
+            return None
+        return types.InlineQueryResultArticle(
+            short_id, title, types.InputTextMessageContent(content[:TEXT_LIMIT]),
+            description=" ".join(content[:DESCRIPTION_LENGTH].split()))
+    # Файлы, сохранённые до появления file_id, есть только сообщением в DATA_CHAT_ID
+    file_id = file_info.get("file_id")
+    if not file_id:
+        return None
+    if file_type == "photo":
+        return types.InlineQueryResultCachedPhoto(short_id, file_id, title=title)
+    if file_type == "video":
+        return types.InlineQueryResultCachedVideo(short_id, file_id, title)
+    if file_type == "audio":
+        return types.InlineQueryResultCachedAudio(short_id, file_id)
+    return types.InlineQueryResultCachedDocument(short_id, file_id, title)
+
+
+def find_inline_results(data, user_id, query):
+    """Все результаты запроса; попадания индекса сверяются с деревом, как в /find."""
+    search_index = get_search_index()
+    if search_index is None:
+        return []
+    results = []
+    for short_id, _ in search_index.search_names(user_id, query, limit=MAX_INLINE_RESULTS):
+        error, file_info, _ = resolve_file(data, user_id, short_id)
+        if error is None:
+            result = inline_result(short_id, file_info)
+            if result is not None:
+                results.append(result)
+    return results
+
+
+def answer_page(load, user_id, query, offset):
+    """(результаты страницы, next_offset) для inline-запроса.
+
+    load() вызывается только при промахе кэша и возвращает данные бота.
+    """
+    key = (user_id, " ".join(query.lower().split()))
+    results = _answers.get(key)
+    if results is None:
+        results = find_inline_results(load(), user_id, query)
+        _answers.put(key, results)
+    try:
+        start = max(0, int(offset or 0))
+    except ValueError:
+        start = 0
+    end = start + INLINE_PAGE_SIZE
+    return results[start:end], str(end) if end < len(results) else ""
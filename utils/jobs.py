@@ -0,0 +1,349 @@
+# utils/jobs.py
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from telebot import types
+from config import JOBS_FILE, JOB_THREADS
+from utils.data_store import atomic_write
+from utils.callbacks import encode
+from utils.outbound import bulk_requests
+from utils.retrieval import plan_retrieval, send_batch, send_batch_async, ProgressMessage, AsyncProgressMessage
+from utils.export import export_folder, export_folder_async
+from utils.importer import import_archive, import_archive_async
+
+logger = logging.getLogger(__name__)
+
+# Фоновые задачи для долгих операций (выдача большой папки, экспорт и импорт архивов).
+# Обработчик кнопки только ставит задачу в очередь и сразу отвечает.
+# Состояние задачи хранится в JOBS_FILE: вид, чат и курсор — число уже
+# выполненных шагов. Параметры (список файлов, копия дерева папок) бывают
+# большими, поэтому записываются один раз при создании задачи в отдельный
+# файл <JOBS_FILE без расширения>_params/<id>.json, а после каждого шага
+# переписывается только небольшое состояние. После перезапуска бота
+# незавершённые задачи продолжаются с того же места (прерванный шаг может
+# повториться). Ход выполнения показывается в одном сообщении с кнопкой отмены;
+# отмена проверяется между шагами, а долгие одношаговые задачи (экспорт,
+# импорт) проверяют её и внутри шага, между файлами.
+
+MAX_JOBS_PER_CHAT = 3
+
+
+class RetrieveJob:
+    """«Вернуть Все»: params = {"files": [записи файлов на момент запуска]}."""
+
+    def plan(self, params):
+        return plan_retrieval(params["files"])
+
+    def size(self, step):
+        return step[2]
+
+    def title(self, params):
+        # None — в сообщении о ходе выдачи показывается счётчик файлов
+        return None
+
+    def run(self, bot, chat_id, step, cancelled):
+        # Возвращает число элементов шага, которые выполнить не удалось;
+        # cancelled() — отменена ли задача (для долгих шагов)
+        return send_batch(bot, chat_id, step)
+
+    async def run_async(self, bot, chat_id, step, cancelled):
+        return await send_batch_async(bot, chat_id, step)
+
+
+class ExportJob:
+    """Экспорт в ZIP: params = {"tree": копия папки, "name": имя архива}; один шаг."""
+
+    def plan(self, params):
+        return [params]
+
+    def size(self, step):
+        return 1
+
+    def title(self, params):
+        return f"Экспорт «{params['name']}»"
+
+    def run(self, bot, chat_id, step, cancelled):
+        return 0 if export_folder(bot, chat_id, step["tree"], step["name"], cancelled=cancelled) else 1
+
+    async def run_async(self, bot, chat_id, step, cancelled):
+        return 0 if await export_folder_async(bot, chat_id, step["tree"], step["name"], cancelled=cancelled) else 1
+
+
+class ImportJob:
+    """Импорт ZIP: params = {"file_id", "user_id", "path", "name"}; один шаг, один коммит."""
+
+    def plan(self, params):
+        return [params]
+
+    def size(self, step):
+        return 1
+
+    def title(self, params):
+        return f"Импорт архива «{params['name']}»"
+
+    def run(self, bot, chat_id, step, cancelled):
+        return 0 if import_archive(bot, chat_id, step, cancelled=cancelled) else 1
+
+    async def run_async(self, bot, chat_id, step, cancelled):
+        return 0 if await import_archive_async(bot, chat_id, step, cancelled=cancelled) else 1
+
+
+JOB_KINDS = {
+    "retrieve": RetrieveJob(),
+    "export": ExportJob(),
+    "import": ImportJob(),
+}
+
+
+def cancel_markup(job_id):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("⛔ Отменить", callback_data=encode("job_cancel", job_id)))
+    return markup
+
+
+class JobRegistry:
+    """Список задач и его хранение в файле (общая часть потоковой и асинхронной версий)."""
+
+    def __init__(self, bot, path=JOBS_FILE):
+        self.bot = bot
+        self.path = path
+        self.params_dir = os.path.splitext(path)[0] + "_params"
+        self._lock = threading.Lock()
+        self._jobs = self._load()
+        self._stopping = False
+
+    def _params_path(self, job_id):
+        return os.path.join(self.params_dir, f"{job_id}.json")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                jobs = json.load(file)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке фоновых задач: {e}")
+            return {}
+        loaded = {}
+        for job_id, job in jobs.items():
+            if job.get("kind") not in JOB_KINDS:
+                continue
+            if "params" in job:
+                # Задача из JOBS_FILE прежнего формата, где параметры лежали вместе с состоянием
+                self._write_params(job)
+            else:
+                try:
+                    with open(self._params_path(job_id), 'r', encoding='utf-8') as file:
+                        job["params"] = json.load(file)
+                except Exception as e:
+                    logger.error(f"Не удалось прочитать параметры фоновой задачи {job_id}: {e}")
+                    continue
+            loaded[job_id] = job
+        return loaded
+
+    def _write_params(self, job):
+        os.makedirs(self.params_dir, exist_ok=True)
+        atomic_write(self._params_path(job["id"]), json.dumps(job["params"], ensure_ascii=False))
+
+    def _save(self):
+        """Переписывает состояние задач (без параметров)."""
+        with self._lock:
+            state = {job_id: {key: value for key, value in job.items() if key != "params"}
+                     for job_id, job in self._jobs.items()}
+            atomic_write(self.path, json.dumps(state, ensure_ascii=False))
+
+    def _store(self, job):
+        # Параметры пишутся раньше состояния: сохранённая задача всегда находит свои параметры
+        self._write_params(job)
+        self._save()
+
+    def _create(self, kind, chat_id, params):
+        """Новая задача или None, если у чата слишком много незавершённых задач."""
+        chat_id = str(chat_id)
+        with self._lock:
+            if sum(1 for job in self._jobs.values() if job["chat_id"] == chat_id) >= MAX_JOBS_PER_CHAT:
+                return None
+            job_id = uuid.uuid4().hex[:8]
+            job = self._jobs[job_id] = {
+                "id": job_id,
+                "kind": kind,
+                "chat_id": chat_id,
+                "params": params,
+                "cursor": 0,
+                "done": 0,
+                "failed": 0,
+                "message_id": None,
+                "cancelled": False,
+                "created": time.time(),
+            }
+        return job
+
+    def _advance(self, job, done, failed, message_id):
+        with self._lock:
+            job["cursor"] += 1
+            job["done"] += done
+            job["failed"] += failed
+            job["message_id"] = message_id
+
+    def _finish(self, job):
+        with self._lock:
+            self._jobs.pop(job["id"], None)
+        self._save()
+        try:
+            os.remove(self._params_path(job["id"]))
+        except OSError:
+            pass
+
+    def pending(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id, chat_id):
+        """Помечает задачу отменённой; остановится она после текущего шага."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["chat_id"] != str(chat_id):
+                return False
+            job["cancelled"] = True
+        return True
+
+    def _progress(self, progress_cls, job, steps):
+        kind = JOB_KINDS[job["kind"]]
+        total = sum(kind.size(step) for step in steps)
+        return progress_cls(self.bot, int(job["chat_id"]), total, reply_markup=cancel_markup(job["id"]),
+                            message_id=job["message_id"], title=kind.title(job["params"]))
+
+
+class JobManager(JobRegistry):
+    """Выполняет задачи в пуле из JOB_THREADS потоков."""
+
+    def __init__(self, bot, path=JOBS_FILE, threads=JOB_THREADS):
+        super().__init__(bot, path)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="job")
+
+    def resume(self):
+        """Запускает задачи, оставшиеся незавершёнными с прошлого запуска."""
+        jobs = self.pending()
+        if jobs:
+            logger.info(f"Возобновляем фоновые задачи: {len(jobs)}")
+        for job in jobs:
+            self._executor.submit(self._run, job)
+
+    def submit(self, kind, chat_id, params):
+        """Ставит задачу в очередь; возвращает её id или None при превышении лимита."""
+        job = self._create(kind, chat_id, params)
+        if job is None:
+            return None
+        self._store(job)
+        self._executor.submit(self._run, job)
+        return job["id"]
+
+    def _run(self, job):
+        try:
+            with bulk_requests():
+                self._execute(job)
+        except Exception as e:
+            logger.error(f"Ошибка в фоновой задаче {job['id']}: {e}")
+            self._finish(job)
+
+    def _execute(self, job):
+        kind = JOB_KINDS[job["kind"]]
+        chat_id = int(job["chat_id"])
+        steps = kind.plan(job["params"])
+        progress = self._progress(ProgressMessage, job, steps)
+        progress.update(job["done"], job["failed"], force=True)
+        while job["cursor"] < len(steps) and not job["cancelled"]:
+            if self._stopping:
+                return  # Продолжим после перезапуска
+            step = steps[job["cursor"]]
+            failed = kind.run(self.bot, chat_id, step, lambda: job["cancelled"])
+            self._advance(job, kind.size(step) - failed, failed, progress.message_id)
+            self._save()
+            progress.update(job["done"], job["failed"])
+        progress.finish(job["done"], job["failed"], cancelled=job["cancelled"])
+        self._finish(job)
+
+    def shutdown(self):
+        # Начатые шаги завершаются, остальное продолжится после перезапуска
+        self._stopping = True
+        self._executor.shutdown(wait=True)
+
+
+class AsyncJobManager(JobRegistry):
+    """То же для AsyncTeleBot: задачи — корутины, не более JOB_THREADS одновременно."""
+
+    def __init__(self, bot, path=JOBS_FILE, concurrency=JOB_THREADS):
+        super().__init__(bot, path)
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+
+    def _start(self, job):
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def resume(self):
+        jobs = self.pending()
+        if jobs:
+            logger.info(f"Возобновляем фоновые задачи: {len(jobs)}")
+        for job in jobs:
+            self._start(job)
+
+    async def submit(self, kind, chat_id, params):
+        job = self._create(kind, chat_id, params)
+        if job is None:
+            return None
+        await asyncio.to_thread(self._store, job)
+        self._start(job)
+        return job["id"]
+
+    async def _run(self, job):
+        async with self._slots:
+            try:
+                with bulk_requests():
+                    await self._execute(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка в фоновой задаче {job['id']}: {e}")
+                await asyncio.to_thread(self._finish, job)
+
+    async def _execute(self, job):
+        kind = JOB_KINDS[job["kind"]]
+        chat_id = int(job["chat_id"])
+        steps = kind.plan(job["params"])
+        progress = self._progress(AsyncProgressMessage, job, steps)
+        await progress.update(job["done"], job["failed"], force=True)
+        while job["cursor"] < len(steps) and not job["cancelled"]:
+            if self._stopping:
+                return
+            step = steps[job["cursor"]]
+            failed = await kind.run_async(self.bot, chat_id, step, lambda: job["cancelled"])
+            self._advance(job, kind.size(step) - failed, failed, progress.message_id)
+            await asyncio.to_thread(self._save)
+            await progress.update(job["done"], job["failed"])
+        await progress.finish(job["done"], job["failed"], cancelled=job["cancelled"])
+        await asyncio.to_thread(self._finish, job)
+
+    async def shutdown(self):
+        self._stopping = True
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+_manager = None
+
+
+def init_jobs(bot, async_runtime=False):
+    global _manager
+    _manager = AsyncJobManager(bot) if async_runtime else JobManager(bot)
+    return _manager
+
+
+def get_jobs():
+    return _manager
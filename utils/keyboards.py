@@ -1,76 +1,157 @@
 # utils/keyboards.py
 from telebot import types
+from utils.history import short_commit_id
+from utils.navigation import folder_version, list_children
+from utils.callbacks import encode
+from config import FOLDER_PAGE_SIZE
+from collections import OrderedDict
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
 
-def generate_markup(current, path, shared_key=None, project_name=None, page=0, items_per_page=5):
+# Страницы папок листаются курсором — позицией первого элемента страницы в
+# порядке «подпапки, затем файлы» (utils/navigation.list_children), который
+# передаётся в callback_data действий page и shared_page (utils/callbacks.py).
+# Отрисовка страницы не зависит от размера папки, а курсор не зависит от
+# размера страницы, который пользователь может поменять командой /pagesize.
+#
+# Отрисованные страницы кэшируются по (id папки, версия папки, курсор,
+# размер страницы, есть ли кнопка «Вверх», shared_key, проект): листание
+# большой папки и повторная отрисовка после нажатия не обходят её содержимое.
+# Версия меняется при любом изменении папки (utils/navigation.py), так что
+# устаревшие страницы просто перестают запрашиваться и вытесняются.
+# Клавиатура из кэша общая для всех вызовов, изменять её нельзя.
+MAX_RENDERED_PAGES = 4096
+
+_rendered_lock = threading.Lock()
+_rendered = OrderedDict()  # ключ -> (папка, клавиатура)
+
+def generate_markup(current, path, shared_key=None, project_name=None, start=0, items_per_page=FOLDER_PAGE_SIZE):
+    key = (id(current), folder_version(current), start, items_per_page, bool(path), shared_key, project_name)
+    with _rendered_lock:
+        cached = _rendered.get(key)
+        # Папка хранится вместе с клавиатурой, поэтому её id не может достаться другой папке
+        if cached is not None and cached[0] is current:
+            _rendered.move_to_end(key)
+            return cached[1]
+    markup = render_markup(current, path, shared_key, project_name, start, items_per_page)
+    with _rendered_lock:
+        _rendered[key] = (current, markup)
+        _rendered.move_to_end(key)
+        while len(_rendered) > MAX_RENDERED_PAGES:
+            _rendered.popitem(last=False)
+    return markup
+
+def render_markup(current, path, shared_key=None, project_name=None, start=0, items_per_page=FOLDER_PAGE_SIZE):
     markup = types.InlineKeyboardMarkup()
     
     if path:
-        callback_data = "up" if not shared_key else f"shared_up:{shared_key}"
+        callback_data = encode("up") if not shared_key else encode("shared_up", shared_key)
         markup.add(types.InlineKeyboardButton("⬆️ Вверх", callback_data=callback_data))
 
-    # Собираем все элементы (папки и файлы) в один список
-    items = []
-    for folder in current["folders"]:
-        if folder.endswith('.git'):
-            items.append(('folder', folder, f"🔧 {folder}"))
-        else:
-            items.append(('folder', folder, f"📂 {folder}"))
-    
-    for idx, file in enumerate(current["files"], start=1):
-        display_name = get_file_display_name(file, idx)
+    # Курсор за концом папки (после удаления элементов) ведёт на последнюю страницу
+    total, items = list_children(current, start, items_per_page)
+    last = (total - 1) // items_per_page * items_per_page if total else 0
+    if start > last:
+        start = last
+        total, items = list_children(current, start, items_per_page)
+
+    # Добавляем элементы текущей страницы в клавиатуру
+    for item_type, key, file in items:
+        if item_type == 'folder':
+            icon = "🔧" if key.endswith('.git') else "📂"
+            callback_data = encode("folder", key) if not shared_key else encode("shared_folder", shared_key, key)
+            markup.add(types.InlineKeyboardButton(f"{icon} {key}", callback_data=callback_data))
+            continue
         short_id = file.get("short_id")
         if not short_id:
             logger.error(f"Файл без short_id: {file}")
             continue
-        items.append(('file', short_id, display_name))
-
-    # Пагинация
-    total_pages = (len(items) + items_per_page - 1) // items_per_page
-    page = max(0, min(page, total_pages - 1))
-    start = page * items_per_page
-    end = start + items_per_page
-    items_on_page = items[start:end]
-
-    # Добавляем элементы текущей страницы в клавиатуру
-    for item in items_on_page:
-        item_type, item_id, display_name = item
-        if item_type == 'folder':
-            callback_data = f"folder:{item_id}" if not shared_key else f"shared_folder:{shared_key}:{item_id}"
-        else:  # file
-            callback_data = f"file:{item_id}" if not shared_key else f"shared_file:{shared_key}:{item_id}"
-        markup.add(types.InlineKeyboardButton(display_name, callback_data=callback_data))
+        callback_data = encode("file", short_id) if not shared_key else encode("shared_file", shared_key, short_id)
+        markup.add(types.InlineKeyboardButton(get_file_display_name(file, key + 1), callback_data=callback_data))
 
-    # Кнопка "Вернуть Все", если есть файлы
+    # Кнопка "Вернуть Все", если есть файлы, и экспорт всего дерева в архив
+    bottom_buttons = []
     if current["files"]:
         if project_name:
-            callback_data = "retrieve_all_project"
+            callback_data = encode("retrieve_all_project")
         else:
-            callback_data = "retrieve_all" if not shared_key else f"shared_retrieve_all:{shared_key}"
-        markup.add(types.InlineKeyboardButton("📤 Вернуть Все", callback_data=callback_data))
+            callback_data = encode("retrieve_all") if not shared_key else encode("shared_retrieve_all", shared_key)
+        bottom_buttons.append(types.InlineKeyboardButton("📤 Вернуть Все", callback_data=callback_data))
+    if current["files"] or current["folders"]:
+        callback_data = encode("export") if not shared_key else encode("shared_export", shared_key)
+        bottom_buttons.append(types.InlineKeyboardButton("🗜 Экспорт", callback_data=callback_data))
+    if bottom_buttons:
+        markup.row(*bottom_buttons)
 
-    # Добавляем кнопки навигации по страницам
-    nav_buttons = []
-    if page > 0:
-        prev_callback = f"page:{page - 1}" if not shared_key else f"shared_page:{shared_key}:{page - 1}"
-        nav_buttons.append(types.InlineKeyboardButton("⬅️", callback_data=prev_callback))
-    if page < total_pages - 1:
-        next_callback = f"page:{page + 1}" if not shared_key else f"shared_page:{shared_key}:{page + 1}"
-        nav_buttons.append(types.InlineKeyboardButton("➡️", callback_data=next_callback))
-    if nav_buttons:
+    # Навигация по страницам: в начало, назад, номер страницы, вперёд, в конец
+    if total > items_per_page:
+        def page_button(text, cursor):
+            callback_data = encode("page", cursor) if not shared_key else encode("shared_page", shared_key, cursor)
+            return types.InlineKeyboardButton(text, callback_data=callback_data)
+
+        nav_buttons = []
+        if start > 0:
+            nav_buttons.append(page_button("⏮", 0))
+            nav_buttons.append(page_button("⬅️", max(0, start - items_per_page)))
+        pages = (total + items_per_page - 1) // items_per_page
+        nav_buttons.append(page_button(f"{(start + items_per_page - 1) // items_per_page + 1}/{pages}", start))
+        if start + items_per_page < total:
+            nav_buttons.append(page_button("➡️", start + items_per_page))
+            nav_buttons.append(page_button("⏭", last))
         markup.row(*nav_buttons)
 
     if project_name:
         markup.row(
-            types.InlineKeyboardButton("🌿 Создать Ветку", callback_data=f"create_branch_project:{project_name}"),
-            types.InlineKeyboardButton("📜 История Коммитов", callback_data=f"log_project:{project_name}")
+            types.InlineKeyboardButton("🌿 Создать Ветку", callback_data=encode("create_branch_project", project_name)),
+            types.InlineKeyboardButton("📜 История Коммитов", callback_data=encode("log_project", project_name))
         )
-        markup.add(types.InlineKeyboardButton("🔀 Переключиться на Ветку", callback_data=f"switch_branch_project:{project_name}"))
-        markup.add(types.InlineKeyboardButton("👥 Пригласить Участника", callback_data=f"invite_member:{project_name}"))
-        markup.add(types.InlineKeyboardButton("🔙 Выйти из Проекта", callback_data="exit_project"))
+        markup.add(types.InlineKeyboardButton("🔀 Переключиться на Ветку", callback_data=encode("switch_branch_project", project_name)))
+        markup.add(types.InlineKeyboardButton("👥 Пригласить Участника", callback_data=encode("invite_member", project_name)))
+        markup.add(types.InlineKeyboardButton("🔙 Выйти из Проекта", callback_data=encode("exit_project")))
+
+    return markup
+
+def generate_search_markup(results, page, total, page_size):
+    # Кнопка результата открывает папку файла, внизу — листание страниц
+    markup = types.InlineKeyboardMarkup()
+    for short_id, file_info, _ in results:
+        markup.add(types.InlineKeyboardButton(f"📂 {get_file_display_name(file_info, 0)}",
+                                              callback_data=encode("find_go", short_id)))
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(types.InlineKeyboardButton("⬅️", callback_data=encode("find_page", page - 1)))
+    if (page + 1) * page_size < total:
+        nav_buttons.append(types.InlineKeyboardButton("➡️", callback_data=encode("find_page", page + 1)))
+    if nav_buttons:
+        markup.row(*nav_buttons)
+    return markup
+
+def generate_main_menu():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.row('/help', '/mkdir', '/cd', '/up')
+    markup.row('/getmydata', '/share', '/access', '/invite')
+    markup.row('/find', '/open', '/export', '/import')
+    markup.row('/initgit', '/commit', '/branch')
+    markup.row('/checkout', '/log', '/rollback', '/merge')
+    return markup
 
+def generate_branch_markup(project_name, branches):
+    markup = types.InlineKeyboardMarkup()
+    for branch_name in branches:
+        markup.add(types.InlineKeyboardButton(branch_name, callback_data=encode("switch_to_branch", project_name, branch_name)))
+    return markup
+
+def generate_rollback_markup(project_name, commits):
+    # Кнопки отката, от новых коммитов к старым
+    markup = types.InlineKeyboardMarkup()
+    for commit in reversed(commits):
+        short_id = short_commit_id(commit['commit_id'])
+        markup.add(types.InlineKeyboardButton(
+            f"Откатиться к коммиту {short_id}",
+            callback_data=encode("rollback_commit", project_name, short_id)
+        ))
     return markup
 
 def get_file_display_name(file, idx):
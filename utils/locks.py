@@ -0,0 +1,50 @@
+# utils/locks.py
+import threading
+from contextlib import contextmanager
+
+# Блокировки берутся в одном порядке: сначала пользователь, затем проект.
+# Две блокировки проектов одновременно не удерживаются — так взаимная
+# блокировка потоков невозможна.
+
+
+class LockManager:
+    """Блокировки по ключу, создаваемые по требованию.
+
+    Блокировка живёт, пока её кто-то удерживает или ждёт, поэтому словарь
+    не растёт с числом пользователей. Повторный захват тем же потоком
+    допускается (RLock).
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}  # ключ -> [RLock, число владельцев и ожидающих]
+
+    @contextmanager
+    def hold(self, key):
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.RLock(), 0]
+            entry[1] += 1
+        entry[0].acquire()
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+
+_manager = LockManager()
+
+
+def user_lock(user_id):
+    """Сериализует обработку обновлений одного пользователя."""
+    return _manager.hold(("user", str(user_id)))
+
+
+def project_lock(owner_id, project_name):
+    """Сериализует изменения одного проекта, в том числе от разных участников."""
+    return _manager.hold(("project", str(owner_id), project_name))
@@ -0,0 +1,170 @@
+# utils/markup_edits.py
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Обновление клавиатур сообщений после нажатий кнопок:
+#   - для каждого сообщения (chat_id, message_id) помнится хеш последней
+#     отправленной клавиатуры, и правка с той же клавиатурой не отправляется;
+#   - правка выполняется вне обработчика (в пуле потоков или задачей asyncio),
+#     поэтому следующие нажатия пользователя обрабатываются, не дожидаясь
+#     ответа Telegram; пока правка сообщения в пути, новые клавиатуры для него
+#     только заменяют ожидающую, и после ответа отправляется последняя.
+# Серия быстрых нажатий превращается в одну-две правки вместо правки на каждое.
+
+MAX_TRACKED_MESSAGES = 10000
+EDIT_THREADS = 2
+
+
+def markup_digest(markup):
+    return hashlib.blake2b(markup.to_json().encode('utf-8'), digest_size=8).digest()
+
+
+def is_not_modified(error):
+    return "message is not modified" in str(error)
+
+
+class MarkupState:
+    """Хеши отправленных клавиатур и ожидающие правки (общая часть обеих версий)."""
+
+    def __init__(self, max_messages=MAX_TRACKED_MESSAGES):
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._sent = OrderedDict()  # (chat_id, message_id) -> хеш
+        self._pending = {}  # (chat_id, message_id) -> (клавиатура, хеш), ждущая отправки
+        self._in_flight = set()
+
+    def remember(self, chat_id, message_id, markup):
+        """Отмечает клавиатуру, с которой сообщение было отправлено."""
+        with self._lock:
+            self._record((chat_id, message_id), markup_digest(markup))
+
+    def _record(self, key, digest):
+        self._sent[key] = digest
+        self._sent.move_to_end(key)
+        while len(self._sent) > self.max_messages:
+            self._sent.popitem(last=False)
+
+    def _offer(self, key, markup):
+        # True — вызывающий должен запустить отправку; False — правка не нужна или уже в пути
+        digest = markup_digest(markup)
+        with self._lock:
+            if key in self._in_flight:
+                self._pending[key] = (markup, digest)
+                return False
+            if self._sent.get(key) == digest:
+                return False
+            self._in_flight.add(key)
+            self._pending[key] = (markup, digest)
+            return True
+
+    def _next(self, key):
+        # Следующая клавиатура для отправки или None, если отправлять больше нечего
+        with self._lock:
+            while True:
+                entry = self._pending.pop(key, None)
+                if entry is None:
+                    self._in_flight.discard(key)
+                    return None
+                if self._sent.get(key) != entry[1]:
+                    return entry
+
+    def _done(self, key, digest, ok):
+        with self._lock:
+            if ok:
+                self._record(key, digest)
+            else:
+                self._sent.pop(key, None)
+
+
+class MarkupEditor(MarkupState):
+    def __init__(self, bot, threads=EDIT_THREADS):
+        super().__init__()
+        self.bot = bot
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="markup")
+
+    def submit(self, chat_id, message_id, markup):
+        key = (chat_id, message_id)
+        if self._offer(key, markup):
+            self._executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            entry = self._next(key)
+            if entry is None:
+                return
+            markup, digest = entry
+            try:
+                self.bot.edit_message_reply_markup(chat_id=key[0], message_id=key[1], reply_markup=markup)
+                self._done(key, digest, True)
+            except Exception as e:
+                self._done(key, digest, is_not_modified(e))
+                if not is_not_modified(e):
+                    logger.error(f"Ошибка обновления клавиатуры: {e}")
+                    try:
+                        self.bot.send_message(key[0], f"Ошибка обновления клавиатуры: {str(e)}")
+                    except Exception as send_error:
+                        logger.error(f"Ошибка при отправке сообщения: {send_error}")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class AsyncMarkupEditor(MarkupState):
+    def __init__(self, bot):
+        super().__init__()
+        self.bot = bot
+        self._tasks = set()
+
+    def submit(self, chat_id, message_id, markup):
+        key = (chat_id, message_id)
+        if self._offer(key, markup):
+            task = asyncio.get_running_loop().create_task(self._drain(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key):
+        while True:
+            entry = self._next(key)
+            if entry is None:
+                return
+            markup, digest = entry
+            try:
+                await self.bot.edit_message_reply_markup(chat_id=key[0], message_id=key[1], reply_markup=markup)
+                self._done(key, digest, True)
+            except Exception as e:
+                self._done(key, digest, is_not_modified(e))
+                if not is_not_modified(e):
+                    logger.error(f"Ошибка обновления клавиатуры: {e}")
+                    try:
+                        await self.bot.send_message(key[0], f"Ошибка обновления клавиатуры: {str(e)}")
+                    except Exception as send_error:
+                        logger.error(f"Ошибка при отправке сообщения: {send_error}")
+
+    async def shutdown(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+_editor = None
+
+
+def init_markup_editor(bot, async_runtime=False):
+    global _editor
+    _editor = AsyncMarkupEditor(bot) if async_runtime else MarkupEditor(bot)
+    return _editor
+
+
+def get_markup_editor():
+    return _editor
+
+
+def remember_markup(message, markup):
+    """Запоминает клавиатуру только что отправленного или изменённого сообщения."""
+    if _editor is not None and message is not None and markup is not None:
+        _editor.remember(message.chat.id, message.message_id, markup)
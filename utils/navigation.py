@@ -1,6 +1,213 @@
 # utils/navigation.py
+import itertools
+import threading
+from collections import OrderedDict
+
+# Индексы дерева папок (в памяти, не сохраняются):
+#   - TreeIndex для корня дерева: путь -> папка и папка -> путь, так что
+#     переход по пути, к родителю и обратно выполняется за O(1) после
+#     первого обращения;
+#   - для каждой папки: short_id -> позиция файла и имя -> позиция.
+#     Позиция проверяется при каждом поиске, список файлов, изменённый
+#     в обход индекса, просто переиндексируется.
+# Добавлять и заменять файлы нужно через put_file(); после замены поддеревьев
+# (откат, слияние) индекс дерева сбрасывается invalidate_tree().
+# У индекса папки есть версия (folder_version), уникальная для всего процесса:
+# она меняется при put_file(), при изменении числа файлов или подпапок и при
+# замене их списков.
+# По версии кэшируются отрисованные клавиатуры (utils/keyboards.py).
+# Индекс папки также хранит порядок её элементов (сначала подпапки, затем
+# файлы) для постраничного вывода: list_children() отдаёт срез по позиции
+# за время, зависящее только от размера страницы.
+
+MAX_INDEXED_TREES = 1024
+MAX_INDEXED_FOLDERS = 100000
+
+_lock = threading.Lock()
+_trees = OrderedDict()  # id(корня) -> TreeIndex
+_folders = OrderedDict()  # id(папки) -> FileIndex
+_versions = itertools.count(1)
+
+
+class TreeIndex:
+    def __init__(self, root):
+        self.root = root
+        self._nodes = {(): root}  # путь -> папка
+        self._paths = {id(root): ()}  # id(папки) -> путь
+
+    def folder(self, path):
+        key = tuple(path)
+        node = self._nodes.get(key)
+        if node is not None:
+            return node
+        # Спускаемся от ближайшей проиндексированной папки, запоминая путь
+        depth = len(key)
+        while key[:depth] not in self._nodes:
+            depth -= 1
+        node = self._nodes[key[:depth]]
+        for end in range(depth + 1, len(key) + 1):
+            node = node["folders"][key[end - 1]]
+            self._nodes[key[:end]] = node
+            self._paths[id(node)] = key[:end]
+        return node
+
+    def parent(self, path):
+        """Родительская папка (None для корня)."""
+        return self.folder(tuple(path)[:-1]) if path else None
+
+    def path_of(self, folder):
+        """Путь уже открывавшейся папки или None."""
+        path = self._paths.get(id(folder))
+        if path is not None and self._nodes.get(path) is folder:
+            return list(path)
+        return None
+
+
+class FileIndex:
+    def __init__(self, folder):
+        self.folder = folder
+        self.rebuild()
+
+    def rebuild(self, changed=True):
+        if changed:
+            self.version = next(_versions)
+        self.subfolders = self.folder["folders"]
+        self.subfolder_count = len(self.subfolders)
+        self.subfolder_names = None
+        self.files = self.folder["files"]
+        self.size = len(self.files)
+        self.by_id = {}
+        self.by_name = {}
+        for position, entry in enumerate(self.files):
+            if entry.get("short_id") is not None:
+                self.by_id[entry["short_id"]] = position
+            self.by_name.setdefault(entry.get("name"), position)
+
+    def _fresh(self):
+        if self.folder["files"] is not self.files or len(self.files) != self.size:
+            self.rebuild()
+        elif self.folder["folders"] is not self.subfolders or len(self.subfolders) != self.subfolder_count:
+            self.touch()
+
+    def touch(self):
+        self.version = next(_versions)
+        self.subfolders = self.folder["folders"]
+        self.subfolder_count = len(self.subfolders)
+        self.subfolder_names = None
+
+    def children(self, start, count):
+        self._fresh()
+        if self.subfolder_names is None:
+            self.subfolder_names = list(self.subfolders)
+        names = self.subfolder_names
+        items = [("folder", name, None) for name in names[start:start + count]]
+        file_start = max(0, start - len(names))
+        for position in range(file_start, min(self.size, file_start + count - len(items))):
+            items.append(("file", position, self.files[position]))
+        return len(names) + self.size, items
+
+    def _lookup(self, table, key, field):
+        self._fresh()
+        position = table(self).get(key)
+        if position is not None and position < len(self.files) and self.files[position].get(field) == key:
+            return position
+        # Индекс мог устареть из-за изменения в обход put_file(); отсутствующий
+        # ключ, которого нет и после переиндексации, версию папки не меняет
+        self.rebuild(changed=False)
+        found = table(self).get(key)
+        if position is not None or found is not None:
+            self.version = next(_versions)
+        return found
+
+    def position_by_id(self, short_id):
+        return self._lookup(lambda index: index.by_id, short_id, "short_id")
+
+    def position_by_name(self, name):
+        return self._lookup(lambda index: index.by_name, name, "name")
+
+    def put(self, entry, replace):
+        self._fresh()
+        position = self.position_by_name(entry.get("name")) if replace else None
+        replaced = None
+        if position is None:
+            self.files.append(entry)
+            position = self.size = len(self.files) - 1
+            self.by_name.setdefault(entry.get("name"), position)
+        else:
+            replaced = self.files[position]
+            if self.by_id.get(replaced.get("short_id")) == position:
+                del self.by_id[replaced["short_id"]]
+            self.files[position] = entry
+        if entry.get("short_id") is not None:
+            self.by_id[entry["short_id"]] = position
+        self.version = next(_versions)
+        return replaced
+
+
+def _cached(registry, key, obj, factory, limit):
+    with _lock:
+        index = registry.get(key)
+        if index is None or (index.root if isinstance(index, TreeIndex) else index.folder) is not obj:
+            index = registry[key] = factory(obj)
+        registry.move_to_end(key)
+        while len(registry) > limit:
+            registry.popitem(last=False)
+        return index
+
+
+def tree_index(root):
+    return _cached(_trees, id(root), root, TreeIndex, MAX_INDEXED_TREES)
+
+
+def file_index(folder):
+    return _cached(_folders, id(folder), folder, FileIndex, MAX_INDEXED_FOLDERS)
+
+
+def invalidate_tree(root):
+    """Сбрасывает индекс путей дерева после замены его поддеревьев."""
+    with _lock:
+        _trees.pop(id(root), None)
+
+
 def navigate_to_path(structure, path):
-    current = structure
-    for folder in path:
-        current = current["folders"][folder]
-    return current
+    return tree_index(structure).folder(path)
+
+
+def find_folder_path(structure, name):
+    """Путь к первой папке с именем name (обход в ширину) или None."""
+    queue = [((), structure)]
+    for path, folder in queue:
+        for child_name, child in folder.get("folders", {}).items():
+            if child_name == name:
+                return list(path) + [child_name]
+            queue.append((path + (child_name,), child))
+    return None
+
+
+def find_file_by_id(folder, short_id):
+    position = file_index(folder).position_by_id(short_id)
+    return folder["files"][position] if position is not None else None
+
+
+def find_file_by_name(folder, name):
+    position = file_index(folder).position_by_name(name)
+    return folder["files"][position] if position is not None else None
+
+
+def folder_version(folder):
+    index = file_index(folder)
+    with _lock:
+        index._fresh()
+        return index.version
+
+
+def list_children(folder, start, count):
+    """(число элементов папки, элементы с позиции start): ("folder", имя, None) или ("file", позиция, запись)."""
+    index = file_index(folder)
+    with _lock:
+        return index.children(start, count)
+
+
+def put_file(folder, entry, replace=False):
+    """Добавляет запись файла; при replace заменяет файл с тем же именем и возвращает заменённую запись."""
+    return file_index(folder).put(entry, replace)
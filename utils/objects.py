@@ -0,0 +1,202 @@
+# utils/objects.py
+import hashlib
+import json
+
+# Хранилище объектов проекта устроено как в git: коммит ссылается на дерево
+# по хешу содержимого, дерево — на поддеревья и записи файлов по их хешам.
+# Неизменённые поддеревья общие для всех коммитов, поэтому новый коммит
+# добавляет только объекты на пути от корня до изменённого файла.
+#
+#   project["trees"][oid] = {"folders": {имя: oid}, "files": [oid, ...]}
+#   project["blobs"][oid] = запись файла
+#
+# В рабочей структуре ветки у папок и файлов кэшируется ключ "oid".
+# Любое изменение папки должно сбрасывать его через touch_path().
+
+
+def _hash(kind, payload):
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(f"{kind}\0{text}".encode('utf-8'), digest_size=12).hexdigest()
+
+
+def ensure_object_store(project):
+    if "trees" not in project:
+        project["trees"] = {}
+    if "blobs" not in project:
+        project["blobs"] = {}
+
+
+def write_blob(project, entry, created=None):
+    """oid записи файла; новые объекты blob добавляются в список created."""
+    oid = entry.get("oid")
+    if oid and oid in project["blobs"]:
+        return oid
+    payload = {key: value for key, value in entry.items() if key != "oid"}
+    oid = _hash("blob", payload)
+    if oid not in project["blobs"]:
+        project["blobs"][oid] = payload
+        if created is not None:
+            created.append(payload)
+    entry["oid"] = oid
+    return oid
+
+
+def write_tree(project, folder, created=None):
+    """Сохраняет папку рабочей структуры и возвращает oid её дерева."""
+    oid = folder.get("oid")
+    if oid and oid in project["trees"]:
+        return oid
+    node = {
+        "folders": {name: write_tree(project, child, created) for name, child in folder.get("folders", {}).items()},
+        "files": [write_blob(project, entry, created) for entry in folder.get("files", [])],
+    }
+    oid = put_tree(project, node)
+    folder["oid"] = oid
+    return oid
+
+
+def read_tree(project, oid):
+    """Восстанавливает рабочую структуру (с кэшированными oid) из дерева."""
+    node = project["trees"][oid]
+    return {
+        "folders": {name: read_tree(project, child_oid) for name, child_oid in node["folders"].items()},
+        "files": [dict(project["blobs"][blob_oid], oid=blob_oid) for blob_oid in node["files"]],
+        "oid": oid,
+    }
+
+
+def touch_path(structure, path):
+    """Сбрасывает кэшированные oid от корня до папки path после её изменения."""
+    folder = structure
+    folder.pop("oid", None)
+    for name in path:
+        folder = folder["folders"][name]
+        folder.pop("oid", None)
+
+
+def reachable_objects(project, tree_oids):
+    trees, blobs = set(), set()
+    stack = list(tree_oids)
+    while stack:
+        oid = stack.pop()
+        if oid in trees or oid not in project["trees"]:
+            continue
+        trees.add(oid)
+        node = project["trees"][oid]
+        blobs.update(node["files"])
+        stack.extend(node["folders"].values())
+    return trees, blobs
+
+
+def working_objects(project, folder):
+    """(oid деревьев, oid записей файлов), на которые ссылается рабочая структура ветки.
+
+    Папка с актуальным oid учитывается деревом целиком, в изменённых папках
+    собираются oid записей файлов (place_file пишет объект сразу).
+    """
+    trees, blobs = [], []
+    stack = [folder]
+    while stack:
+        folder = stack.pop()
+        if folder.get("oid") in project["trees"]:
+            trees.append(folder["oid"])
+            continue
+        blobs.extend(entry["oid"] for entry in folder.get("files", []) if entry.get("oid"))
+        stack.extend(folder.get("folders", {}).values())
+    return trees, blobs
+
+
+def prune_objects(project, tree_oids, blob_oids=()):
+    """Удаляет объекты, недостижимые из указанных деревьев и записей файлов; возвращает удалённые записи файлов."""
+    trees, blobs = reachable_objects(project, tree_oids)
+    blobs.update(blob_oids)
+    for oid in [oid for oid in project["trees"] if oid not in trees]:
+        del project["trees"][oid]
+    return [project["blobs"].pop(oid) for oid in [oid for oid in project["blobs"] if oid not in blobs]]
+
+
+def put_tree(project, node):
+    oid = _hash("tree", node)
+    project["trees"].setdefault(oid, node)
+    return oid
+
+
+def checkout_tree(project, folder, oid):
+    """Приводит рабочую папку к дереву oid, перестраивая только отличающиеся поддеревья."""
+    if folder.get("oid") == oid:
+        return folder
+    node = project["trees"][oid]
+    old_folders = folder.get("folders", {})
+    folder["folders"] = {
+        name: checkout_tree(project, old_folders[name], child_oid) if name in old_folders else read_tree(project, child_oid)
+        for name, child_oid in node["folders"].items()
+    }
+    folder["files"] = [dict(project["blobs"][blob_oid], oid=blob_oid) for blob_oid in node["files"]]
+    folder["oid"] = oid
+    return folder
+
+
+EMPTY_TREE = {"folders": {}, "files": []}
+
+
+def _three_way(base, ours, theirs):
+    # Возвращает (результат, конфликт). При конфликте побеждает источник слияния,
+    # а изменённая версия — удалённую.
+    if ours == theirs:
+        return ours, False
+    if base == ours:
+        return theirs, False
+    if base == theirs:
+        return ours, False
+    return (theirs if theirs is not None else ours), True
+
+
+def merge_trees(project, base, ours, theirs, path=()):
+    """Трёхстороннее слияние деревьев.
+
+    Спускается только в поддеревья, oid которых различаются, поэтому
+    стоимость зависит от размера изменений, а не всего дерева.
+    Возвращает oid результата и список путей с конфликтами.
+    """
+    if ours == theirs:
+        return ours, []
+    if base == ours:
+        return theirs, []
+    if base == theirs:
+        return ours, []
+
+    trees, blobs = project["trees"], project["blobs"]
+    base_node = trees[base] if base else EMPTY_TREE
+    ours_node = trees[ours] if ours else EMPTY_TREE
+    theirs_node = trees[theirs] if theirs else EMPTY_TREE
+    conflicts = []
+
+    folders = {}
+    names = list(ours_node["folders"]) + [name for name in theirs_node["folders"] if name not in ours_node["folders"]]
+    for name in names:
+        base_child = base_node["folders"].get(name)
+        ours_child = ours_node["folders"].get(name)
+        theirs_child = theirs_node["folders"].get(name)
+        if ours_child is None or theirs_child is None:
+            result, conflict = _three_way(base_child, ours_child, theirs_child)
+            if conflict:
+                conflicts.append("/".join(path + (name,)))
+        else:
+            result, child_conflicts = merge_trees(project, base_child, ours_child, theirs_child, path + (name,))
+            conflicts.extend(child_conflicts)
+        if result is not None:
+            folders[name] = result
+
+    def files_by_name(node):
+        return {blobs[oid].get("name"): oid for oid in node["files"]}
+
+    base_files, ours_files, theirs_files = files_by_name(base_node), files_by_name(ours_node), files_by_name(theirs_node)
+    files = []
+    for name in list(ours_files) + [name for name in theirs_files if name not in ours_files]:
+        result, conflict = _three_way(base_files.get(name), ours_files.get(name), theirs_files.get(name))
+        if conflict:
+            conflicts.append("/".join(path + (name,)))
+        if result is not None:
+            files.append(result)
+
+    return put_tree(project, {"folders": folders, "files": files}), conflicts
@@ -0,0 +1,317 @@
+# utils/outbound.py
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from telebot import apihelper
+from config import (
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_GROUP_RATE,
+    OUTBOUND_MAX_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Все запросы к Bot API проходят через общий планировщик:
+#   - token bucket на бота и на каждый чат (в группы — реже, чем в личные чаты);
+#   - ответ 429 блокирует чат (или весь бот) на retry_after, после чего запрос повторяется;
+#   - сетевые ошибки и 5xx повторяются с экспоненциальной задержкой;
+#     файлы запроса перед повтором перематываются в начало, а запрос с файлом,
+#     который перемотать нельзя, не повторяется;
+#   - интерактивные ответы обслуживаются раньше массовой выдачи (bulk_requests()).
+
+INTERACTIVE = 0
+BULK = 1
+
+# Методы, которые не ограничиваются (long polling и настройка вебхука)
+UNLIMITED_METHODS = {"getUpdates", "setWebhook", "deleteWebhook", "getWebhookInfo", "getMe", "getChat"}
+# Методы, расходующие лимит чата
+CHAT_METHOD_PREFIXES = ("send", "copy", "forward", "edit")
+
+RETRY_STATUSES = {500, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+MAX_CHAT_BUCKETS = 10000
+
+_priority = contextvars.ContextVar("outbound_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def bulk_requests():
+    """Запросы внутри блока уступают очередь интерактивным ответам."""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def backoff_delay(attempt):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now):
+        """Через сколько секунд будет доступен токен (0 — уже доступен)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        return now >= self.blocked_until and self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """Выдаёт разрешения на запросы в порядке приоритета с учётом лимитов.
+
+    Запрос ждёт, пока есть токен и в общем ведре, и в ведре его чата, и пока
+    впереди нет более приоритетного запроса, который тоже мог бы быть отправлен.
+    Запросы в «занятый» чат не задерживают остальные чаты.
+    """
+
+    def __init__(self, global_rate, chat_rate, chat_burst, group_rate):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._waiting = []  # куча (приоритет, порядковый номер, чат)
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def _chat_bucket(self, chat_id):
+        if chat_id is None:
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                for key in [key for key, value in self._chats.items() if value.idle(now)]:
+                    del self._chats[key]
+            # Отрицательные id — группы и каналы, для них лимит строже
+            rate = self.group_rate if str(chat_id).startswith('-') else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _ticket_delay(self, chat_id, now):
+        chat_bucket = self._chat_bucket(chat_id)
+        chat_delay = chat_bucket.delay(now) if chat_bucket else 0.0
+        return max(self._global.delay(now), chat_delay)
+
+    def _try_grant(self, ticket, now):
+        """0 — разрешение выдано; иначе сколько ждать (None — ждать уведомления)."""
+        own_delay = self._ticket_delay(ticket[2], now)
+        if own_delay > 0:
+            return own_delay
+        # Впереди по приоритету может стоять запрос в свободный чат — пропускаем его
+        for other in sorted(self._waiting):
+            if other is ticket:
+                break
+            chat_bucket = self._chat_bucket(other[2])
+            if chat_bucket is None or chat_bucket.delay(now) == 0:
+                return None
+        self._global.take()
+        chat_bucket = self._chat_bucket(ticket[2])
+        if chat_bucket is not None:
+            chat_bucket.take()
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        return 0
+
+    def _enqueue(self, chat_id, priority):
+        ticket = (priority, next(self._counter), chat_id)
+        heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _cancel(self, ticket):
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+        self._cond.notify_all()
+
+    def acquire(self, chat_id=None, priority=INTERACTIVE):
+        with self._cond:
+            ticket = self._enqueue(chat_id, priority)
+            try:
+                while True:
+                    delay = self._try_grant(ticket, time.monotonic())
+                    if delay == 0:
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(delay)
+            except BaseException:
+                self._cancel(ticket)
+                raise
+
+    async def acquire_async(self, chat_id=None, priority=INTERACTIVE):
+        # Все вызовы идут из одного цикла событий, блокировка берётся без ожидания
+        with self._cond:
+            ticket = self._enqueue(chat_id, priority)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_grant(ticket, time.monotonic())
+                if delay == 0:
+                    return
+                await asyncio.sleep(min(delay if delay is not None else 0.05, 1.0))
+        except BaseException:
+            with self._cond:
+                self._cancel(ticket)
+            raise
+
+    def block(self, chat_id, seconds):
+        """Запрещает запросы в чат (или всему боту, если чат неизвестен) на seconds секунд."""
+        with self._cond:
+            bucket = self._chat_bucket(chat_id) or self._global
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+
+limiter = RateLimiter(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_GROUP_RATE)
+
+
+def _limited_chat(api_method, params):
+    if not params or not api_method.startswith(CHAT_METHOD_PREFIXES):
+        return None
+    return params.get("chat_id")
+
+
+def _retry_after(response):
+    try:
+        return float(response.json().get("parameters", {}).get("retry_after", 1))
+    except Exception:
+        return 1.0
+
+
+def _file_object(value):
+    if isinstance(value, tuple):
+        value = value[1] if len(value) > 1 else None
+    return getattr(value, "file", value)  # InputFile хранит сам файл в .file
+
+
+def rewind_files(files):
+    """Перематывает файлы запроса перед повтором; False — какой-то файл уже не прочитать заново."""
+    for value in (files or {}).values():
+        file = _file_object(value)
+        if not hasattr(file, "read"):
+            continue  # bytes и строки отправляются заново целиком
+        try:
+            if not file.seekable():
+                return False
+            file.seek(0)
+        except (AttributeError, OSError, ValueError):
+            return False
+    return True
+
+
+def send_request(method, url, params=None, files=None, **kwargs):
+    """Замена отправки запроса в telebot (apihelper.CUSTOM_REQUEST_SENDER)."""
+    api_method = url.rsplit('/', 1)[-1]
+    session = apihelper._get_req_session()
+    if api_method in UNLIMITED_METHODS:
+        return session.request(method, url, params=params, files=files, **kwargs)
+    chat_id = _limited_chat(api_method, params)
+    attempt = 0
+    while True:
+        limiter.acquire(chat_id, _priority.get())
+        try:
+            response = session.request(method, url, params=params, files=files, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            # Соединение не установлено — запрос точно не дошёл, повторять безопасно
+            if attempt >= OUTBOUND_MAX_RETRIES or not rewind_files(files):
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"{api_method}: ошибка соединения ({e.__class__.__name__}), повтор через {delay:.1f} с")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        if attempt >= OUTBOUND_MAX_RETRIES or response.status_code not in RETRY_STATUSES | {429}:
+            return response
+        # Файлы уже прочитаны первой попыткой; без перемотки повтор ушёл бы пустым
+        if not rewind_files(files):
+            return response
+        if response.status_code == 429:
+            retry_after = _retry_after(response)
+            logger.warning(f"{api_method}: 429 Too Many Requests, пауза {retry_after} с")
+            limiter.block(chat_id, retry_after)
+            attempt += 1
+            continue
+        delay = backoff_delay(attempt)
+        logger.warning(f"{api_method}: ответ {response.status_code}, повтор через {delay:.1f} с")
+        time.sleep(delay)
+        attempt += 1
+
+
+def install_outbound_limiter():
+    apihelper.CUSTOM_REQUEST_SENDER = send_request
+
+
+def install_async_outbound_limiter():
+    """То же для AsyncTeleBot: оборачивает asyncio_helper._process_request."""
+    import aiohttp
+    from telebot import asyncio_helper
+    original = asyncio_helper._process_request
+    if getattr(original, "rate_limited", False):
+        return
+
+    async def process_request(token, url, method='get', params=None, files=None, **kwargs):
+        if url in UNLIMITED_METHODS:
+            return await original(token, url, method, params=params, files=files, **kwargs)
+        chat_id = _limited_chat(url, params)
+        attempt = 0
+        while True:
+            await limiter.acquire_async(chat_id, _priority.get())
+            try:
+                # original() изменяет params, поэтому каждой попытке — своя копия
+                return await original(token, url, method, params=dict(params) if params else params,
+                                      files=files, **kwargs)
+            except asyncio_helper.ApiTelegramException as e:
+                if attempt >= OUTBOUND_MAX_RETRIES or not rewind_files(files):
+                    raise
+                if e.error_code == 429:
+                    retry_after = float((e.result_json or {}).get("parameters", {}).get("retry_after", 1))
+                    logger.warning(f"{url}: 429 Too Many Requests, пауза {retry_after} с")
+                    limiter.block(chat_id, retry_after)
+                elif e.error_code in RETRY_STATUSES:
+                    await asyncio.sleep(backoff_delay(attempt))
+                else:
+                    raise
+            except asyncio_helper.ApiHTTPException as e:
+                if attempt >= OUTBOUND_MAX_RETRIES or e.result.status not in RETRY_STATUSES \
+                        or not rewind_files(files):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+            except asyncio_helper.RequestTimeout as e:
+                # Истёкший запрос мог уже дойти, поэтому, как и в синхронной версии,
+                # повторяется только запрос, для которого не удалось установить соединение
+                if attempt >= OUTBOUND_MAX_RETRIES or not isinstance(e.__cause__, aiohttp.ClientConnectorError) \
+                        or not rewind_files(files):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    process_request.rate_limited = True
+    asyncio_helper._process_request = process_request
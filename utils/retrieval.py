@@ -0,0 +1,336 @@
+# utils/retrieval.py
+import logging
+import time
+from telebot import types
+from config import DATA_CHAT_ID
+from utils.keyboards import get_file_display_name
+
+logger = logging.getLogger(__name__)
+
+# Пакетная выдача содержимого папки («Вернуть Все»):
+#   - подряд идущие тексты склеиваются в сообщения до TEXT_LIMIT символов;
+#   - фото/видео, документы и аудио с известным file_id уходят альбомами
+#     до ALBUM_SIZE штук (sendMediaGroup);
+#   - остальные файлы копируются из DATA_CHAT_ID одним copyMessages на
+#     серию до COPY_BATCH_SIZE сообщений с возрастающими id (так требует API).
+# Подпись файла сохраняется в записи при загрузке ("caption",
+# "caption_entities") и передаётся явно: в InputMedia альбома и в copyMessage
+# для одиночного файла. Сообщение в DATA_CHAT_ID общее для одинаковых файлов
+# (utils/stored_files.py), поэтому его собственная подпись может быть чужой:
+# у файла с ключом дедупликации без своей подписи она снимается (caption="",
+# remove_caption в copyMessages). Подпись сохраняется только у файлов,
+# загруженных до дедупликации, — их сообщение ни с кем не общее.
+
+TEXT_LIMIT = 4096
+ALBUM_SIZE = 10
+COPY_BATCH_SIZE = 100
+PROGRESS_INTERVAL = 1.0  # Не чаще раза в секунду редактируем сообщение о ходе выдачи
+
+ALBUM_GROUPS = {"photo": "visual", "video": "visual", "document": "document", "audio": "audio"}
+INPUT_MEDIA = {
+    "photo": types.InputMediaPhoto,
+    "video": types.InputMediaVideo,
+    "document": types.InputMediaDocument,
+    "audio": types.InputMediaAudio,
+}
+
+
+def message_file_id(message):
+    """file_id вложения сообщения (для альбомов при выдаче) или None."""
+    if message.content_type == 'photo':
+        return message.photo[-1].file_id
+    attachment = getattr(message, message.content_type, None)
+    return getattr(attachment, "file_id", None)
+
+
+def message_caption(message):
+    """Поля подписи вложения для записи файла ({} — подписи нет)."""
+    if not message.caption:
+        return {}
+    fields = {"caption": message.caption}
+    if message.caption_entities:
+        fields["caption_entities"] = [{key: value for key, value in entity.to_dict().items() if value is not None}
+                                      for entity in message.caption_entities]
+    return fields
+
+
+def _caption_kwargs(caption):
+    # caption — {"caption", "caption_entities"} из записи файла; {"caption": ""} снимает подпись
+    if not caption:
+        return {}
+    kwargs = {"caption": caption["caption"]}
+    if caption.get("caption_entities"):
+        kwargs["caption_entities"] = [types.MessageEntity.de_json(entity) for entity in caption["caption_entities"]]
+    return kwargs
+
+
+def _caption(file_info):
+    # Подпись для отправки: своя, пустая (сообщение может быть общим) или {} — подпись сообщения
+    if file_info.get("caption"):
+        return {field: file_info[field] for field in ("caption", "caption_entities") if file_info.get(field)}
+    return {"caption": ""} if file_info.get("storage_key") else {}
+
+
+def caption_kwargs(file_info):
+    """Аргументы подписи для copy_message одного файла."""
+    return _caption_kwargs(_caption(file_info))
+
+
+def _text_chunks(file_info, idx):
+    content = file_info.get("content") or ""
+    header = get_file_display_name(file_info, idx)
+    text = f"{header}\n{content}"
+    return [text[start:start + TEXT_LIMIT] for start in range(0, len(text), TEXT_LIMIT)]
+
+
+def plan_retrieval(files):
+    """Разбивает файлы на пакеты с сохранением порядка.
+
+    Пакет — (вид, содержимое, число файлов): ("text", строка, n),
+    ("album", [(тип, file_id, message_id, подпись)], n), ("copy", [message_id], n),
+    ("copy_uncaptioned", [message_id], n) — копирование со снятием подписи
+    или ("captioned", (message_id, подпись), 1) для одиночного файла с подписью.
+    Тексты без содержимого пропускаются.
+    """
+    batches = []
+    current = None  # [вид, содержимое, число файлов, группа альбома]
+
+    def flush():
+        nonlocal current
+        if current is None:
+            return
+        kind, payload, count, _ = current
+        if kind == "album" and len(payload) == 1:
+            # Альбом из одного файла — обычное копирование
+            _, _, message_id, caption = payload[0]
+            kind, payload = ("captioned", (message_id, caption)) if caption else ("copy", [message_id])
+            if caption == {"caption": ""}:
+                kind, payload = "copy_uncaptioned", [message_id]
+        batches.append((kind, payload, count))
+        current = None
+
+    for idx, file_info in enumerate(files, start=1):
+        file_type = file_info.get("type")
+        if file_type in ("text", "code"):
+            if not file_info.get("content"):
+                continue
+            chunks = _text_chunks(file_info, idx)
+            for chunk_idx, chunk in enumerate(chunks):
+                last = chunk_idx == len(chunks) - 1
+                if current is not None and current[0] == "text" and \
+                        len(current[1]) + 2 + len(chunk) <= TEXT_LIMIT:
+                    current[1] += "\n\n" + chunk
+                    current[2] += 1 if last else 0
+                else:
+                    flush()
+                    current = ["text", chunk, 1 if last else 0, None]
+            continue
+
+        message_id = file_info.get("message_id")
+        if message_id is None:
+            continue
+        group = ALBUM_GROUPS.get(file_type)
+        item = (file_type, file_info.get("file_id"), message_id, _caption(file_info))
+        if file_info.get("file_id") and group:
+            if current is not None and current[0] == "album" and current[3] == group and len(current[1]) < ALBUM_SIZE:
+                current[1].append(item)
+                current[2] += 1
+            else:
+                flush()
+                current = ["album", [item], 1, group]
+            continue
+        if item[3].get("caption"):
+            flush()
+            batches.append(("captioned", (message_id, item[3]), 1))
+            continue
+
+        copy_kind = "copy_uncaptioned" if item[3] else "copy"
+        if current is not None and current[0] == copy_kind and len(current[1]) < COPY_BATCH_SIZE \
+                and message_id > current[1][-1]:
+            current[1].append(message_id)
+            current[2] += 1
+        else:
+            flush()
+            current = [copy_kind, [message_id], 1, None]
+    flush()
+    return batches
+
+
+def _media(batch_payload):
+    return [INPUT_MEDIA[file_type](file_id, **_caption_kwargs(caption))
+            for file_type, file_id, _, caption in batch_payload]
+
+
+def _copies(kind, payload):
+    # (message_id, подпись) для поштучного копирования
+    if kind == "album":
+        return [(item[2], item[3]) for item in payload]
+    if kind == "captioned":
+        return [payload]
+    caption = {"caption": ""} if kind == "copy_uncaptioned" else None
+    return [(message_id, caption) for message_id in payload]
+
+
+def progress_text(sent, total, failed=0, done=False, cancelled=False):
+    if cancelled:
+        text = f"⛔ Отправка отменена: отправлено файлов {sent} из {total}."
+    elif done:
+        text = f"✅ Отправлено файлов: {sent} из {total}."
+    else:
+        text = f"📤 Отправка файлов: {sent}/{total}..."
+    if failed:
+        text += f"\nНе удалось отправить: {failed}."
+    return text
+
+
+def status_text(title, done=False, cancelled=False, failed=0):
+    """Состояние задачи без счётчика файлов (экспорт, импорт)."""
+    if cancelled:
+        return f"⛔ {title}: отменено."
+    if done:
+        return f"⚠️ {title}: не выполнено." if failed else f"✅ {title}: готово."
+    return f"⏳ {title}..."
+
+
+class ProgressMessage:
+    """Одно сообщение о ходе выдачи, которое редактируется на месте.
+
+    reply_markup (например, кнопка отмены) показывается, пока выдача не завершена;
+    message_id позволяет продолжить редактировать уже отправленное сообщение.
+    С title вместо счётчика файлов показывается состояние задачи (status_text).
+    """
+
+    def __init__(self, bot, chat_id, total, reply_markup=None, message_id=None, title=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.total = total
+        self.reply_markup = reply_markup
+        self.message_id = message_id
+        self.title = title
+        self._last_text = None
+        self._last_edit = 0.0
+
+    def _render(self, text, reply_markup=None):
+        if text == self._last_text:
+            return
+        try:
+            if self.message_id is None:
+                self.message_id = self.bot.send_message(self.chat_id, text, reply_markup=reply_markup).message_id
+            else:
+                self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id,
+                                           reply_markup=reply_markup)
+            self._last_text = text
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение о ходе выдачи: {e}")
+
+    def text(self, sent, failed=0, done=False, cancelled=False):
+        if self.title:
+            return status_text(self.title, done=done, cancelled=cancelled, failed=failed)
+        return progress_text(sent, self.total, failed, done=done, cancelled=cancelled)
+
+    def update(self, sent, failed=0, force=False):
+        now = time.monotonic()
+        if force or now - self._last_edit >= PROGRESS_INTERVAL:
+            self._last_edit = now
+            self._render(self.text(sent, failed), self.reply_markup)
+
+    def finish(self, sent, failed=0, cancelled=False):
+        self._render(self.text(sent, failed, done=True, cancelled=cancelled))
+
+
+def send_batch(bot, chat_id, batch):
+    """Отправляет один пакет; возвращает число файлов, которые отправить не удалось."""
+    kind, payload, count = batch
+    try:
+        if kind == "text":
+            bot.send_message(chat_id, payload)
+        elif kind == "album":
+            bot.send_media_group(chat_id, _media(payload))
+        elif kind == "captioned":
+            bot.copy_message(chat_id, DATA_CHAT_ID, payload[0], **_caption_kwargs(payload[1]))
+        else:
+            bot.copy_messages(chat_id, DATA_CHAT_ID, payload, remove_caption=kind == "copy_uncaptioned")
+        return 0
+    except Exception as e:
+        if kind == "text":
+            logger.error(f"Ошибка при отправке текста: {e}")
+            return count
+        logger.warning(f"Пакетная отправка не удалась ({e}), отправляем по одному")
+    failed = 0
+    for message_id, caption in _copies(kind, payload):
+        try:
+            bot.copy_message(chat_id=chat_id, from_chat_id=DATA_CHAT_ID, message_id=message_id,
+                             **_caption_kwargs(caption))
+        except Exception as e:
+            logger.error(f"Ошибка при копировании файла: {e}")
+            failed += 1
+    return failed
+
+
+def send_single(bot, chat_id, file_info):
+    """Отправляет один файл (/open); False, если отправлять нечего или отправка не удалась."""
+    batches = plan_retrieval([file_info])
+    return bool(batches) and sum(send_batch(bot, chat_id, batch) for batch in batches) == 0
+
+
+# Асинхронные версии для AsyncTeleBot
+
+class AsyncProgressMessage(ProgressMessage):
+    async def _render(self, text, reply_markup=None):
+        if text == self._last_text:
+            return
+        try:
+            if self.message_id is None:
+                message = await self.bot.send_message(self.chat_id, text, reply_markup=reply_markup)
+                self.message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id,
+                                                 reply_markup=reply_markup)
+            self._last_text = text
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение о ходе выдачи: {e}")
+
+    async def update(self, sent, failed=0, force=False):
+        now = time.monotonic()
+        if force or now - self._last_edit >= PROGRESS_INTERVAL:
+            self._last_edit = now
+            await self._render(self.text(sent, failed), self.reply_markup)
+
+    async def finish(self, sent, failed=0, cancelled=False):
+        await self._render(self.text(sent, failed, done=True, cancelled=cancelled))
+
+
+async def send_batch_async(bot, chat_id, batch):
+    kind, payload, count = batch
+    try:
+        if kind == "text":
+            await bot.send_message(chat_id, payload)
+        elif kind == "album":
+            await bot.send_media_group(chat_id, _media(payload))
+        elif kind == "captioned":
+            await bot.copy_message(chat_id, DATA_CHAT_ID, payload[0], **_caption_kwargs(payload[1]))
+        else:
+            await bot.copy_messages(chat_id, DATA_CHAT_ID, payload, remove_caption=kind == "copy_uncaptioned")
+        return 0
+    except Exception as e:
+        if kind == "text":
+            logger.error(f"Ошибка при отправке текста: {e}")
+            return count
+        logger.warning(f"Пакетная отправка не удалась ({e}), отправляем по одному")
+    failed = 0
+    for message_id, caption in _copies(kind, payload):
+        try:
+            await bot.copy_message(chat_id=chat_id, from_chat_id=DATA_CHAT_ID, message_id=message_id,
+                                   **_caption_kwargs(caption))
+        except Exception as e:
+            logger.error(f"Ошибка при копировании файла: {e}")
+            failed += 1
+    return failed
+
+
+async def send_single_async(bot, chat_id, file_info):
+    batches = plan_retrieval([file_info])
+    failed = 0
+    for batch in batches:
+        failed += await send_batch_async(bot, chat_id, batch)
+    return bool(batches) and failed == 0
@@ -0,0 +1,328 @@
+# utils/search.py
+import bisect
+import difflib
+import json
+import logging
+import os
+import re
+import threading
+from utils.data_store import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Полнотекстовый поиск (/find): инвертированный индекс по именам файлов и
+# содержимому текстов и кода. Для каждого владельца хранится
+# слово -> {short_id: вес}, так что запрос — пересечение нескольких
+# словарей, начиная с самого короткого, без обхода деревьев.
+# Индекс живёт в памяти; изменения дописываются в журнал SEARCH_INDEX_FILE
+# (строка JSON на изменение), при запуске журнал проигрывается и, если
+# разросся, переписывается снимком. Нет файла — индекс строится по данным.
+# Для inline-режима слова имён файлов дополнительно лежат в отсортированном
+# словаре владельца: поиск по началу слова — двоичный поиск, при промахе —
+# ближайшие по написанию слова (difflib) среди слов на ту же букву и
+# близкой длины, чтобы не перебирать весь словарь.
+
+TOKEN_RE = re.compile(r"\w+")
+MIN_TOKEN_LENGTH = 2
+NAME_WEIGHT = 5  # Слово в имени файла весит как столько вхождений в тексте
+MAX_TERM_FREQUENCY = 10
+MAX_INDEXED_CONTENT = 256 * 1024
+MAX_RESULTS = 500
+PAGE_SIZE = 5
+CONTENT_TYPES = ("text", "code")
+MAX_PREFIX_WORDS = 1000  # Сколько слов словаря перебирать для одного начала слова
+FUZZY_CUTOFF = 0.75
+MAX_FUZZY_WORDS = 2000
+NAME_PART_RE = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) >= MIN_TOKEN_LENGTH]
+
+
+def name_tokens(name):
+    """Слова имени для поиска по началу слова: report_2024 даёт и report, и 2024."""
+    tokens = set(tokenize(name))
+    for token in list(tokens):
+        if "_" in token:
+            tokens.update(part for part in NAME_PART_RE.findall(token) if len(part) >= MIN_TOKEN_LENGTH)
+    return tokens
+
+
+def query_tokens(query):
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def file_terms(entry):
+    """Слова файла с весами: имя весит больше, частота в тексте ограничена."""
+    terms = {}
+    for token in tokenize(entry.get("name") or ""):
+        terms[token] = terms.get(token, 0) + NAME_WEIGHT
+    if entry.get("type") in CONTENT_TYPES:
+        counts = {}
+        for token in tokenize((entry.get("content") or "")[:MAX_INDEXED_CONTENT]):
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            terms[token] = terms.get(token, 0) + min(count, MAX_TERM_FREQUENCY)
+    return terms
+
+
+def snippet(entry, tokens, width=60):
+    """Фрагмент текста вокруг первого найденного слова запроса."""
+    content = entry.get("content") or ""
+    lowered = content.lower()
+    positions = [lowered.find(token) for token in tokens if token in lowered]
+    if not positions:
+        return ""
+    start = max(0, min(positions) - width // 2)
+    text = " ".join(content[start:start + width].split())
+    return ("…" if start else "") + text + ("…" if start + width < len(content) else "")
+
+
+class SearchIndex:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._docs = {}  # short_id -> {"owner", "project", "branch", "path", "name", "type", "terms"}
+        self._postings = {}  # владелец -> {слово: {short_id: вес}}
+        self._trees = {}  # (владелец, проект, ветка) -> {short_id}
+        self._names = {}  # владелец -> {слово имени: {short_id}}
+        self._vocabulary = {}  # владелец -> отсортированный список слов из _names
+        self._journal = None
+        self._journal_lines = 0
+
+    # Изменения
+
+    def _remove(self, short_id):
+        doc = self._docs.pop(short_id, None)
+        if doc is None:
+            return
+        postings = self._postings.get(doc["owner"], {})
+        for token in doc["terms"]:
+            ids = postings.get(token)
+            if ids is not None:
+                ids.pop(short_id, None)
+                if not ids:
+                    del postings[token]
+        self._trees.get((doc["owner"], doc["project"], doc["branch"]), set()).discard(short_id)
+        names = self._names.get(doc["owner"], {})
+        vocabulary = self._vocabulary.get(doc["owner"], [])
+        for token in name_tokens(doc["name"] or ""):
+            ids = names.get(token)
+            if ids is None:
+                continue
+            ids.discard(short_id)
+            if not ids:
+                del names[token]
+                del vocabulary[bisect.bisect_left(vocabulary, token)]
+
+    def _add(self, short_id, doc):
+        self._remove(short_id)
+        self._docs[short_id] = doc
+        postings = self._postings.setdefault(doc["owner"], {})
+        for token, weight in doc["terms"].items():
+            postings.setdefault(token, {})[short_id] = weight
+        self._trees.setdefault((doc["owner"], doc["project"], doc["branch"]), set()).add(short_id)
+        names = self._names.setdefault(doc["owner"], {})
+        vocabulary = self._vocabulary.setdefault(doc["owner"], [])
+        for token in name_tokens(doc["name"] or ""):
+            if token not in names:
+                names[token] = set()
+                bisect.insort(vocabulary, token)
+            names[token].add(short_id)
+
+    def put(self, short_id, entry, owner_id, path, project_name=None, branch_name=None):
+        doc = {"owner": owner_id, "project": project_name, "branch": branch_name, "path": list(path),
+               "name": entry.get("name"), "type": entry.get("type"), "terms": file_terms(entry)}
+        with self._lock:
+            self._add(short_id, doc)
+            self._log({"op": "put", "id": short_id, **doc})
+
+    def drop(self, short_id):
+        with self._lock:
+            if short_id in self._docs:
+                self._remove(short_id)
+                self._log({"op": "drop", "id": short_id})
+
+    def replace_tree(self, structure, owner_id, project_name=None, branch_name=None):
+        """Переиндексирует дерево целиком (после отката или слияния ветки)."""
+        with self._lock:
+            for short_id in list(self._trees.get((owner_id, project_name, branch_name), ())):
+                self._remove(short_id)
+                self._log({"op": "drop", "id": short_id})
+        for short_id, entry, path in walk_files(structure):
+            self.put(short_id, entry, owner_id, path, project_name, branch_name)
+
+    # Поиск
+
+    def search(self, owner_id, query, limit=MAX_RESULTS):
+        """[(short_id, документ)] с файлами владельца, где есть все слова запроса, по убыванию веса."""
+        tokens = query_tokens(query)
+        if not tokens:
+            return []
+        with self._lock:
+            postings = self._postings.get(owner_id, {})
+            lists = [postings.get(token) for token in tokens]
+            if not all(lists):
+                return []
+            lists.sort(key=len)
+            scores = dict(lists[0])
+            for ids in lists[1:]:
+                scores = {short_id: score + ids[short_id] for short_id, score in scores.items() if short_id in ids}
+                if not scores:
+                    return []
+            ranked = sorted(scores, key=lambda short_id: (-scores[short_id], self._docs[short_id]["name"] or ""))
+            return [(short_id, self._docs[short_id]) for short_id in ranked[:limit]]
+
+    def search_names(self, owner_id, query, limit=MAX_RESULTS):
+        """[(short_id, документ)] по именам файлов: каждое слово запроса — начало слова имени,
+        а если таких нет — похожее слово. Точные совпадения выше начал слов, начала выше похожих."""
+        tokens = query_tokens(query)
+        if not tokens:
+            return []
+        with self._lock:
+            names = self._names.get(owner_id, {})
+            vocabulary = self._vocabulary.get(owner_id, [])
+            scores = None
+            for token in tokens:
+                matched = {}
+                start = bisect.bisect_left(vocabulary, token)
+                for word in vocabulary[start:start + MAX_PREFIX_WORDS]:
+                    if not word.startswith(token):
+                        break
+                    for short_id in names[word]:
+                        matched[short_id] = max(matched.get(short_id, 0), 3 if word == token else 2)
+                if not matched:
+                    start = bisect.bisect_left(vocabulary, token[0])
+                    end = bisect.bisect_left(vocabulary, chr(ord(token[0]) + 1))
+                    candidates = [word for word in vocabulary[start:end] if abs(len(word) - len(token)) <= 2]
+                    for word in difflib.get_close_matches(token, candidates[:MAX_FUZZY_WORDS], n=5, cutoff=FUZZY_CUTOFF):
+                        for short_id in names[word]:
+                            matched[short_id] = max(matched.get(short_id, 0), 1)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {short_id: score + matched[short_id] for short_id, score in scores.items() if short_id in matched}
+                if not scores:
+                    return []
+            ranked = sorted(scores, key=lambda short_id: (-scores[short_id], len(self._docs[short_id]["name"] or ""),
+                                                          self._docs[short_id]["name"] or ""))
+            return [(short_id, self._docs[short_id]) for short_id in ranked[:limit]]
+
+    def __len__(self):
+        return len(self._docs)
+
+    # Хранение
+
+    def _log(self, record):
+        if self._journal is None:
+            return
+        try:
+            self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._journal.flush()
+            self._journal_lines += 1
+        except Exception as e:
+            logger.error(f"Ошибка записи журнала поискового индекса: {e}")
+
+    def load(self):
+        """Проигрывает журнал; False, если файла индекса нет."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        lines = 0
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Недописанная при сбое строка
+                short_id = record.pop("id")
+                if record.pop("op") == "put":
+                    self._add(short_id, record)
+                else:
+                    self._remove(short_id)
+                lines += 1
+        self._journal_lines = lines
+        return True
+
+    def build(self, data):
+        for owner_id, user_data in data.get("users", {}).items():
+            for short_id, entry, path in walk_files(user_data.get("structure", {})):
+                self.put(short_id, entry, owner_id, path)
+        for owner_id, projects in data.get("projects", {}).items():
+            for project_name, project in projects.items():
+                for branch_name, branch in project.get("branches", {}).items():
+                    if "structure" in branch:
+                        for short_id, entry, path in walk_files(branch["structure"]):
+                            self.put(short_id, entry, owner_id, path, project_name, branch_name)
+
+    def open(self, compact=False):
+        """Начинает дописывать журнал; разросшийся журнал сначала сжимается в снимок."""
+        if not self.path:
+            return
+        with self._lock:
+            if compact or self._journal_lines > 2 * len(self._docs) + 1000:
+                records = [json.dumps({"op": "put", "id": short_id, **doc}, ensure_ascii=False)
+                           for short_id, doc in self._docs.items()]
+                atomic_write(self.path, "".join(record + "\n" for record in records))
+                self._journal_lines = len(records)
+            self._journal = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+def walk_files(structure, path=()):
+    """(short_id, запись, путь папки) всех файлов дерева."""
+    stack = [(structure, list(path))]
+    while stack:
+        folder, path = stack.pop()
+        for entry in folder.get("files", []):
+            if entry.get("short_id"):
+                yield entry["short_id"], entry, path
+        for name, child in folder.get("folders", {}).items():
+            stack.append((child, path + [name]))
+
+
+def search_blobs(projects, query, limit=20):
+    """Поиск по версиям файлов из истории коммитов: [(вес, проект, запись)].
+
+    Объекты коммитов неизменяемы и общие для всех коммитов, поэтому каждая
+    версия файла проверяется один раз; индекс для истории не ведётся.
+    """
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+    hits = []
+    for project_name, project in projects.items():
+        for blob in project.get("blobs", {}).values():
+            terms = file_terms(blob)
+            if all(token in terms for token in tokens):
+                hits.append((sum(terms[token] for token in tokens), project_name, blob))
+    hits.sort(key=lambda hit: (-hit[0], hit[1], hit[2].get("name") or ""))
+    return hits[:limit]
+
+
+_index = None
+
+
+def init_search_index(data, path):
+    global _index
+    index = SearchIndex(path)
+    try:
+        loaded = index.load()
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке поискового индекса, строим заново: {e}")
+        index, loaded = SearchIndex(path), False
+    if not loaded:
+        index.build(data)
+        logger.info(f"Поисковый индекс построен: файлов {len(index)}.")
+    index.open(compact=not loaded)
+    _index = index
+    return index
+
+
+def get_search_index():
+    return _index
@@ -0,0 +1,646 @@
+# utils/sqlite_storage.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import logging
+from collections.abc import MutableMapping
+from utils.data_store import read_data_file
+from utils.storage import ShardMap, ProjectOwnersMap, ShardTracker
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    username TEXT,
+    current_path TEXT NOT NULL,
+    extra TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usernames (
+    username TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shared_folders (
+    shared_key TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shared_folders_user ON shared_folders (user_id);
+CREATE TABLE IF NOT EXISTS file_ids (
+    short_id TEXT PRIMARY KEY,
+    owner_id TEXT NOT NULL,
+    project TEXT,
+    branch TEXT,
+    path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stored_files (
+    storage_key TEXT PRIMARY KEY,
+    message_id INTEGER NOT NULL,
+    file_id TEXT,
+    refs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS projects (
+    owner_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    current_branch TEXT NOT NULL,
+    collaborators TEXT NOT NULL,
+    extra TEXT NOT NULL,
+    PRIMARY KEY (owner_id, name)
+);
+CREATE TABLE IF NOT EXISTS branches (
+    owner_id TEXT NOT NULL,
+    project TEXT NOT NULL,
+    name TEXT NOT NULL,
+    extra TEXT NOT NULL,
+    PRIMARY KEY (owner_id, project, name)
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id INTEGER PRIMARY KEY,
+    tree TEXT NOT NULL,
+    parent_id INTEGER,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS nodes_tree ON nodes (tree, parent_id, name);
+CREATE TABLE IF NOT EXISTS files (
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    tree TEXT NOT NULL,
+    short_id TEXT,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (node_id, position)
+);
+CREATE INDEX IF NOT EXISTS files_short_id ON files (short_id, tree);
+CREATE INDEX IF NOT EXISTS files_tree ON files (tree);
+CREATE TABLE IF NOT EXISTS commits (
+    owner_id TEXT NOT NULL,
+    project TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    commit_id TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (owner_id, project, branch, position)
+);
+CREATE INDEX IF NOT EXISTS commits_id ON commits (owner_id, project, commit_id);
+CREATE TABLE IF NOT EXISTS objects (
+    owner_id TEXT NOT NULL,
+    project TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    oid TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (owner_id, project, kind, oid)
+);
+"""
+
+# Запросы держим константами: sqlite3 кэширует подготовленные выражения по тексту запроса
+SQL_USER_EXISTS = "SELECT 1 FROM users WHERE user_id = ?"
+SQL_USER_IDS = "SELECT user_id FROM users"
+SQL_USER_GET = "SELECT username, current_path, extra FROM users WHERE user_id = ?"
+SQL_USER_PUT = """
+INSERT INTO users (user_id, username, current_path, extra) VALUES (?, ?, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    username = excluded.username, current_path = excluded.current_path, extra = excluded.extra
+"""
+SQL_USER_DELETE = "DELETE FROM users WHERE user_id = ?"
+
+SQL_USERNAME_GET = "SELECT user_id FROM usernames WHERE username = ?"
+SQL_USERNAME_ALL = "SELECT username FROM usernames"
+SQL_USERNAME_PUT = "INSERT OR REPLACE INTO usernames (username, user_id) VALUES (?, ?)"
+SQL_USERNAME_DELETE = "DELETE FROM usernames WHERE username = ?"
+
+SQL_SHARED_GET = "SELECT user_id, path FROM shared_folders WHERE shared_key = ?"
+SQL_SHARED_ALL = "SELECT shared_key FROM shared_folders"
+SQL_SHARED_PUT = "INSERT OR REPLACE INTO shared_folders (shared_key, user_id, path) VALUES (?, ?, ?)"
+SQL_SHARED_DELETE = "DELETE FROM shared_folders WHERE shared_key = ?"
+
+SQL_FILE_ID_GET = "SELECT owner_id, project, branch, path FROM file_ids WHERE short_id = ?"
+SQL_FILE_ID_ALL = "SELECT short_id FROM file_ids"
+SQL_FILE_ID_PUT = "INSERT OR REPLACE INTO file_ids (short_id, owner_id, project, branch, path) VALUES (?, ?, ?, ?, ?)"
+SQL_FILE_ID_DELETE = "DELETE FROM file_ids WHERE short_id = ?"
+
+SQL_STORED_GET = "SELECT message_id, file_id, refs FROM stored_files WHERE storage_key = ?"
+SQL_STORED_ALL = "SELECT storage_key FROM stored_files"
+SQL_STORED_PUT = "INSERT OR REPLACE INTO stored_files (storage_key, message_id, file_id, refs) VALUES (?, ?, ?, ?)"
+SQL_STORED_DELETE = "DELETE FROM stored_files WHERE storage_key = ?"
+
+SQL_OWNER_EXISTS = "SELECT 1 FROM projects WHERE owner_id = ? LIMIT 1"
+SQL_OWNER_IDS = "SELECT DISTINCT owner_id FROM projects"
+SQL_PROJECT_EXISTS = "SELECT 1 FROM projects WHERE owner_id = ? AND name = ?"
+SQL_PROJECT_NAMES = "SELECT name FROM projects WHERE owner_id = ?"
+SQL_PROJECT_GET = "SELECT current_branch, collaborators, extra FROM projects WHERE owner_id = ? AND name = ?"
+SQL_PROJECT_PUT = """
+INSERT INTO projects (owner_id, name, current_branch, collaborators, extra) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (owner_id, name) DO UPDATE SET
+    current_branch = excluded.current_branch, collaborators = excluded.collaborators, extra = excluded.extra
+"""
+SQL_PROJECT_DELETE = "DELETE FROM projects WHERE owner_id = ? AND name = ?"
+
+SQL_BRANCHES_GET = "SELECT name, extra FROM branches WHERE owner_id = ? AND project = ? ORDER BY rowid"
+SQL_BRANCH_NAMES = "SELECT name FROM branches WHERE owner_id = ? AND project = ?"
+SQL_BRANCH_PUT = "INSERT OR REPLACE INTO branches (owner_id, project, name, extra) VALUES (?, ?, ?, ?)"
+SQL_BRANCH_DELETE = "DELETE FROM branches WHERE owner_id = ? AND project = ? AND name = ?"
+
+SQL_NODES_GET = "SELECT node_id, parent_id, name FROM nodes WHERE tree = ? ORDER BY node_id"
+SQL_NODE_PUT = "INSERT INTO nodes (tree, parent_id, name, path) VALUES (?, ?, ?, ?)"
+SQL_NODES_DELETE = "DELETE FROM nodes WHERE tree = ?"
+SQL_FILES_GET = "SELECT node_id, entry FROM files WHERE tree = ? ORDER BY node_id, position"
+SQL_FILE_PUT = "INSERT INTO files (node_id, position, tree, short_id, entry) VALUES (?, ?, ?, ?, ?)"
+SQL_FILES_DELETE = "DELETE FROM files WHERE tree = ?"
+SQL_FILE_LOCATE = """
+SELECT n.path, f.position FROM files f JOIN nodes n ON n.node_id = f.node_id
+WHERE f.short_id = ? AND f.tree = ?
+"""
+
+# Граф коммитов проекта хранится строками с пустым branch; строки с именем ветки —
+# старый формат (список коммитов в каждой ветке), он переводится при загрузке проекта
+SQL_COMMITS_GET = "SELECT branch, body FROM commits WHERE owner_id = ? AND project = ? ORDER BY branch, position"
+SQL_COMMIT_PUT = "INSERT OR REPLACE INTO commits (owner_id, project, branch, position, commit_id, body) VALUES (?, ?, '', ?, ?, ?)"
+SQL_COMMIT_DELETE = "DELETE FROM commits WHERE owner_id = ? AND project = ? AND branch = '' AND commit_id = ?"
+SQL_COMMITS_DELETE = "DELETE FROM commits WHERE owner_id = ? AND project = ?"
+
+SQL_OBJECTS_GET = "SELECT kind, oid, body FROM objects WHERE owner_id = ? AND project = ?"
+SQL_OBJECT_IDS = "SELECT kind, oid FROM objects WHERE owner_id = ? AND project = ?"
+SQL_OBJECT_PUT = "INSERT OR IGNORE INTO objects (owner_id, project, kind, oid, body) VALUES (?, ?, ?, ?, ?)"
+SQL_OBJECT_DELETE = "DELETE FROM objects WHERE owner_id = ? AND project = ? AND kind = ? AND oid = ?"
+SQL_OBJECTS_DELETE = "DELETE FROM objects WHERE owner_id = ? AND project = ?"
+
+# Хранилище объектов коммитов (см. utils/objects.py) лежит в таблице objects
+OBJECT_KINDS = {"trees": "tree", "blobs": "blob"}
+
+
+def user_tree(user_id):
+    return json.dumps(["user", user_id])
+
+
+def branch_tree(owner_id, project_name, branch_name):
+    return json.dumps(["branch", owner_id, project_name, branch_name])
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _file_location_row(short_id, location):
+    return (short_id, location["owner"], location["project"], location["branch"], _dumps(location["path"]))
+
+
+def _decode_file_location(row):
+    return {"owner": row[0], "project": row[1], "branch": row[2], "path": json.loads(row[3])}
+
+
+def _stored_file_row(key, record):
+    return (key, record["message_id"], record.get("file_id"), record["refs"])
+
+
+def _decode_stored_file(row):
+    return {"message_id": row[0], "file_id": row[1], "refs": row[2]}
+
+
+def _digest(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class SqlIndexMap(MutableMapping):
+    """Отображение поверх таблицы: чтение — один запрос по первичному ключу,
+    запись копится в памяти до ближайшего сброса."""
+
+    def __init__(self, backend, get_sql, all_sql, decode):
+        self._backend = backend
+        self._get_sql = get_sql
+        self._all_sql = all_sql
+        self._decode = decode
+        self._pending = {}
+        self._deleted = object()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._pending.get(key)
+        if value is self._deleted:
+            raise KeyError(key)
+        if value is not None:
+            return value
+        row = self._backend.query_one(self._get_sql, (key,))
+        if row is None:
+            raise KeyError(key)
+        return self._decode(row)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._pending[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        with self._lock:
+            self._pending[key] = self._deleted
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        keys = {row[0] for row in self._backend.query_all(self._all_sql, ())}
+        with self._lock:
+            for key, value in self._pending.items():
+                if value is self._deleted:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+        return iter(list(keys))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return [(key, None if value is self._deleted else value) for key, value in pending.items()]
+
+    def return_pending(self, items):
+        with self._lock:
+            for key, value in items:
+                self._pending.setdefault(key, self._deleted if value is None else value)
+
+
+class SqliteBackend(ShardTracker):
+    """Хранилище в SQLite (только стандартный модуль sqlite3).
+
+    Пользователи, usernames, ключи общих папок, индекс файлов, сохранённые файлы, проекты, узлы деревьев папок,
+    файлы и коммиты лежат в отдельных таблицах с индексами, так что поиск по
+    username, ключу доступа или short_id — один индексированный запрос.
+    Данные пользователей и проектов по-прежнему видны обработчикам как
+    словари: они читаются лениво и переписываются только при изменении.
+    """
+
+    def __init__(self, path, legacy_path=None, normalize_data=None,
+                 normalize_user=None, normalize_project=None):
+        super().__init__()
+        self.path = path
+        self.legacy_path = legacy_path
+        self.normalize_data = normalize_data
+        self.normalize_user = normalize_user
+        self.normalize_project = normalize_project
+        self._conn = None
+        self._db_lock = threading.RLock()
+        self._digests = {}
+        self._commit_ids = {}
+        self._object_ids = {}
+        self._usernames = None
+        self._shared_folders = None
+        self._file_ids = None
+        self._stored_files = None
+
+    # Соединение
+
+    def connect(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+        return conn
+
+    def query_one(self, sql, params):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def query_all(self, sql, params):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # Загрузка
+
+    def load(self):
+        conn = self.connect()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            if self.legacy_path and os.path.exists(self.legacy_path):
+                self.migrate(read_data_file(self.legacy_path))
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+        self._usernames = SqlIndexMap(self, SQL_USERNAME_GET, SQL_USERNAME_ALL, lambda row: row[0])
+        self._shared_folders = SqlIndexMap(self, SQL_SHARED_GET, SQL_SHARED_ALL,
+                                           lambda row: {"user_id": row[0], "path": json.loads(row[1])})
+        self._file_ids = SqlIndexMap(self, SQL_FILE_ID_GET, SQL_FILE_ID_ALL, _decode_file_location)
+        self._stored_files = SqlIndexMap(self, SQL_STORED_GET, SQL_STORED_ALL, _decode_stored_file)
+        return {
+            "users": ShardMap(None, self._load_user, tracker=self, shard_prefix=("user",),
+                              exists=lambda user_id: self.query_one(SQL_USER_EXISTS, (user_id,)) is not None,
+                              list_keys=lambda: [row[0] for row in self.query_all(SQL_USER_IDS, ())]),
+            "projects": ProjectOwnersMap(None, self._owner_projects,
+                                         exists=lambda owner_id: self.query_one(SQL_OWNER_EXISTS, (owner_id,)) is not None,
+                                         list_keys=lambda: [row[0] for row in self.query_all(SQL_OWNER_IDS, ())]),
+            "shared_folders": self._shared_folders,
+            "usernames": self._usernames,
+            "file_ids": self._file_ids,
+            "stored_files": self._stored_files,
+        }
+
+    def _read_tree(self, tree, default=True):
+        nodes = {}
+        root = None
+        for node_id, parent_id, name in self.query_all(SQL_NODES_GET, (tree,)):
+            node = {"folders": {}, "files": []}
+            nodes[node_id] = node
+            if parent_id is None:
+                root = node
+            else:
+                nodes[parent_id]["folders"][name] = node
+        for node_id, entry in self.query_all(SQL_FILES_GET, (tree,)):
+            nodes[node_id]["files"].append(json.loads(entry))
+        if root is None and default:
+            return {"folders": {}, "files": []}
+        return root
+
+    def _load_user(self, user_id):
+        username, current_path, extra = self.query_one(SQL_USER_GET, (user_id,))
+        user_data = json.loads(extra)
+        user_data["username"] = username
+        user_data["current_path"] = json.loads(current_path)
+        user_data["structure"] = self._read_tree(user_tree(user_id))
+        if self.normalize_user:
+            self.normalize_user(user_data)
+        return user_data
+
+    def _load_project(self, owner_id, project_name):
+        current_branch, collaborators, extra = self.query_one(SQL_PROJECT_GET, (owner_id, project_name))
+        project_data = json.loads(extra)
+        project_data["current_branch"] = current_branch
+        project_data["collaborators"] = json.loads(collaborators)
+        branches = {}
+        for branch_name, branch_extra in self.query_all(SQL_BRANCHES_GET, (owner_id, project_name)):
+            branch_data = json.loads(branch_extra)
+            # У ветки без рабочей копии (ещё не открытой после создания) узлов в базе нет
+            structure = self._read_tree(branch_tree(owner_id, project_name, branch_name), default=False)
+            if structure is not None:
+                branch_data["structure"] = structure
+            branches[branch_name] = branch_data
+        project_data["branches"] = branches
+        commits = {}
+        for branch_name, body in self.query_all(SQL_COMMITS_GET, (owner_id, project_name)):
+            commit = json.loads(body)
+            if branch_name:
+                if branch_name in branches:
+                    branches[branch_name].setdefault("commits", []).append(commit)
+            else:
+                commits[str(commit["commit_id"])] = commit
+        project_data["commits"] = commits
+        # Старые строки будут переписаны при первом сохранении проекта
+        self._commit_ids[(owner_id, project_name)] = None if any("commits" in b for b in branches.values()) else set(commits)
+        objects = {key: {} for key in OBJECT_KINDS}
+        kinds = {kind: key for key, kind in OBJECT_KINDS.items()}
+        for kind, oid, body in self.query_all(SQL_OBJECTS_GET, (owner_id, project_name)):
+            objects[kinds[kind]][oid] = json.loads(body)
+        project_data.update(objects)
+        self._object_ids[(owner_id, project_name)] = {
+            kind: set(objects[key]) for key, kind in OBJECT_KINDS.items()
+        }
+        if self.normalize_project:
+            self.normalize_project(project_data)
+        return project_data
+
+    def _owner_projects(self, owner_id):
+        return ShardMap(None, lambda project_name: self._load_project(owner_id, project_name),
+                        tracker=self, shard_prefix=("project", owner_id),
+                        exists=lambda name: self.query_one(SQL_PROJECT_EXISTS, (owner_id, name)) is not None,
+                        list_keys=lambda: [row[0] for row in self.query_all(SQL_PROJECT_NAMES, (owner_id,))])
+
+    def locate_file(self, tree, short_id):
+        """Все места файла с short_id в дереве tree: [(путь папки, позиция), ...]."""
+        rows = self.query_all(SQL_FILE_LOCATE, (short_id, json.dumps(list(tree))))
+        return [(json.loads(path), position) for path, position in rows]
+
+    # Сохранение
+
+    def _write_tree(self, tree, structure):
+        conn = self._conn
+        conn.execute(SQL_FILES_DELETE, (tree,))
+        conn.execute(SQL_NODES_DELETE, (tree,))
+        stack = [(None, "", [], structure)]
+        while stack:
+            parent_id, name, path, folder = stack.pop()
+            node_id = conn.execute(SQL_NODE_PUT, (tree, parent_id, name, _dumps(path))).lastrowid
+            conn.executemany(SQL_FILE_PUT, [
+                (node_id, position, tree, file.get("short_id"), _dumps(file))
+                for position, file in enumerate(folder.get("files", []))
+            ])
+            # Обратный порядок, чтобы node_id папок шли в порядке словаря
+            for child_name, child in reversed(list(folder.get("folders", {}).items())):
+                stack.append((node_id, child_name, path + [child_name], child))
+
+    def _delete_tree(self, tree):
+        self._conn.execute(SQL_FILES_DELETE, (tree,))
+        self._conn.execute(SQL_NODES_DELETE, (tree,))
+
+    def _changed(self, shard, record):
+        if shard[0] == "project":
+            # Коммиты и объекты неизменяемы и добавляются только вместе со сдвигом head ветки —
+            # в дайджест их не включаем
+            record = {key: value for key, value in record.items() if key != "commits" and key not in OBJECT_KINDS}
+        digest = _digest(_dumps(record))
+        if self._digests.get(shard) == digest:
+            return None
+        return digest
+
+    def _write_user(self, user_id, user_data):
+        extra = {key: value for key, value in user_data.items()
+                 if key not in ("username", "current_path", "structure")}
+        self._conn.execute(SQL_USER_PUT, (user_id, user_data.get("username"),
+                                          _dumps(user_data.get("current_path", [])), _dumps(extra)))
+        self._write_tree(user_tree(user_id), user_data.get("structure", {"folders": {}, "files": []}))
+
+    def _delete_user(self, user_id):
+        self._conn.execute(SQL_USER_DELETE, (user_id,))
+        self._delete_tree(user_tree(user_id))
+
+    def _write_commits(self, owner_id, project_name, commits):
+        # Коммиты неизменяемы: дописываем новые и удаляем вычищенные
+        key = (owner_id, project_name)
+        stored = self._commit_ids.get(key)
+        if stored is None:
+            self._conn.execute(SQL_COMMITS_DELETE, (owner_id, project_name))
+            stored = set()
+        self._conn.executemany(SQL_COMMIT_PUT, [
+            (owner_id, project_name, commits[commit_id].get("seq", 0), commit_id, _dumps(commits[commit_id]))
+            for commit_id in commits.keys() - stored
+        ])
+        self._conn.executemany(SQL_COMMIT_DELETE, [
+            (owner_id, project_name, commit_id) for commit_id in stored - commits.keys()
+        ])
+        self._commit_ids[key] = set(commits)
+
+    def _write_project(self, owner_id, project_name, project_data):
+        conn = self._conn
+        extra = {key: value for key, value in project_data.items()
+                 if key not in ("current_branch", "collaborators", "branches", "commits") and key not in OBJECT_KINDS}
+        conn.execute(SQL_PROJECT_PUT, (owner_id, project_name, project_data.get("current_branch", "master"),
+                                       _dumps(project_data.get("collaborators", [])), _dumps(extra)))
+        branches = project_data.get("branches", {})
+        stored = {row[0] for row in conn.execute(SQL_BRANCH_NAMES, (owner_id, project_name))}
+        for branch_name in stored - set(branches):
+            self._delete_branch(owner_id, project_name, branch_name)
+        for branch_name, branch_data in branches.items():
+            branch_extra = {key: value for key, value in branch_data.items() if key not in ("structure", "commits")}
+            conn.execute(SQL_BRANCH_PUT, (owner_id, project_name, branch_name, _dumps(branch_extra)))
+            if "structure" in branch_data:
+                self._write_tree(branch_tree(owner_id, project_name, branch_name), branch_data["structure"])
+            else:
+                self._delete_tree(branch_tree(owner_id, project_name, branch_name))
+        self._write_commits(owner_id, project_name, project_data.get("commits", {}))
+        self._write_objects(owner_id, project_name, project_data)
+
+    def _write_objects(self, owner_id, project_name, project_data):
+        # Объекты неизменяемы: добавляем новые и удаляем вычищенные, остальные не трогаем
+        key = (owner_id, project_name)
+        stored = self._object_ids.get(key)
+        if stored is None:
+            stored = {kind: set() for kind in OBJECT_KINDS.values()}
+            for kind, oid in self._conn.execute(SQL_OBJECT_IDS, (owner_id, project_name)):
+                stored[kind].add(oid)
+        for field, kind in OBJECT_KINDS.items():
+            objects = project_data.get(field, {})
+            self._conn.executemany(SQL_OBJECT_PUT, [
+                (owner_id, project_name, kind, oid, _dumps(objects[oid]))
+                for oid in objects.keys() - stored[kind]
+            ])
+            self._conn.executemany(SQL_OBJECT_DELETE, [
+                (owner_id, project_name, kind, oid) for oid in stored[kind] - objects.keys()
+            ])
+        self._object_ids[key] = {kind: set(project_data.get(field, {})) for field, kind in OBJECT_KINDS.items()}
+
+    def _delete_branch(self, owner_id, project_name, branch_name):
+        self._conn.execute(SQL_BRANCH_DELETE, (owner_id, project_name, branch_name))
+        self._delete_tree(branch_tree(owner_id, project_name, branch_name))
+
+    def _delete_project(self, owner_id, project_name):
+        for branch_name in [row[0] for row in self._conn.execute(SQL_BRANCH_NAMES, (owner_id, project_name))]:
+            self._delete_branch(owner_id, project_name, branch_name)
+        self._conn.execute(SQL_OBJECTS_DELETE, (owner_id, project_name))
+        self._object_ids.pop((owner_id, project_name), None)
+        self._conn.execute(SQL_COMMITS_DELETE, (owner_id, project_name))
+        self._commit_ids.pop((owner_id, project_name), None)
+        self._conn.execute(SQL_PROJECT_DELETE, (owner_id, project_name))
+
+    def _flush_shard(self, data, shard):
+        # Возвращает новый дайджест шарда или None, если писать было нечего
+        if shard[0] == "user":
+            user_id = shard[1]
+            users = data["users"]
+            if user_id not in users:
+                self._delete_user(user_id)
+                return b""
+            record = users.loaded(user_id)
+            digest = record is not None and self._changed(shard, record)
+            if digest:
+                self._write_user(user_id, record)
+            return digest or None
+        owner_id, project_name = shard[1], shard[2]
+        projects = data["projects"].loaded(owner_id)
+        if projects is None:
+            return None
+        if project_name not in projects:
+            self._delete_project(owner_id, project_name)
+            return b""
+        record = projects.loaded(project_name)
+        digest = record is not None and self._changed(shard, record)
+        if digest:
+            self._write_project(owner_id, project_name, record)
+        return digest or None
+
+    def flush(self, data):
+        # Блокировка берётся до изъятия отложенных записей, чтобы чтения
+        # индексов дождались коммита и не увидели промежуточное состояние
+        with self._db_lock:
+            return self._flush_locked(data)
+
+    def _flush_locked(self, data):
+        dirty = self.take_dirty()
+        usernames = self._usernames.take_pending()
+        shared_folders = self._shared_folders.take_pending()
+        file_ids = self._file_ids.take_pending()
+        stored_files = self._stored_files.take_pending()
+        if not dirty and not usernames and not shared_folders and not file_ids and not stored_files:
+            return False
+        digests = {}
+        try:
+            with self._conn:
+                for shard in dirty:
+                    digest = self._flush_shard(data, shard)
+                    if digest is not None:
+                        digests[shard] = digest
+                for username, user_id in usernames:
+                    if user_id is None:
+                        self._conn.execute(SQL_USERNAME_DELETE, (username,))
+                    else:
+                        self._conn.execute(SQL_USERNAME_PUT, (username, user_id))
+                for shared_key, shared in shared_folders:
+                    if shared is None:
+                        self._conn.execute(SQL_SHARED_DELETE, (shared_key,))
+                    else:
+                        self._conn.execute(SQL_SHARED_PUT, (shared_key, shared["user_id"], _dumps(shared["path"])))
+                for short_id, location in file_ids:
+                    if location is None:
+                        self._conn.execute(SQL_FILE_ID_DELETE, (short_id,))
+                    else:
+                        self._conn.execute(SQL_FILE_ID_PUT, _file_location_row(short_id, location))
+                for key, record in stored_files:
+                    if record is None:
+                        self._conn.execute(SQL_STORED_DELETE, (key,))
+                    else:
+                        self._conn.execute(SQL_STORED_PUT, _stored_file_row(key, record))
+        except Exception:
+            # Транзакция откатилась целиком — всё вернётся в следующий сброс
+            self._commit_ids.clear()
+            self._object_ids.clear()
+            self.return_dirty(dirty)
+            self._usernames.return_pending(usernames)
+            self._shared_folders.return_pending(shared_folders)
+            self._file_ids.return_pending(file_ids)
+            self._stored_files.return_pending(stored_files)
+            raise
+        for shard, digest in digests.items():
+            if digest:
+                self._digests[shard] = digest
+            else:
+                self._digests.pop(shard, None)
+        return bool(digests or usernames or shared_folders or file_ids or stored_files)
+
+    # Миграция
+
+    def migrate(self, data):
+        """Разово переносит монолитный data.json в базу."""
+        if self.normalize_data:
+            data = self.normalize_data(data)
+        with self._db_lock, self._conn:
+            for user_id, user_data in data.get("users", {}).items():
+                self._write_user(user_id, user_data)
+            for owner_id, projects in data.get("projects", {}).items():
+                for project_name, project_data in projects.items():
+                    self._write_project(owner_id, project_name, project_data)
+            for username, user_id in data.get("usernames", {}).items():
+                self._conn.execute(SQL_USERNAME_PUT, (username, user_id))
+            for shared_key, shared in data.get("shared_folders", {}).items():
+                self._conn.execute(SQL_SHARED_PUT, (shared_key, shared["user_id"], _dumps(shared["path"])))
+            self._conn.executemany(SQL_FILE_ID_PUT, [
+                _file_location_row(short_id, location) for short_id, location in data.get("file_ids", {}).items()
+            ])
+            self._conn.executemany(SQL_STORED_PUT, [
+                _stored_file_row(key, record) for key, record in data.get("stored_files", {}).items()
+            ])
+        logger.info(f"Данные из {self.legacy_path} перенесены в SQLite-хранилище {self.path}.")
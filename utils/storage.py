@@ -0,0 +1,468 @@
+# utils/storage.py
+import hashlib
+import json
+import os
+import threading
+import logging
+from collections.abc import MutableMapping
+from urllib.parse import quote, unquote
+from utils.data_store import atomic_write, dump_data, read_data_file
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFileBackend:
+    """Все данные в одном JSON-файле (исходный формат data.json)."""
+
+    def __init__(self, path, normalize_data=None):
+        self.path = path
+        self.normalize_data = normalize_data
+        self._saved_snapshot = None
+
+    def load(self):
+        data = read_data_file(self.path)
+        if self.normalize_data:
+            data = self.normalize_data(data)
+        return data
+
+    def begin(self):
+        pass
+
+    def mark_dirty(self):
+        pass
+
+    def flush(self, data):
+        snapshot = dump_data(data)
+        if snapshot == self._saved_snapshot:
+            return False
+        atomic_write(self.path, snapshot)
+        self._saved_snapshot = snapshot
+        return True
+
+
+class ShardMap(MutableMapping):
+    """Словарь, значения которого читаются из шардов по первому обращению.
+
+    Каждое обращение к значению отмечается в tracker, чтобы при сохранении
+    записать только те шарды, с которыми работал обработчик. Список ключей
+    можно передать сразу (keys) или получать из хранилища по запросу
+    (exists / list_keys).
+    """
+
+    def __init__(self, keys, loader, tracker=None, shard_prefix=None, exists=None, list_keys=None):
+        self._keys = set(keys) if keys is not None else None
+        self._exists = exists
+        self._list_keys = list_keys
+        self._loaded = {}
+        self._removed = set()
+        self._loader = loader
+        self._tracker = tracker
+        self._shard_prefix = shard_prefix
+
+    def _touch(self, key):
+        if self._tracker is not None and self._shard_prefix is not None:
+            self._tracker.touch(self._shard_prefix + (key,))
+
+    def _has(self, key):
+        if key in self._loaded:
+            return True
+        if key in self._removed:
+            return False
+        if self._keys is not None:
+            return key in self._keys
+        return self._exists(key)
+
+    def __getitem__(self, key):
+        if key not in self._loaded:
+            if not self._has(key):
+                raise KeyError(key)
+            self._loaded[key] = self._loader(key)
+        self._touch(key)
+        return self._loaded[key]
+
+    def __setitem__(self, key, value):
+        if self._keys is not None:
+            self._keys.add(key)
+        self._removed.discard(key)
+        self._loaded[key] = value
+        self._touch(key)
+
+    def __delitem__(self, key):
+        if not self._has(key):
+            raise KeyError(key)
+        if self._keys is not None:
+            self._keys.discard(key)
+        self._removed.add(key)
+        self._loaded.pop(key, None)
+        self._touch(key)
+
+    def __contains__(self, key):
+        # Проверка наличия не требует чтения шарда
+        return self._has(key)
+
+    def __iter__(self):
+        if self._keys is not None:
+            return iter(list(self._keys))
+        keys = (set(self._list_keys()) | set(self._loaded)) - self._removed
+        return iter(list(keys))
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def loaded(self, key):
+        return self._loaded.get(key)
+
+
+class ProjectOwnersMap(ShardMap):
+    """owner_id -> ShardMap проектов владельца; обычные словари оборачиваются."""
+
+    def __init__(self, keys, owner_loader, **kwargs):
+        super().__init__(keys, owner_loader, **kwargs)
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, ShardMap):
+            projects = self._loader(key)
+            for project_name, project_data in value.items():
+                projects[project_name] = project_data
+            value = projects
+        super().__setitem__(key, value)
+
+
+class IndexMap(MutableMapping):
+    """Общий индекс (usernames, shared_folders, file_ids, stored_files), помнящий записанные ключи."""
+
+    def __init__(self, items=None):
+        self._items = dict(items or {})
+        self._changed = set()
+        self.dirty = False
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._changed.add(key)
+        self.dirty = True
+
+    def __delitem__(self, key):
+        del self._items[key]
+        self._changed.add(key)
+        self.dirty = True
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def to_dict(self):
+        return dict(self._items)
+
+    def take_changes(self):
+        """Ключи, изменённые с прошлого вызова."""
+        changed, self._changed = self._changed, set()
+        self.dirty = False
+        return list(changed)
+
+    def return_changes(self, keys):
+        self._changed.update(keys)
+        self.dirty = True
+
+
+class ShardTracker:
+    """Учёт шардов, к которым обращался текущий поток между load_data() и save_data()."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._dirty = set()
+
+    def begin(self):
+        self._local.touched = set()
+
+    def touch(self, shard):
+        touched = getattr(self._local, 'touched', None)
+        if touched is None:
+            touched = self._local.touched = set()
+        touched.add(shard)
+
+    def mark_dirty(self):
+        touched = getattr(self._local, 'touched', None)
+        if touched:
+            with self._lock:
+                self._dirty |= touched
+
+    def take_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def return_dirty(self, shards):
+        with self._lock:
+            self._dirty.update(shards)
+
+
+def _shard_name(key):
+    return quote(str(key), safe='') + '.json'
+
+
+def _list_shards(directory):
+    if not os.path.isdir(directory):
+        return []
+    return [unquote(name[:-len('.json')]) for name in os.listdir(directory) if name.endswith('.json')]
+
+
+class ShardedJsonBackend(ShardTracker):
+    """Отдельный JSON-файл на каждого пользователя и каждый проект.
+
+    Структура каталога:
+        index.json                      — usernames и shared_folders
+        file_ids.jsonl                  — глобальный индекс файлов по short_id
+        stored_files.jsonl              — файлы в DATA_CHAT_ID по ключу дедупликации
+        users/<user_id>.json            — данные пользователя
+        projects/<owner_id>/<name>.json — данные проекта
+
+    Шарды читаются лениво, а при сохранении записываются только те,
+    к которым обращался обработчик, вызвавший save_data(), и только если
+    их содержимое действительно изменилось.
+
+    Индексы файлов меняются при каждой загрузке, поэтому хранятся журналами:
+    при сохранении дописываются только изменённые ключи, а разросшийся журнал
+    переписывается снимком (как журнал поискового индекса).
+    """
+
+    JOURNALS = ("file_ids", "stored_files")
+
+    def __init__(self, directory, legacy_path=None, normalize_data=None,
+                 normalize_user=None, normalize_project=None):
+        super().__init__()
+        self.directory = directory
+        self.legacy_path = legacy_path
+        self.normalize_data = normalize_data
+        self.normalize_user = normalize_user
+        self.normalize_project = normalize_project
+        self._digests = {}
+        self._journal_lines = {}
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _journal_path(self, name):
+        return os.path.join(self.directory, name + '.jsonl')
+
+    def _user_path(self, user_id):
+        return os.path.join(self.directory, 'users', _shard_name(user_id))
+
+    def _project_dir(self, owner_id):
+        return os.path.join(self.directory, 'projects', quote(str(owner_id), safe=''))
+
+    def _project_path(self, owner_id, project_name):
+        return os.path.join(self._project_dir(owner_id), _shard_name(project_name))
+
+    # Загрузка
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self.index_path) and self.legacy_path and os.path.exists(self.legacy_path):
+            self.migrate(read_data_file(self.legacy_path))
+
+        index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+
+        owners_dir = os.path.join(self.directory, 'projects')
+        owners = [unquote(name) for name in os.listdir(owners_dir)] if os.path.isdir(owners_dir) else []
+        return {
+            "users": ShardMap(_list_shards(os.path.join(self.directory, 'users')), self._load_user,
+                              tracker=self, shard_prefix=("user",)),
+            "projects": ProjectOwnersMap(owners, self._owner_projects),
+            "shared_folders": IndexMap(index.get("shared_folders")),
+            "usernames": IndexMap(index.get("usernames")),
+            "file_ids": IndexMap(self._load_journal("file_ids")),
+            "stored_files": IndexMap(self._load_journal("stored_files")),
+        }
+
+    def _load_journal(self, name):
+        """Проигрывает журнал индекса; индекс в прежнем формате (<name>.json) переводится в журнал."""
+        path = self._journal_path(name)
+        legacy_path = os.path.join(self.directory, name + '.json')
+        items = {}
+        if not os.path.exists(path):
+            if os.path.exists(legacy_path):
+                with open(legacy_path, 'r', encoding='utf-8') as file:
+                    items = json.load(file)
+                self._compact_journal(name, items)
+                os.remove(legacy_path)
+            self._journal_lines[name] = len(items)
+            return items
+        lines, broken = 0, False
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    broken = True  # Недописанная при сбое строка
+                    continue
+                if record["op"] == "put":
+                    items[record["key"]] = record["value"]
+                else:
+                    items.pop(record["key"], None)
+                lines += 1
+        self._journal_lines[name] = lines
+        if broken:
+            # Дописывать после оборванной строки нельзя — переписываем журнал снимком
+            self._compact_journal(name, items)
+        return items
+
+    def _compact_journal(self, name, items):
+        atomic_write(self._journal_path(name),
+                     "".join(json.dumps({"op": "put", "key": key, "value": value}, ensure_ascii=False) + "\n"
+                             for key, value in items.items()))
+        self._journal_lines[name] = len(items)
+
+    def _flush_journal(self, name, index):
+        keys = index.take_changes()
+        if not keys:
+            return False
+        try:
+            if self._journal_lines.get(name, 0) + len(keys) > 2 * len(index) + 1000:
+                self._compact_journal(name, index.to_dict())
+                return True
+            records = []
+            for key in keys:
+                if key in index:
+                    records.append({"op": "put", "key": key, "value": index[key]})
+                else:
+                    records.append({"op": "drop", "key": key})
+            with open(self._journal_path(name), 'a', encoding='utf-8') as file:
+                file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                file.flush()
+                os.fsync(file.fileno())
+            self._journal_lines[name] = self._journal_lines.get(name, 0) + len(records)
+        except Exception:
+            index.return_changes(keys)
+            raise
+        return True
+
+    def _read_shard(self, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def _load_user(self, user_id):
+        user_data = self._read_shard(self._user_path(user_id))
+        if self.normalize_user:
+            self.normalize_user(user_data)
+        return user_data
+
+    def _owner_projects(self, owner_id):
+        def load_project(project_name):
+            project_data = self._read_shard(self._project_path(owner_id, project_name))
+            if self.normalize_project:
+                self.normalize_project(project_data)
+            return project_data
+        return ShardMap(_list_shards(self._project_dir(owner_id)), load_project,
+                        tracker=self, shard_prefix=("project", owner_id))
+
+    # Сохранение
+
+    def _write_shard(self, shard, path, record):
+        text = dump_data(record)
+        digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        if self._digests.get(shard) == digest:
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, text)
+        self._digests[shard] = digest
+        return True
+
+    def _remove_shard(self, shard, path):
+        self._digests.pop(shard, None)
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    def _flush_shard(self, data, shard):
+        if shard[0] == "user":
+            user_id = shard[1]
+            users = data["users"]
+            if user_id not in users:
+                return self._remove_shard(shard, self._user_path(user_id))
+            record = users.loaded(user_id)
+            return record is not None and self._write_shard(shard, self._user_path(user_id), record)
+        owner_id, project_name = shard[1], shard[2]
+        path = self._project_path(owner_id, project_name)
+        projects = data["projects"].loaded(owner_id)
+        if projects is None:
+            return False
+        if project_name not in projects:
+            return self._remove_shard(shard, path)
+        record = projects.loaded(project_name)
+        return record is not None and self._write_shard(shard, path, record)
+
+    def flush(self, data):
+        dirty = self.take_dirty()
+        wrote = False
+        remaining = list(dirty)
+        try:
+            while remaining:
+                wrote = self._flush_shard(data, remaining[-1]) or wrote
+                remaining.pop()
+            shared_folders, usernames = data["shared_folders"], data["usernames"]
+            if shared_folders.dirty or usernames.dirty:
+                # index.json пишется целиком, поэтому список изменённых ключей не нужен
+                shared_folders.take_changes()
+                usernames.take_changes()
+                try:
+                    self._write_index(shared_folders.to_dict(), usernames.to_dict())
+                except Exception:
+                    shared_folders.dirty = True
+                    raise
+                wrote = True
+            for name in self.JOURNALS:
+                wrote = self._flush_journal(name, data[name]) or wrote
+        except Exception:
+            # Незаписанные шарды вернутся в следующий сброс
+            self.return_dirty(remaining)
+            raise
+        return wrote
+
+    def _write_index(self, shared_folders, usernames):
+        atomic_write(self.index_path, dump_data({"shared_folders": shared_folders, "usernames": usernames}))
+
+    # Миграция
+
+    def migrate(self, data):
+        """Разово раскладывает монолитный data.json по шардам."""
+        if self.normalize_data:
+            data = self.normalize_data(data)
+        for user_id, user_data in data.get("users", {}).items():
+            self._write_shard(("user", user_id), self._user_path(user_id), user_data)
+        for owner_id, projects in data.get("projects", {}).items():
+            for project_name, project_data in projects.items():
+                self._write_shard(("project", owner_id, project_name),
+                                  self._project_path(owner_id, project_name), project_data)
+        for name in self.JOURNALS:
+            self._compact_journal(name, data.get(name, {}))
+        # index.json пишется последним: его наличие означает, что миграция завершена
+        self._write_index(data.get("shared_folders", {}), data.get("usernames", {}))
+        logger.info(f"Данные из {self.legacy_path} перенесены в шардированное хранилище {self.directory}.")
+
+
+def create_backend(kind, data_file, data_dir=None, sqlite_path=None, normalize_data=None,
+                   normalize_user=None, normalize_project=None):
+    if kind == "json":
+        return JsonFileBackend(data_file, normalize_data=normalize_data)
+    if kind == "sharded":
+        return ShardedJsonBackend(data_dir, legacy_path=data_file, normalize_data=normalize_data,
+                                  normalize_user=normalize_user, normalize_project=normalize_project)
+    if kind == "sqlite":
+        from utils.sqlite_storage import SqliteBackend
+        return SqliteBackend(sqlite_path, legacy_path=data_file, normalize_data=normalize_data,
+                             normalize_user=normalize_user, normalize_project=normalize_project)
+    raise ValueError(f"Неизвестный тип хранилища: {kind}")
@@ -0,0 +1,88 @@
+# utils/stored_files.py
+import hashlib
+import threading
+
+# Дедупликация файлов в DATA_CHAT_ID:
+#   data["stored_files"][ключ] = {"message_id", "file_id", "refs"}
+# Ключ — "u:<file_unique_id>" для присланных пользователем вложений (Telegram
+# выдаёт один file_unique_id одному и тому же файлу, кто бы его ни переслал)
+# или "h:<хеш содержимого>" для файлов, которые бот отправляет сам (импорт).
+# Перед копированием в чат хранения файл ищется по ключу: уже сохранённый
+# файл не копируется повторно, новая запись ссылается на тот же message_id.
+# Ключ хранится в записи файла ("storage_key") и попадает в объекты проекта.
+#
+# refs — число держателей сообщения:
+#   - записи файлов в структурах пользователей (вне проектов): +1 при
+#     добавлении, -1 при замене одноимённым файлом;
+#   - объекты blob в хранилищах проектов: +1 при создании объекта
+#     (файл, положенный в рабочую копию, сразу записывается объектом), -1 при
+#     удалении недостижимых объектов. Один объект общий для всех коммитов и
+#     веток, где файл не менялся, поэтому ветвление и коммиты счётчик не растят.
+# Сообщение с refs == 0 больше ни на что не ссылается.
+# Записи таблицы только заменяются целиком: хранилища (sharded, sqlite) видят
+# изменение общего индекса по присваиванию.
+
+_lock = threading.Lock()  # Счётчики общих файлов меняют обработчики разных пользователей
+
+
+def upload_key(message):
+    """Ключ дедупликации вложения сообщения или None."""
+    if message.content_type == 'photo':
+        attachment = message.photo[-1]
+    else:
+        attachment = getattr(message, message.content_type, None)
+    unique_id = getattr(attachment, "file_unique_id", None)
+    return f"u:{unique_id}" if unique_id else None
+
+
+def content_key(content):
+    return "h:" + hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def find_stored(data, key):
+    """Уже сохранённый в DATA_CHAT_ID файл: {"message_id", "file_id", "refs"} или None."""
+    if key is None:
+        return None
+    return data["stored_files"].get(key)
+
+
+def stored_fields(key, record):
+    """Поля записи файла, ссылающиеся на сохранённое сообщение record ({"message_id", "file_id"})."""
+    fields = {"message_id": record["message_id"], "file_id": record.get("file_id")}
+    if key is not None:
+        fields["storage_key"] = key
+    return fields
+
+
+def register_stored(data, entry):
+    """Учитывает запись файла, которая кладётся в структуру.
+
+    Для нового ключа заводится запись таблицы; если такой файл уже сохранён
+    другим сообщением (одновременная загрузка), запись переводится на него.
+    """
+    key = entry.get("storage_key")
+    if key is None:
+        return
+    stored = data["stored_files"]
+    with _lock:
+        record = stored.get(key)
+        if record is None:
+            stored[key] = {"message_id": entry["message_id"], "file_id": entry.get("file_id"), "refs": 0}
+            return
+    entry["message_id"] = record["message_id"]
+    if record.get("file_id"):
+        entry["file_id"] = record["file_id"]
+
+
+def add_refs(data, entries, count=1):
+    stored = data["stored_files"]
+    with _lock:
+        for entry in entries:
+            key = entry.get("storage_key")
+            record = stored.get(key) if key is not None else None
+            if record is not None:
+                stored[key] = dict(record, refs=max(0, record["refs"] + count))
+
+
+def release_refs(data, entries):
+    add_refs(data, entries, count=-1)
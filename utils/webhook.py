@@ -0,0 +1,129 @@
+# utils/webhook.py
+import json
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024  # Обновления Telegram заметно меньше
+RECENT_UPDATES = 1000  # Сколько последних update_id помнить для отсева повторов
+
+
+class WebhookServer:
+    """HTTP-сервер для приёма обновлений Telegram (только стандартная библиотека).
+
+    POST <path>  — обновление в JSON; передаётся в accept_update(update).
+                   Если accept_update вернул False (очередь заполнена),
+                   отвечаем 503, и Telegram повторит доставку позже.
+    GET /health  — состояние очереди в JSON (200, либо 503 при переполнении).
+
+    Повторно доставленные обновления с уже принятым update_id отбрасываются.
+    """
+
+    def __init__(self, host, port, path, accept_update, secret_token=None, health=None):
+        self.path = path
+        self.accept_update = accept_update
+        self.secret_token = secret_token
+        self.health = health
+        self._recent = deque()
+        self._recent_ids = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def _remember(self, update_id):
+        # False, если обновление уже принималось
+        with self._lock:
+            if update_id in self._recent_ids:
+                return False
+            self._recent.append(update_id)
+            self._recent_ids.add(update_id)
+            if len(self._recent) > RECENT_UPDATES:
+                self._recent_ids.discard(self._recent.popleft())
+            return True
+
+    def _forget(self, update_id):
+        with self._lock:
+            self._recent_ids.discard(update_id)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            server_version = "InfoBotWebhook"
+
+            def _reply(self, status, payload=None, headers=None):
+                body = json.dumps(payload or {}, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path != "/health":
+                    self._reply(404, {"error": "not found"})
+                    return
+                state = server.health() if server.health else {}
+                healthy = state.get("status", "ok") == "ok"
+                self._reply(200 if healthy else 503, state)
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404, {"error": "not found"})
+                    return
+                if server.secret_token and \
+                        self.headers.get("X-Telegram-Bot-Api-Secret-Token") != server.secret_token:
+                    self._reply(403, {"error": "forbidden"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0 or length > MAX_BODY_SIZE:
+                    self._reply(413, {"error": "bad length"})
+                    return
+                try:
+                    update = types.Update.de_json(self.rfile.read(length).decode('utf-8'))
+                except Exception as e:
+                    logger.warning(f"Некорректное обновление в вебхуке: {e}")
+                    self._reply(400, {"error": "bad update"})
+                    return
+                if update is None or not server._remember(update.update_id):
+                    self._reply(200)
+                    return
+                if not server.accept_update(update):
+                    server._forget(update.update_id)
+                    self._reply(503, {"error": "queue is full"}, headers={"Retry-After": "1"})
+                    return
+                self._reply(200)
+
+            def log_message(self, format, *args):
+                logger.debug("webhook: " + format % args)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+        logger.info(f"Вебхук слушает {self.address[0]}:{self.address[1]}{self.path}")
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        # httpd.shutdown() ждёт выхода из serve_forever, поэтому нужен только для start()
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread = None
+        self.httpd.server_close()
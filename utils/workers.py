@@ -0,0 +1,156 @@
+# utils/workers.py
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils.locks import user_lock
+from utils.data_manager import data_session
+
+logger = logging.getLogger(__name__)
+
+UPDATE_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+)
+
+
+def update_user_id(update):
+    """Ключ пользователя, которому адресовано обновление (id чата, как в обработчиках)."""
+    for field in UPDATE_FIELDS:
+        event = getattr(update, field, None)
+        if event is None:
+            continue
+        message = event if field in ("message", "edited_message") else getattr(event, "message", None)
+        if message is not None and getattr(message, "chat", None) is not None:
+            return str(message.chat.id)
+        from_user = getattr(event, "from_user", None)
+        if from_user is not None:
+            return str(from_user.id)
+    return None
+
+
+class UpdateWorkerPool:
+    """Пул потоков для обработки обновлений.
+
+    Обновления разных пользователей обрабатываются параллельно, одного
+    пользователя — строго по очереди в порядке поступления. Очередь
+    пользователя не занимает поток надолго: после каждого обновления
+    продолжение снова ставится в общий пул.
+
+    Число принятых, но ещё не обработанных обновлений ограничено max_pending:
+    при переполнении submit() ждёт освобождения места (long polling просто
+    притормаживает) или, если задан timeout, отказывает (вебхук отвечает 503).
+    """
+
+    def __init__(self, workers, max_pending=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="update-worker")
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._process = None
+        self._slots = threading.BoundedSemaphore(max_pending) if max_pending else None
+        self._pending = 0
+        self.processed = 0
+
+    def install(self, bot):
+        """Перехватывает bot.process_new_updates: обновления уходят в пул."""
+        self._process = bot.process_new_updates
+
+        def process_new_updates(updates):
+            if not updates:
+                return
+            # Смещение для getUpdates сдвигаем сразу, не дожидаясь обработки
+            bot.last_update_id = max(bot.last_update_id, max(update.update_id for update in updates))
+            for update in updates:
+                self.submit(update)
+
+        bot.process_new_updates = process_new_updates
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def stats(self):
+        overloaded = self.max_pending is not None and self._pending >= self.max_pending
+        return {
+            "status": "overloaded" if overloaded else "ok",
+            "pending": self._pending,
+            "capacity": self.max_pending,
+            "workers": self.workers,
+            "processed": self.processed,
+        }
+
+    def submit(self, update, timeout=None):
+        """Принимает обновление в обработку; False — очередь заполнена дольше timeout."""
+        if self._slots is not None and not self._slots.acquire(timeout=timeout):
+            return False
+        key = update_user_id(update)
+        with self._lock:
+            self._pending += 1
+            if key is not None:
+                queue = self._queues.get(key)
+                if queue is not None:
+                    queue.append(update)
+                    return True
+                self._queues[key] = deque([update])
+        if key is None:
+            self._executor.submit(self._run, None, update)
+        else:
+            self._executor.submit(self._drain, key)
+        return True
+
+    def _drain(self, key):
+        with self._lock:
+            update = self._queues[key][0]
+        self._run(key, update)
+        with self._lock:
+            queue = self._queues[key]
+            queue.popleft()
+            if not queue:
+                del self._queues[key]
+                return
+        self._executor.submit(self._drain, key)
+
+    def _run(self, key, update):
+        try:
+            if key is None:
+                with data_session():
+                    self._process([update])
+            else:
+                with user_lock(key), data_session():
+                    self._process([update])
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.processed += 1
+            if self._slots is not None:
+                self._slots.release()
+
+    def shutdown(self):
+        """Дожидается обработки уже принятых обновлений."""
+        if self._pending:
+            logger.info(f"Ожидание обработки {self._pending} обновлений...")
+        while True:
+            with self._lock:
+                if not self._pending:
+                    break
+            time.sleep(0.1)
+        self._executor.shutdown(wait=True)
+
+
+def _in_session(task, *args, **kwargs):
+    with data_session():
+        return task(*args, **kwargs)
+
+
+def install_data_sessions(bot):
+    """Встроенный пул telebot (WORKER_THREADS = 0): каждый обработчик — внутри data_session()."""
+    exec_task = bot._exec_task
+
+    def _exec_task(task, *args, **kwargs):
+        exec_task(_in_session, task, *args, **kwargs)
+
+    bot._exec_task = _exec_task